@@ -10,6 +10,11 @@ from .models import (
     FornecedorValor,
     FornecedorResidente,
     Orcamento_limite,
+    ResumoMensal,
+    ChaveMedidor,
+    AlertaOrcamento,
+    PrevisaoCusto,
+    AnomaliaLeitura,
 )
 
 #Apenas o administrador consegue ver e gerir
@@ -56,4 +61,74 @@ class FornecedorResidenteAdmin(admin.ModelAdmin):
 
 @admin.register(Orcamento_limite)
 class OrcamentoLimiteAdmin(admin.ModelAdmin):
-    list_display = ("residente", "tipo", "valor", "timestamp")
\ No newline at end of file
+    list_display = ("residente", "tipo", "valor", "timestamp")
+
+
+@admin.register(ResumoMensal)
+class ResumoMensalAdmin(admin.ModelAdmin):
+    list_display = ("residente", "tipo", "categoria", "ano", "mes", "total", "registos")
+    list_filter = ("tipo", "categoria", "ano")
+
+
+# As chaves são criadas com o comando criar_chave_medidor (aqui só se consultam e revogam)
+@admin.register(ChaveMedidor)
+class ChaveMedidorAdmin(admin.ModelAdmin):
+    list_display = ("nome", "residente", "status", "timestamp", "ultimo_uso")
+    list_filter = ("status",)
+    readonly_fields = ("chave_hash", "timestamp", "ultimo_uso")
+
+    def has_add_permission(self, request):
+        return False
+
+
+# Gerados pelo comando avaliar_orcamentos e pelo dashboard (só leitura)
+@admin.register(AlertaOrcamento)
+class AlertaOrcamentoAdmin(admin.ModelAdmin):
+    list_display = ("residente", "ano", "mes", "custo", "meta", "estado", "avaliado_em")
+    list_filter = ("estado", "ano", "mes")
+    search_fields = ("residente__nome", "residente__email")
+    list_select_related = ("residente",)
+    readonly_fields = ("residente", "ano", "mes", "custo", "meta", "estado", "avaliado_em")
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(PrevisaoCusto)
+class PrevisaoCustoAdmin(admin.ModelAdmin):
+    list_display = ("residente", "tipo", "ano", "mes", "consumo", "custo", "meses_historico", "calculado_em")
+    list_filter = ("tipo", "ano", "mes")
+    search_fields = ("residente__nome", "residente__email")
+    list_select_related = ("residente", "tipo")
+    readonly_fields = ("residente", "tipo", "ano", "mes", "consumo", "custo", "meses_historico", "calculado_em")
+
+    def has_add_permission(self, request):
+        return False
+
+# Leituras sinalizadas (detetar_anomalias / registo manual); apagar a linha retira a sinalização
+@admin.register(AnomaliaLeitura)
+class AnomaliaLeituraAdmin(admin.ModelAdmin):
+    list_display = ("residente", "dispositivo", "data", "valor", "valor_habitual", "pontuacao", "detetada_em")
+    list_filter = ("registo__dispositivo__tipo", "detetada_em")
+    search_fields = ("registo__dispositivo__residente__nome", "registo__dispositivo__residente__email", "registo__dispositivo__nome")
+    list_select_related = ("registo__dispositivo__residente",)
+    ordering = ("-detetada_em", "-pontuacao")
+    readonly_fields = ("registo", "pontuacao", "valor_habitual", "detetada_em")
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description="Residente", ordering="registo__dispositivo__residente__nome")
+    def residente(self, obj):
+        return obj.registo.dispositivo.residente
+
+    @admin.display(description="Dispositivo", ordering="registo__dispositivo__nome")
+    def dispositivo(self, obj):
+        return obj.registo.dispositivo.nome
+
+    @admin.display(description="Data", ordering="registo__timestamp")
+    def data(self, obj):
+        return obj.registo.timestamp.strftime("%m/%Y")
+
+    @admin.display(description="Valor", ordering="registo__valor")
+    def valor(self, obj):
+        return obj.registo.valor
@@ -0,0 +1,153 @@
+import csv
+import io
+
+from django.core.cache import caches
+from django.db.models import Count, FloatField, Max, Q, Sum
+from django.db.models.functions import Cast
+
+from . import cache_paginas
+from .models import Residente, ResumoMensal, Tipo, Categoria
+from .periodos import filtro_meses, instante_do_mes
+from .tarifas import LinhaTemporalTarifas, PRECO_POR_OMISSAO
+
+# Colunas pelas quais se pode agrupar: nome -> rótulo
+AGRUPAMENTOS = {
+    'cidade': 'Cidade',
+    'codigo_postal': 'Código postal',
+    'tipo': 'Tipo',
+    'categoria': 'Categoria',
+    'mes': 'Mês',
+}
+# O tipo entra sempre no agrupamento: kWh e m³ não se somam
+OBRIGATORIOS = ('tipo',)
+SEM_VALOR = '—'
+# Linhas mostradas na página (o CSV tem sempre todas)
+LINHAS_NO_ECRA = 500
+
+
+# Muda com qualquer escrita que afete um residente (ver versoes.py) e quando se apagam residentes
+def _versao():
+    dados = Residente.objects.aggregate(alteracao=Max('dados_atualizados_em'), total=Count('pk'))
+    return f"{dados['alteracao'].timestamp() if dados['alteracao'] else 0}-{dados['total']}"
+
+
+# Colunas do resumo correspondentes a cada agrupamento
+CAMPOS = {
+    'cidade': 'residente__cidade',
+    'codigo_postal': 'residente__codigo_postal',
+    'tipo': 'tipo__tipo',
+    'categoria': 'categoria__categoria',
+    'mes': ('ano', 'mes'),
+}
+
+
+def _campos(agrupar):
+    campos = []
+    for nome in agrupar:
+        campos += CAMPOS[nome] if isinstance(CAMPOS[nome], tuple) else [CAMPOS[nome]]
+    return campos
+
+
+def _calcular(agrupar, desde, ate):
+    # O resumo mensal já agregou os registos de consumo: as somas são GROUP BY sobre ele
+    resumo = ResumoMensal.objects.filter(filtro_meses(
+        (desde.year, desde.month) if desde else None, (ate.year, ate.month) if ate else None
+    )).order_by()
+    campos = _campos(agrupar)
+    gerador = Q(categoria_id__in=Categoria.objects.filter(categoria='Gerador').values_list('pk', flat=True))
+    somas = {
+        'consumo': Cast(Sum('total', filter=~gerador), FloatField()),
+        'producao': Cast(Sum('total', filter=gerador), FloatField()),
+    }
+
+    grupos = {}
+    for linha in resumo.values(*campos).annotate(
+        **somas, registos=Sum('registos'), residentes=Count('residente', distinct=True)
+    ):
+        grupos[tuple(linha[campo] or SEM_VALOR for campo in campos)] = {
+            'consumo': linha['consumo'] or 0.0,
+            'producao': linha['producao'] or 0.0,
+            'custo': 0.0,
+            'registos': linha['registos'],
+            'residentes': linha['residentes'],
+        }
+
+    # Custo: consumo líquido de cada residente/tipo/mês (a produção desconta na luz) à tarifa do contrato da altura
+    tarifas = LinhaTemporalTarifas.carregar()
+    tipos = dict(Tipo.objects.values_list('pk', 'tipo'))
+    locais = {pk: {'residente__cidade': cidade, 'residente__codigo_postal': codigo_postal}
+              for pk, cidade, codigo_postal in Residente.objects.values_list('pk', 'cidade', 'codigo_postal')}
+    # Com a categoria no agrupamento, o custo fica no grupo do consumidor (a produção não tem custo)
+    valores = {'categoria__categoria': 'Consumidor'}
+    # Instantes e tarifas repetem-se muito (poucos meses e serviços): calculados uma vez
+    instantes = {}
+    precos = {}
+    for residente_id, tipo_id, ano, mes, consumo, producao in resumo.values_list(
+        'residente_id', 'tipo_id', 'ano', 'mes'
+    ).annotate(**somas).values_list('residente_id', 'tipo_id', 'ano', 'mes', 'consumo', 'producao'):
+        tipo_nome = tipos[tipo_id]
+        consumo = consumo or 0.0
+        if tipo_nome == 'Luz':
+            consumo = max(0.0, consumo - (producao or 0.0))
+        if not consumo:
+            continue
+        instante = instantes.get((ano, mes))
+        if instante is None:
+            instante = instantes[(ano, mes)] = instante_do_mes(ano, mes)
+        fornecedor_tipo_id = tarifas.contrato_em(residente_id, tipo_nome, instante)
+        preco = precos.get((fornecedor_tipo_id, instante))
+        if preco is None:
+            preco = precos[(fornecedor_tipo_id, instante)] = (
+                tarifas.preco_em(fornecedor_tipo_id, instante) if fornecedor_tipo_id else PRECO_POR_OMISSAO
+            )
+        valores.update(locais[residente_id], tipo__tipo=tipo_nome, ano=ano, mes=mes)
+        grupos[tuple(valores[campo] or SEM_VALOR for campo in campos)]['custo'] += consumo * preco
+
+    return [
+        {
+            'chave': _rotulos(agrupar, chave),
+            'consumo': round(grupo['consumo'], 2),
+            'producao': round(grupo['producao'], 2),
+            'custo': round(grupo['custo'], 2),
+            'registos': grupo['registos'],
+            'residentes': grupo['residentes'],
+        }
+        for chave, grupo in sorted(grupos.items())
+    ]
+
+
+# Valores de uma chave para mostrar: o mês (ano, mes) fica "AAAA-MM"
+def _rotulos(agrupar, chave):
+    rotulos = []
+    posicao = 0
+    for nome in agrupar:
+        if nome == 'mes':
+            rotulos.append(f'{chave[posicao]}-{chave[posicao + 1]:02d}')
+            posicao += 2
+        else:
+            rotulos.append(chave[posicao])
+            posicao += 1
+    return tuple(rotulos)
+
+
+# Consumo, produção e custo de todos os residentes agrupados pelas colunas pedidas (ver AGRUPAMENTOS)
+def agregar(agrupar=('cidade', 'mes'), desde=None, ate=None):
+    agrupar = [nome for nome in AGRUPAMENTOS if nome in agrupar or nome in OBRIGATORIOS]
+    chave = f"analise:{_versao()}:{','.join(agrupar)}:{desde or ''}:{ate or ''}"
+    cache = caches[cache_paginas.CACHE_ALIAS]
+    linhas = cache.get(chave)
+    if linhas is None:
+        linhas = _calcular(agrupar, desde, ate)
+        cache.set(chave, linhas, cache_paginas.TEMPO_EXPIRACAO)
+    return agrupar, linhas
+
+
+def em_csv(agrupar, linhas):
+    saida = io.StringIO()
+    escritor = csv.writer(saida)
+    escritor.writerow([AGRUPAMENTOS[nome] for nome in agrupar] + ['Consumo', 'Produção', 'Custo (€)', 'Registos', 'Residentes'])
+    for linha in linhas:
+        escritor.writerow(list(linha['chave']) + [
+            linha['consumo'], linha['producao'], linha['custo'], linha['registos'], linha['residentes']
+        ])
+    return saida.getvalue()
@@ -0,0 +1,102 @@
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .models import AnomaliaLeitura, RegistoConsumo
+
+# Z-score robusto a partir do qual uma leitura é suspeita (Iglewicz e Hoaglin)
+LIMIAR = 3.5
+# Leituras do dispositivo (além da avaliada) necessárias para haver termo de comparação
+MINIMO_HISTORICO = 6
+# Escala mínima em fração da mediana: séries quase constantes não sinalizam variações normais
+ESCALA_MINIMA = 0.1
+# Converte o MAD no desvio padrão de uma distribuição normal
+FATOR_MAD = 1.4826
+LEITURAS_POR_LOTE = 20000
+TAMANHO_LOTE = 1000
+
+
+def _escala(mediana, mad):
+    return np.maximum(np.maximum(FATOR_MAD * mad, ESCALA_MINIMA * np.abs(mediana)), 0.01)
+
+
+# Mediana de cada grupo (grupos = índices 0..G-1, todos com pelo menos um valor) sem ciclos em Python
+def _medianas(grupos, valores, total_grupos):
+    ordem = np.lexsort((valores, grupos))
+    ordenados = valores[ordem]
+    contagem = np.bincount(grupos, minlength=total_grupos)
+    inicio = np.concatenate(([0], np.cumsum(contagem)[:-1]))
+    return (ordenados[inicio + (contagem - 1) // 2] + ordenados[inicio + contagem // 2]) / 2
+
+
+# Pontua todas as leituras de uma vez contra o histórico do respetivo dispositivo.
+# Devolve (pontuações, medianas por leitura); NaN nos dispositivos com poucas leituras.
+def pontuar(dispositivos, valores):
+    codigos, grupos = np.unique(dispositivos, return_inverse=True)
+    mediana = _medianas(grupos, valores, len(codigos))[grupos]
+    mad = _medianas(grupos, np.abs(valores - mediana), len(codigos))[grupos]
+    pontuacoes = (valores - mediana) / _escala(mediana, mad)
+    suficientes = np.bincount(grupos, minlength=len(codigos))[grupos] > MINIMO_HISTORICO
+    return np.where(suficientes, pontuacoes, np.nan), mediana
+
+
+def _carregar(dispositivo_ids):
+    registos = RegistoConsumo.objects.order_by()
+    if dispositivo_ids is not None:
+        registos = registos.filter(dispositivo_id__in=dispositivo_ids)
+    # Conversão para float na base de dados: evita criar um Decimal por linha
+    linhas = registos.values_list('pk', 'dispositivo_id', Cast('valor', FloatField())).iterator(
+        chunk_size=LEITURAS_POR_LOTE
+    )
+    dados = np.fromiter(linhas, dtype=[('pk', np.int64), ('dispositivo', np.int64), ('valor', np.float64)])
+    return dados['pk'], dados['dispositivo'], dados['valor']
+
+
+# Analisa as leituras de todos os dispositivos (ou só dos indicados) e substitui as anomalias gravadas.
+# Devolve (leituras analisadas, leituras sinalizadas).
+def analisar(dispositivo_ids=None, limiar=LIMIAR):
+    pks, dispositivos, valores = _carregar(dispositivo_ids)
+    anomalias = []
+    if len(pks):
+        pontuacoes, medianas = pontuar(dispositivos, valores)
+        agora = timezone.now()
+        for posicao in np.flatnonzero(np.abs(np.nan_to_num(pontuacoes)) > limiar):
+            anomalias.append(AnomaliaLeitura(
+                registo_id=int(pks[posicao]), pontuacao=round(float(pontuacoes[posicao]), 2),
+                valor_habitual=Decimal(str(round(float(medianas[posicao]), 2))), detetada_em=agora,
+            ))
+
+    antigas = AnomaliaLeitura.objects.all()
+    if dispositivo_ids is not None:
+        antigas = antigas.filter(registo__dispositivo_id__in=dispositivo_ids)
+    with transaction.atomic():
+        antigas.delete()
+        AnomaliaLeitura.objects.bulk_create(anomalias, batch_size=TAMANHO_LOTE)
+    return len(pks), len(anomalias)
+
+
+# Verificação no registo e na edição manual: compara a leitura com as restantes do dispositivo.
+# Grava (ou atualiza) e devolve a anomalia se a leitura for suspeita; senão retira a sinalização e devolve None.
+def verificar(registo, limiar=LIMIAR):
+    historico = np.array(
+        RegistoConsumo.objects.filter(dispositivo_id=registo.dispositivo_id).exclude(pk=registo.pk)
+        .values_list(Cast('valor', FloatField()), flat=True)
+    )
+    pontuacao = None
+    if len(historico) >= MINIMO_HISTORICO:
+        mediana = float(np.median(historico))
+        mad = float(np.median(np.abs(historico - mediana)))
+        pontuacao = (float(registo.valor) - mediana) / float(_escala(mediana, mad))
+    if pontuacao is None or abs(pontuacao) <= limiar:
+        AnomaliaLeitura.objects.filter(registo=registo).delete()
+        return None
+    anomalia, _ = AnomaliaLeitura.objects.update_or_create(registo=registo, defaults={
+        'pontuacao': round(pontuacao, 2),
+        'valor_habitual': Decimal(str(round(mediana, 2))),
+        'detetada_em': timezone.now(),
+    })
+    return anomalia
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class GestãoConsumosConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Gestao_Consumos'
+
+    def ready(self):
+        # Liga os sinais (resumo mensal, caches e relatórios PDF gerados)
+        from . import signals  # noqa: F401
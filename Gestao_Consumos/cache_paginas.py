@@ -0,0 +1,53 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Alias do cache (settings.CACHES); locmem nos testes, partilhado (ficheiros/Redis) em produção
+CACHE_ALIAS = getattr(settings, 'PAGINAS_CACHE_ALIAS', 'default')
+# A versão na chave já invalida as entradas antigas; a expiração só limita o espaço ocupado
+TEMPO_EXPIRACAO = 60 * 60 * 6
+
+_contadores = {'hits': 0, 'misses': 0}
+_lock = threading.Lock()
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _contar(resultado):
+    with _lock:
+        _contadores[resultado] += 1
+
+
+# A versão dos dados do residente (Residente.dados_atualizados_em) muda em qualquer escrita que afete as
+# suas páginas (registos, metas, dispositivos, contratos, tarifas: ver signals.py), por isso nunca é preciso apagar
+def _chave(residente, nome, partes):
+    versao = residente.dados_atualizados_em.timestamp() if residente.dados_atualizados_em else 0
+    return f"paginas:{residente.pk}:{versao}:{nome}:{':'.join(str(parte) for parte in partes)}"
+
+
+# Valor calculado de uma página (ex.: dashboard de um mês), reutilizado enquanto os dados não mudarem
+def obter(residente, nome, calcular, *partes):
+    cache = _cache()
+    chave = _chave(residente, nome, partes)
+    valor = cache.get(chave)
+    if valor is not None:
+        _contar('hits')
+        return valor
+    _contar('misses')
+    valor = calcular()
+    cache.set(chave, valor, TEMPO_EXPIRACAO)
+    return valor
+
+
+def estatisticas():
+    with _lock:
+        hits, misses = _contadores['hits'], _contadores['misses']
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
@@ -0,0 +1,132 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import OuterRef, Prefetch, Subquery
+
+from .models import Fornecedor, FornecedorResidente, FornecedorValor, FornecedorTipo
+from .tarifas import LinhaTemporalTarifas, PRECO_POR_OMISSAO
+
+# Alias do cache (settings.CACHES); por omissão o 'default', em memória local
+CACHE_ALIAS = getattr(settings, 'TARIFAS_CACHE_ALIAS', 'default')
+# As tarifas mudam poucas vezes por ano: a invalidação é feita pelos sinais
+TEMPO_EXPIRACAO = 60 * 60 * 24
+
+_CHAVE_VERSAO = 'tarifas:versao'
+
+_contadores = {'hits': 0, 'misses': 0}
+_lock = threading.Lock()
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _contar(resultado):
+    with _lock:
+        _contadores[resultado] += 1
+
+
+# Versão global: ao mudar uma tarifa/serviço todas as chaves antigas deixam de ser usadas
+def _versao():
+    cache = _cache()
+    versao = cache.get(_CHAVE_VERSAO)
+    if versao is None:
+        cache.add(_CHAVE_VERSAO, 1, None)
+        versao = cache.get(_CHAVE_VERSAO, 1)
+    return versao
+
+
+def _chave(nome):
+    return f'tarifas:{_versao()}:{nome}'
+
+
+def _obter(nome, calcular):
+    cache = _cache()
+    chave = _chave(nome)
+    valor = cache.get(chave)
+    if valor is not None:
+        _contar('hits')
+        return valor
+    _contar('misses')
+    valor = calcular()
+    cache.set(chave, valor, TEMPO_EXPIRACAO)
+    return valor
+
+
+# Subquery com a tarifa mais recente de um serviço (para anotar querysets de FornecedorTipo)
+def _ultima_tarifa():
+    return FornecedorValor.objects.filter(
+        fornecedor_tipo=OuterRef('pk')
+    ).order_by('-timestamp', '-pk').values('valor')[:1]
+
+
+# Catálogo de fornecedores ativos com os serviços ativos e a tarifa atual (2 queries, qualquer que seja o número)
+# [{'info': {'id', 'nome'}, 'servicos': [{'servico_tipo', 'tarifa_valor', 'unidade', 'fornecedor_tipo_pk'}]}]
+def catalogo():
+    def calcular():
+        servicos = FornecedorTipo.objects.filter(status=1).select_related('tipo').annotate(
+            preco=Subquery(_ultima_tarifa())
+        ).order_by('pk')
+        fornecedores = Fornecedor.objects.filter(status=1).order_by('pk').prefetch_related(
+            Prefetch('fornecedortipo_set', queryset=servicos, to_attr='servicos_ativos')
+        )
+        dados = []
+        for fornecedor in fornecedores:
+            servicos_data = [{
+                'servico_tipo': servico.tipo.tipo,
+                'tarifa_valor': float(servico.preco) if servico.preco is not None else PRECO_POR_OMISSAO,
+                'unidade': servico.unidade,
+                'fornecedor_tipo_pk': servico.pk,
+            } for servico in fornecedor.servicos_ativos]
+            if servicos_data:
+                dados.append({'info': {'id': fornecedor.pk, 'nome': fornecedor.nome}, 'servicos': servicos_data})
+        return dados
+    return _obter('catalogo', calcular)
+
+
+# Contratos ativos de um residente: {tipo: {'fornecedor_tipo': id, 'fornecedor': id}}
+def contratos_ativos(residente_id):
+    def calcular():
+        contratos = {}
+        linhas = FornecedorResidente.objects.filter(residente_id=residente_id, status=1).order_by(
+            '-timestamp'
+        ).values_list('fornecedor_tipo__tipo__tipo', 'fornecedor_tipo_id', 'fornecedor_tipo__fornecedor_id')
+        for tipo_nome, fornecedor_tipo_id, fornecedor_id in linhas:
+            contratos.setdefault(tipo_nome, {'fornecedor_tipo': fornecedor_tipo_id, 'fornecedor': fornecedor_id})
+        return contratos
+    return _obter(f'contratos:{residente_id}', calcular)
+
+
+# Histórico de tarifas/contratos de um residente (ver tarifas.py)
+def linha_temporal(residente):
+    def calcular():
+        indice = LinhaTemporalTarifas.carregar([residente])
+        return {'tarifas': indice.tarifas, 'contratos': indice.contratos}
+    dados = _obter(f'linha:{residente.pk}', calcular)
+    return LinhaTemporalTarifas(dados['tarifas'], dados['contratos'])
+
+
+# Chamado quando muda uma tarifa, um serviço ou um fornecedor: invalida tudo
+def invalidar_tarifas():
+    cache = _cache()
+    try:
+        cache.incr(_CHAVE_VERSAO)
+    except ValueError:
+        cache.set(_CHAVE_VERSAO, 2, None)
+
+
+# Chamado quando mudam os contratos de um residente
+def invalidar_contratos(residente_id):
+    _cache().delete_many([_chave(f'contratos:{residente_id}'), _chave(f'linha:{residente_id}')])
+
+
+def estatisticas():
+    with _lock:
+        hits, misses = _contadores['hits'], _contadores['misses']
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
@@ -0,0 +1,80 @@
+from django.db.models import Sum
+
+from .models import ResumoMensal
+from . import cache_tarifas
+from .tarifas import TIPOS
+
+
+# Soma dos consumos de um mês agrupada por (tipo, categoria), lida do resumo mensal
+def agregar_consumos(residente, ano, mes):
+    linhas = ResumoMensal.objects.filter(
+        residente=residente,
+        ano=ano,
+        mes=mes
+    ).order_by().values('tipo__tipo', 'categoria__categoria').annotate(total=Sum('total'))
+
+    return {
+        (linha['tipo__tipo'], linha['categoria__categoria']): float(linha['total'] or 0)
+        for linha in linhas
+    }
+
+
+# Somas de um ano inteiro agrupadas por mês x tipo x categoria (no máximo 12x3x2 linhas do resumo)
+def agregar_consumos_anuais(residente, ano):
+    linhas = ResumoMensal.objects.filter(
+        residente=residente,
+        ano=ano
+    ).order_by().values('mes', 'tipo__tipo', 'categoria__categoria').annotate(total=Sum('total'))
+
+    somas_por_mes = {mes: {} for mes in range(1, 13)}
+    for linha in linhas:
+        chave = (linha['tipo__tipo'], linha['categoria__categoria'])
+        somas_por_mes[linha['mes']][chave] = float(linha['total'] or 0)
+    return somas_por_mes
+
+
+# Consumo líquido por tipo: na luz desconta-se a produção (nunca negativo)
+def consumos_liquidos(somas):
+    consumos = {}
+    for tipo_nome in TIPOS:
+        consumo = somas.get((tipo_nome, 'Consumidor'), 0.0)
+        if tipo_nome == 'Luz':
+            consumo = max(0, consumo - somas.get((tipo_nome, 'Gerador'), 0.0))
+        consumos[tipo_nome] = consumo
+    return consumos
+
+
+# Custos (consumo * preço por unidade) a partir dos consumos líquidos
+def custos_de(consumos, precos):
+    return {tipo_nome: round(consumos[tipo_nome] * precos[tipo_nome], 2) for tipo_nome in TIPOS}
+
+
+# Consumos líquidos e custos de um residente num mês, com as tarifas em vigor nesse mês
+def calcular_custos(residente, ano, mes, tarifas=None):
+    if tarifas is None:
+        tarifas = cache_tarifas.linha_temporal(residente)
+    consumos = consumos_liquidos(agregar_consumos(residente, ano, mes))
+    custos = custos_de(consumos, tarifas.precos_do_mes(residente.pk, ano, mes))
+    return {
+        'consumos': consumos,
+        'custos': custos,
+        'custo_total': round(sum(custos.values()), 2),
+    }
+
+
+# Série de 12 meses (índice 0 = janeiro); cada mês é valorizado à tarifa da altura
+def calcular_serie_anual(residente, ano, tarifas=None):
+    if tarifas is None:
+        tarifas = cache_tarifas.linha_temporal(residente)
+    precos_por_mes = tarifas.precos_do_ano(residente.pk, ano)
+    serie = []
+    for mes, somas in sorted(agregar_consumos_anuais(residente, ano).items()):
+        consumos = consumos_liquidos(somas)
+        custos = custos_de(consumos, precos_por_mes[mes])
+        serie.append({
+            'mes': mes,
+            'consumos': consumos,
+            'custos': custos,
+            'custo_total': round(sum(custos.values()), 2),
+        })
+    return serie
@@ -0,0 +1,180 @@
+import datetime
+import math
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, models, transaction
+
+from . import resumo
+from .models import (
+    Residente, Tipo, Categoria, Dispositivo, RegistoConsumo, Fornecedor,
+    FornecedorTipo, FornecedorValor, FornecedorResidente, Orcamento_limite
+)
+from .periodos import instante_do_mes
+
+TAMANHO_LOTE = 5000
+DOMINIO_EMAIL = 'sintetico.pt'
+CIDADES = ('Porto', 'Lisboa', 'Braga', 'Coimbra', 'Aveiro', 'Faro', 'Viseu', 'Évora')
+UNIDADES = {'Luz': 'kWh', 'Agua': 'm3', 'Gas': 'm3'}
+
+# Consumo mensal médio e amplitude sazonal por tipo (o inverno gasta mais luz e gás)
+PERFIS = {
+    'Luz': (220, 0.25),
+    'Agua': (12, -0.15),
+    'Gas': (35, 0.45),
+}
+# Produção solar: máxima no verão
+PERFIL_GERADOR = (160, -0.5)
+# Tarifa inicial por tipo (€/unidade)
+TARIFAS_BASE = {'Luz': 0.16, 'Agua': 1.10, 'Gas': 0.09}
+
+
+# bulk_create que devolve os objetos com id (o MySQL não devolve ids num INSERT em lote: grava um a um)
+def _criar(modelo, objetos):
+    if connection.features.can_return_rows_from_bulk_insert:
+        return modelo.objects.bulk_create(objetos, batch_size=TAMANHO_LOTE)
+    for objeto in objetos:
+        models.Model.save(objeto)
+    return objetos
+
+
+def _valor_mensal(aleatorio, perfil, mes, escala):
+    media, amplitude = perfil
+    sazonal = 1 + amplitude * math.cos((mes - 1) / 12 * 2 * math.pi)
+    return Decimal(str(round(max(media * escala * sazonal * aleatorio.uniform(0.85, 1.15), 0), 2)))
+
+
+# Gera um conjunto de dados realista e reprodutível (a mesma semente gera sempre os mesmos dados)
+def gerar(residentes=10, dispositivos=4, anos=2, fornecedores=3, semente=1, ano_final=None, password='sintetico'):
+    aleatorio = random.Random(semente)
+    ano_final = ano_final or datetime.date.today().year
+    lista_anos = list(range(ano_final - anos + 1, ano_final + 1))
+    meses = [(ano, mes) for ano in lista_anos for mes in range(1, 13)]
+
+    with transaction.atomic(), resumo.suspenso():
+        tipos = {nome: Tipo.objects.get_or_create(tipo=nome)[0] for nome in UNIDADES}
+        categorias = {
+            nome: Categoria.objects.get_or_create(categoria=nome, defaults={'status': 1})[0]
+            for nome in ('Consumidor', 'Gerador')
+        }
+
+        # Fornecedores e serviços: cada tipo tem pelo menos um fornecedor
+        inicio = Fornecedor.objects.count()
+        novos_fornecedores = _criar(Fornecedor, [
+            Fornecedor(nome=f'Fornecedor Sintético {inicio + f + 1}', nif=f'5{inicio + f:08d}', status=1)
+            for f in range(fornecedores)
+        ])
+        servicos = []
+        for f, fornecedor in enumerate(novos_fornecedores):
+            nomes = [nome for i, nome in enumerate(UNIDADES) if i == f % 3 or aleatorio.random() < 0.5]
+            servicos += [
+                FornecedorTipo(fornecedor=fornecedor, tipo=tipos[nome], unidade=UNIDADES[nome], status=1)
+                for nome in nomes
+            ]
+        servicos = _criar(FornecedorTipo, servicos)
+        servicos_por_tipo = {nome: [s for s in servicos if s.tipo_id == tipo.pk] for nome, tipo in tipos.items()}
+
+        # Histórico de tarifas: uma revisão por semestre
+        tarifas = []
+        for servico in servicos:
+            preco = TARIFAS_BASE[servico.tipo.tipo] * aleatorio.uniform(0.85, 1.15)
+            for ano in lista_anos:
+                for mes in (1, 7):
+                    tarifas.append(FornecedorValor(
+                        fornecedor_tipo=servico, valor=Decimal(str(round(preco, 3))), timestamp=instante_do_mes(ano, mes)
+                    ))
+                    preco *= aleatorio.uniform(0.97, 1.06)
+        FornecedorValor.objects.bulk_create(tarifas, batch_size=TAMANHO_LOTE)
+
+        # Residentes com conta de login (o hash da password é calculado uma só vez)
+        inicio = Residente.objects.count()
+        hash_password = make_password(password)
+        utilizadores = _criar(User, [
+            User(username=f'residente{inicio + r}@{DOMINIO_EMAIL}', email=f'residente{inicio + r}@{DOMINIO_EMAIL}',
+                 password=hash_password, first_name=f'Residente {inicio + r}')
+            for r in range(residentes)
+        ])
+        novos_residentes = _criar(Residente, [
+            Residente(
+                nome=f'Residente {inicio + r}', email=utilizador.email, telemovel=f'8{inicio + r:08d}',
+                password=password, cidade=aleatorio.choice(CIDADES), morada=f'Rua Sintética {r + 1}',
+                codigo_postal=f'{aleatorio.randint(1000, 9999)}-{aleatorio.randint(0, 999):03d}',
+                status=0 if aleatorio.random() < 0.05 else 1, utilizador=utilizador
+            )
+            for r, utilizador in enumerate(utilizadores)
+        ])
+
+        contratos, metas, novos_dispositivos = [], [], []
+        for residente in novos_residentes:
+            for nome, opcoes in servicos_por_tipo.items():
+                if not opcoes:
+                    continue
+                # Alguns residentes mudaram de fornecedor a meio do período
+                if len(opcoes) > 1 and aleatorio.random() < 0.3:
+                    antigo, atual = aleatorio.sample(opcoes, 2)
+                    contratos.append(FornecedorResidente(
+                        residente=residente, fornecedor_tipo=antigo, status=0, timestamp=instante_do_mes(lista_anos[0], 1)
+                    ))
+                    ano_mudanca, mes_mudanca = aleatorio.choice(meses)
+                    contratos.append(FornecedorResidente(
+                        residente=residente, fornecedor_tipo=atual, status=1, timestamp=instante_do_mes(ano_mudanca, mes_mudanca)
+                    ))
+                else:
+                    contratos.append(FornecedorResidente(
+                        residente=residente, fornecedor_tipo=aleatorio.choice(opcoes), status=1,
+                        timestamp=instante_do_mes(lista_anos[0], 1)
+                    ))
+                for ano, mes in meses:
+                    if aleatorio.random() < 0.4:
+                        metas.append(Orcamento_limite(
+                            residente=residente, tipo=tipos[nome], timestamp=instante_do_mes(ano, mes),
+                            valor=Decimal(aleatorio.randint(10, 80))
+                        ))
+
+            for d in range(dispositivos):
+                nome = ('Luz', 'Agua', 'Gas')[d % 3]
+                gerador = nome == 'Luz' and aleatorio.random() < 0.2
+                novos_dispositivos.append(Dispositivo(
+                    nome=f"{'Painel solar' if gerador else nome} {d + 1}", tipo=tipos[nome],
+                    categoria=categorias['Gerador' if gerador else 'Consumidor'], residente=residente,
+                    unidade=UNIDADES[nome], status=1
+                ))
+        FornecedorResidente.objects.bulk_create(contratos, batch_size=TAMANHO_LOTE)
+        Orcamento_limite.objects.bulk_create(metas, batch_size=TAMANHO_LOTE)
+        novos_dispositivos = _criar(Dispositivo, novos_dispositivos)
+
+        # Leituras mensais, gravadas por lotes para não acumular tudo em memória
+        total_registos = 0
+        lote = []
+        for dispositivo in novos_dispositivos:
+            gerador = dispositivo.categoria_id == categorias['Gerador'].pk
+            perfil = PERFIL_GERADOR if gerador else PERFIS[dispositivo.tipo.tipo]
+            escala = aleatorio.uniform(0.5, 1.5)
+            for ano, mes in meses:
+                lote.append(RegistoConsumo(
+                    dispositivo=dispositivo, valor=_valor_mensal(aleatorio, perfil, mes, escala),
+                    timestamp=instante_do_mes(ano, mes)
+                ))
+                if len(lote) >= TAMANHO_LOTE:
+                    RegistoConsumo.objects.bulk_create(lote)
+                    total_registos += len(lote)
+                    lote = []
+        RegistoConsumo.objects.bulk_create(lote)
+        total_registos += len(lote)
+
+    # O bulk_create não envia sinais: o resumo mensal é reconstruído de uma vez
+    resumo.reconstruir()
+
+    return {
+        'residentes': len(novos_residentes),
+        'dispositivos': len(novos_dispositivos),
+        'registos': total_registos,
+        'fornecedores': len(novos_fornecedores),
+        'servicos': len(servicos),
+        'tarifas': len(tarifas),
+        'contratos': len(contratos),
+        'metas': len(metas),
+        'anos': lista_anos,
+    }
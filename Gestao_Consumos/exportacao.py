@@ -0,0 +1,83 @@
+import csv
+import json
+
+from django.utils import timezone
+
+from .models import RegistoConsumo
+from .tarifas import LinhaTemporalTarifas, PRECO_POR_OMISSAO
+
+TAMANHO_BLOCO = 2000
+
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'jsonl'),
+}
+
+CAMPOS = (
+    'pk', 'dispositivo__residente_id', 'dispositivo__residente__email', 'dispositivo_id', 'dispositivo__nome',
+    'dispositivo__tipo__tipo', 'dispositivo__categoria__categoria', 'dispositivo__unidade', 'timestamp', 'valor',
+)
+COLUNAS = (
+    'registo', 'residente_id', 'residente', 'dispositivo_id', 'dispositivo',
+    'tipo', 'categoria', 'unidade', 'data', 'ano', 'mes', 'valor', 'tarifa',
+)
+
+
+# Percorre a tabela por blocos de chave primária (WHERE pk > último ... LIMIT n)
+# O iterator() sozinho não chega no MySQL: o driver carrega o resultado inteiro para memória
+def _em_blocos(registos, tamanho):
+    ultimo = 0
+    while True:
+        bloco = 0
+        for linha in registos.filter(pk__gt=ultimo).order_by('pk')[:tamanho].iterator(chunk_size=tamanho):
+            bloco += 1
+            ultimo = linha[0]
+            yield linha
+        if bloco < tamanho:
+            return
+
+
+# Linhas da exportação (tuplos pela ordem de COLUNAS), com a tarifa em vigor no instante de cada registo
+def linhas(registos, tarifas=None, tamanho=TAMANHO_BLOCO):
+    if tarifas is None:
+        tarifas = LinhaTemporalTarifas.carregar()
+    for (pk, residente_id, email, dispositivo_id, nome, tipo_nome, categoria,
+         unidade, timestamp, valor) in _em_blocos(registos.values_list(*CAMPOS), tamanho):
+        fornecedor_tipo_id = tarifas.contrato_em(residente_id, tipo_nome, timestamp)
+        tarifa = tarifas.preco_em(fornecedor_tipo_id, timestamp) if fornecedor_tipo_id else PRECO_POR_OMISSAO
+        local = timezone.localtime(timestamp)
+        yield (
+            pk, residente_id, email, dispositivo_id, nome, tipo_nome, categoria,
+            unidade, local.isoformat(), local.year, local.month, valor, tarifa,
+        )
+
+
+def registos_de(residente=None, filtro=None):
+    registos = RegistoConsumo.objects.all()
+    if residente is not None:
+        registos = registos.filter(dispositivo__residente=residente)
+    return registos.filter(**(filtro or {}))
+
+
+# Objeto "ficheiro" que devolve o que lhe escrevem (o csv.writer escreve linha a linha na resposta)
+class _Eco:
+    def write(self, valor):
+        return valor
+
+
+def em_csv(linhas_exportacao):
+    escritor = csv.writer(_Eco())
+    yield escritor.writerow(COLUNAS)
+    for linha in linhas_exportacao:
+        yield escritor.writerow(linha)
+
+
+def em_jsonl(linhas_exportacao):
+    for linha in linhas_exportacao:
+        dados = dict(zip(COLUNAS, linha))
+        dados['valor'] = str(dados['valor'])
+        yield json.dumps(dados, ensure_ascii=False) + '\n'
+
+
+def gerar(formato, linhas_exportacao):
+    return em_csv(linhas_exportacao) if formato == 'csv' else em_jsonl(linhas_exportacao)
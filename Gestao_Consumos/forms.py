@@ -1,7 +1,6 @@
 from django import forms
-from .models import Residente, Dispositivo, RegistoConsumo, Orcamento_limite, Tipo, Categoria
-from django.utils import timezone
-import datetime
+from .models import Residente, Dispositivo, RegistoConsumo, Orcamento_limite, Tipo, Categoria, ResumoMensal
+from .periodos import filtro_mes, instante_do_mes
 
 MESES_CHOICES = [(i, nome) for i, nome in enumerate(
     ['Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho',
@@ -55,6 +54,46 @@ class EditarPerfilForm(forms.ModelForm):
         }
 
 
+# Filtros do histórico de consumos (pedido GET; todos opcionais)
+class FiltroHistoricoForm(forms.Form):
+    dispositivo = forms.ModelChoiceField(
+        queryset=Dispositivo.objects.none(), required=False, empty_label='Todos os dispositivos',
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'})
+    )
+    tipo = forms.ModelChoiceField(
+        queryset=Tipo.objects.all(), required=False, empty_label='Todos os tipos',
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'})
+    )
+    ano = forms.TypedChoiceField(
+        coerce=int, required=False, empty_value=None,
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'})
+    )
+
+    def __init__(self, residente_obj, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['dispositivo'].queryset = Dispositivo.objects.filter(residente=residente_obj)
+        # Anos com registos (lidos do resumo mensal, sem percorrer os registos)
+        anos = ResumoMensal.objects.filter(residente=residente_obj).order_by('-ano').values_list('ano', flat=True).distinct()
+        self.fields['ano'].choices = [('', 'Todos os anos')] + [(ano, ano) for ano in anos]
+
+
+# Filtros da análise de consumos de todos os residentes (painel de administração; pedido GET)
+class FiltroAnaliseForm(forms.Form):
+    agrupar = forms.MultipleChoiceField(
+        choices=[('cidade', 'Cidade'), ('codigo_postal', 'Código postal'), ('tipo', 'Tipo'),
+                 ('categoria', 'Categoria'), ('mes', 'Mês')],
+        required=False, widget=forms.CheckboxSelectMultiple(attrs={'class': 'form-check-input'})
+    )
+    desde = forms.DateField(
+        required=False, input_formats=['%Y-%m'],
+        widget=forms.DateInput(format='%Y-%m', attrs={'type': 'month', 'class': 'form-control form-control-sm'})
+    )
+    ate = forms.DateField(
+        required=False, input_formats=['%Y-%m'],
+        widget=forms.DateInput(format='%Y-%m', attrs={'type': 'month', 'class': 'form-control form-control-sm'})
+    )
+
+
 # Formulário para registar consumo manual de um dispositivo
 class ConsumoManualForm(forms.ModelForm):
     mes = forms.ChoiceField(choices=MESES_CHOICES, widget=forms.Select(attrs={'class': 'form-select'}))
@@ -86,7 +125,7 @@ class ConsumoManualForm(forms.ModelForm):
         ano = int(cleaned_data.get('ano'))
 
         if dispositivo:
-            qs = RegistoConsumo.objects.filter(dispositivo=dispositivo, timestamp__year=ano, timestamp__month=mes)
+            qs = RegistoConsumo.objects.filter(dispositivo=dispositivo, **filtro_mes(ano, mes))
             if self.instance.pk:
                 qs = qs.exclude(pk=self.instance.pk)
             if qs.exists():
@@ -95,15 +134,19 @@ class ConsumoManualForm(forms.ModelForm):
                 )
     def save(self, commit=True):
         instance = super().save(commit=False)
-        instance.timestamp = timezone.make_aware(
-            datetime.datetime(int(self.cleaned_data['ano']), int(self.cleaned_data['mes']), 1, 12, 0, 0)
-        )
+        instance.timestamp = instante_do_mes(self.cleaned_data['ano'], self.cleaned_data['mes'])
         if commit:
             instance.save()
         return instance
 
 
 
+# Formulário para importar leituras em massa a partir de um CSV
+class ImportarConsumosForm(forms.Form):
+    ficheiro = forms.FileField(widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv'}))
+
+
+
 # Formulário para criar um novo limite orçamental mensal
 class CriarMetaForm(forms.ModelForm):
     mes = forms.ChoiceField(choices=MESES_CHOICES, widget=forms.Select(attrs={'class': 'form-select'}))
@@ -118,9 +161,7 @@ class CriarMetaForm(forms.ModelForm):
     def save(self, residente_obj, commit=True):
         instance = super().save(commit=False)
         instance.residente = residente_obj
-        instance.timestamp = timezone.make_aware(
-            datetime.datetime(int(self.cleaned_data['ano']), int(self.cleaned_data['mes']), 1, 12, 0, 0)
-        )
+        instance.timestamp = instante_do_mes(self.cleaned_data['ano'], self.cleaned_data['mes'])
         if commit:
             instance.save()
         return instance
@@ -0,0 +1,67 @@
+import datetime
+
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import dateformat, timezone
+
+from .models import RegistoConsumo
+from .periodos import filtro_ano
+
+TAMANHO_PAGINA = 25
+
+
+# Histórico de um residente, do mais recente para o mais antigo (com os filtros opcionais)
+def registos_de(residente, dispositivo=None, tipo=None, ano=None):
+    registos = RegistoConsumo.objects.filter(dispositivo__residente=residente).select_related(
+        'dispositivo', 'dispositivo__tipo'
+    )
+    if dispositivo:
+        registos = registos.filter(dispositivo=dispositivo)
+    if tipo:
+        registos = registos.filter(dispositivo__tipo=tipo)
+    if ano:
+        registos = registos.filter(**filtro_ano(ano))
+    return registos.order_by('-timestamp', '-pk')
+
+
+# O cursor identifica o último registo mostrado: "<timestamp ISO>_<id>"
+def cursor_de(registo):
+    return f'{registo.timestamp.isoformat()}_{registo.pk}'
+
+
+def ler_cursor(cursor):
+    try:
+        instante, pk = cursor.rsplit('_', 1)
+        instante = datetime.datetime.fromisoformat(instante)
+        pk = int(pk)
+    except (AttributeError, ValueError):
+        return None
+    if timezone.is_naive(instante):
+        return None
+    return instante, pk
+
+
+# Paginação por chave (seek): WHERE (timestamp, id) < cursor ORDER BY timestamp DESC, id DESC LIMIT n
+# Ao contrário do OFFSET, o custo de cada página não cresce com o número de páginas já vistas
+def pagina(registos, cursor=None, tamanho=TAMANHO_PAGINA):
+    posicao = ler_cursor(cursor) if cursor else None
+    if posicao:
+        instante, pk = posicao
+        registos = registos.filter(Q(timestamp__lt=instante) | Q(timestamp=instante, pk__lt=pk))
+    linhas = list(registos[:tamanho + 1])
+    proximo = cursor_de(linhas[tamanho - 1]) if len(linhas) > tamanho else None
+    return linhas[:tamanho], proximo
+
+
+# Versão leve de um registo para o scroll infinito (JSON)
+def para_json(registo):
+    return {
+        'id': registo.pk,
+        'data': dateformat.format(timezone.localtime(registo.timestamp), 'F/Y'),
+        'dispositivo': registo.dispositivo.nome,
+        'tipo': registo.dispositivo.tipo.tipo,
+        'valor': str(registo.valor),
+        'unidade': registo.dispositivo.unidade,
+        'editar_url': reverse('editar_consumo', args=[registo.pk]),
+        'apagar_url': reverse('apagar_consumo', args=[registo.pk]),
+    }
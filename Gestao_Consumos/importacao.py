@@ -0,0 +1,248 @@
+import csv
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import orcamentos, resumo, versoes
+from .models import Dispositivo, RegistoConsumo
+from .periodos import intervalo_mes, instante_do_mes
+
+TAMANHO_LOTE = 1000
+COLUNAS = ('ano', 'mes', 'valor')
+# O dispositivo é indicado pelo nome (só com residente) ou pelo número (id); pelo menos uma das colunas
+COLUNAS_DISPOSITIVO = ('dispositivo', 'dispositivo_id')
+
+# Limites do campo RegistoConsumo.valor (max_digits=10, decimal_places=2)
+VALOR_MAXIMO = Decimal('99999999.99')
+
+
+CRIADO = 'criado'
+DUPLICADO = 'duplicado'
+INVALIDO = 'invalido'
+# Já existe leitura para o mesmo dispositivo e mês com outro valor: a correção não é aplicada
+CONFLITO = 'conflito'
+
+
+class ResultadoImportacao:
+    # detalhado: guarda também o estado de cada linha (usado pela API de ingestão)
+    def __init__(self, detalhado=False):
+        self.criados = 0
+        self.duplicados = 0
+        self.erros = []  # [(número da linha, mensagem)]
+        self.conflitos = []  # [(número da linha, mensagem)]
+        self.estados = {} if detalhado else None  # {número da linha: (estado, mensagem)}
+
+    def _estado(self, linha, estado, mensagem=None):
+        if self.estados is not None:
+            self.estados[linha] = (estado, mensagem)
+
+    def erro(self, linha, mensagem):
+        self.erros.append((linha, mensagem))
+        self._estado(linha, INVALIDO, mensagem)
+
+    def criado(self, linha):
+        self.criados += 1
+        self._estado(linha, CRIADO)
+
+    def duplicado(self, linha):
+        self.duplicados += 1
+        self._estado(linha, DUPLICADO)
+
+    def conflito(self, linha, mensagem):
+        self.conflitos.append((linha, mensagem))
+        self._estado(linha, CONFLITO, mensagem)
+
+
+# Lê o CSV linha a linha (não carrega o ficheiro todo): devolve (número da linha, dicionário)
+def ler_csv(ficheiro):
+    leitor = csv.DictReader(ficheiro)
+    colunas = leitor.fieldnames or []
+    em_falta = [coluna for coluna in COLUNAS if coluna not in colunas]
+    if not any(coluna in colunas for coluna in COLUNAS_DISPOSITIVO):
+        em_falta.append(' ou '.join(COLUNAS_DISPOSITIVO))
+    if em_falta:
+        raise ValidationError(f"Faltam colunas no CSV: {', '.join(em_falta)}.")
+    for linha in leitor:
+        yield leitor.line_num, linha
+
+
+# Identificador do dispositivo: ('id', número) ou ('nome', nome). Um nome feito só de algarismos continua a ser um
+# nome; o número vem sempre da coluna dispositivo_id
+def _identificador(dados):
+    pk = str(dados.get('dispositivo_id') or '').strip()
+    if pk:
+        if not pk.isdigit():
+            raise ValidationError('O dispositivo_id tem de ser um número inteiro.')
+        return 'id', int(pk)
+    nome = str(dados.get('dispositivo') or '').strip()
+    if not nome:
+        raise ValidationError('Dispositivo em falta.')
+    return 'nome', nome
+
+
+# Converte e valida os campos de uma leitura; devolve (dispositivo, ano, mes, valor, unidade)
+def interpretar_leitura(dados):
+    try:
+        ano = int(str(dados.get('ano', '')).strip())
+        mes = int(str(dados.get('mes', '')).strip())
+    except ValueError:
+        raise ValidationError('Ano e mês têm de ser números inteiros.')
+    if not 1 <= mes <= 12:
+        raise ValidationError('O mês tem de estar entre 1 e 12.')
+    if not 1900 <= ano <= 2100:
+        raise ValidationError('Ano inválido.')
+
+    try:
+        valor = Decimal(str(dados.get('valor', '')).strip().replace(',', '.'))
+    except InvalidOperation:
+        raise ValidationError('Valor inválido.')
+    if not valor.is_finite() or valor < 0 or valor > VALOR_MAXIMO or valor != valor.quantize(Decimal('0.01')):
+        raise ValidationError('O valor tem de ser positivo, com no máximo 2 casas decimais.')
+
+    dispositivo = _identificador(dados)
+    unidade = str(dados.get('unidade') or '').strip() or None
+    return dispositivo, ano, mes, valor, unidade
+
+
+class Importador:
+    # residente: se indicado, só aceita dispositivos desse residente (e permite identificá-los pelo nome);
+    # sem residente os dispositivos só podem ser indicados pelo número (os nomes repetem-se entre residentes)
+    def __init__(self, residente=None, tamanho_lote=TAMANHO_LOTE, detalhado=False):
+        self.residente = residente
+        self.tamanho_lote = tamanho_lote
+        self.resultado = ResultadoImportacao(detalhado)
+        # Cache de dispositivos já validados: {('id', pk) ou ('nome', nome): Dispositivo ou mensagem de erro}
+        self._dispositivos = {}
+
+    def importar(self, linhas):
+        lote = []
+        for numero, dados in linhas:
+            lote.append((numero, dados))
+            if len(lote) >= self.tamanho_lote:
+                self._processar_lote(lote)
+                lote = []
+        if lote:
+            self._processar_lote(lote)
+        self.resultado.erros.sort()
+        self.resultado.conflitos.sort()
+        return self.resultado
+
+    # Carrega numa query os dispositivos do lote ainda desconhecidos e valida-os (Dispositivo.clean)
+    def _carregar_dispositivos(self, identificadores):
+        novos = {i for i in identificadores if i not in self._dispositivos}
+        if not novos:
+            return
+        ids = {valor for campo, valor in novos if campo == 'id'}
+        nomes = {valor for campo, valor in novos if campo == 'nome'}
+
+        qs = Dispositivo.objects.select_related('tipo')
+        if self.residente is not None:
+            qs = qs.filter(residente=self.residente)
+        # {pk: Dispositivo}: o mesmo dispositivo pode vir pelo número e pelo nome
+        encontrados = {dispositivo.pk: dispositivo for dispositivo in qs.filter(pk__in=ids)} if ids else {}
+        if nomes and self.residente is not None:
+            encontrados.update((dispositivo.pk, dispositivo) for dispositivo in qs.filter(nome__in=nomes))
+
+        for dispositivo in encontrados.values():
+            try:
+                if dispositivo.status != 1:
+                    raise ValidationError(f'O dispositivo {dispositivo.nome} está inativo.')
+                dispositivo.clean()
+                estado = dispositivo
+            except ValidationError as e:
+                estado = ' '.join(e.messages)
+            if ('id', dispositivo.pk) in novos:
+                self._dispositivos[('id', dispositivo.pk)] = estado
+            chave = ('nome', dispositivo.nome)
+            if chave in novos:
+                # O nome não é único: com dois dispositivos iguais não se adivinha qual é
+                if chave in self._dispositivos:
+                    estado = f'Há mais de um dispositivo com o nome "{dispositivo.nome}"; indique o dispositivo_id.'
+                self._dispositivos[chave] = estado
+
+        for campo, valor in novos:
+            if campo == 'nome' and self.residente is None:
+                mensagem = 'Sem residente, o dispositivo tem de ser indicado pelo dispositivo_id.'
+            else:
+                mensagem = f'Dispositivo "{valor}" não encontrado.'
+            self._dispositivos.setdefault((campo, valor), mensagem)
+
+    def _processar_lote(self, lote):
+        resultado = self.resultado
+        leituras = []
+        for numero, dados in lote:
+            try:
+                leituras.append((numero,) + interpretar_leitura(dados))
+            except ValidationError as e:
+                resultado.erro(numero, ' '.join(e.messages))
+
+        self._carregar_dispositivos({leitura[1] for leitura in leituras})
+
+        validas = []
+        for numero, identificador, ano, mes, valor, unidade in leituras:
+            dispositivo = self._dispositivos[identificador]
+            if isinstance(dispositivo, str):
+                resultado.erro(numero, dispositivo)
+            elif unidade and unidade != dispositivo.unidade:
+                resultado.erro(numero, f'Unidade {unidade} não corresponde à do dispositivo ({dispositivo.unidade}).')
+            else:
+                validas.append((numero, dispositivo, ano, mes, valor))
+        if not validas:
+            return
+
+        # A verificação dos existentes e a inserção ficam na mesma transação, com os dispositivos do lote bloqueados:
+        # duas importações simultâneas das mesmas leituras não passam ambas a verificação
+        with transaction.atomic():
+            list(Dispositivo.objects.select_for_update().filter(
+                pk__in={dispositivo.pk for _, dispositivo, _, _, _ in validas}
+            ).order_by('pk').values_list('pk'))
+            existentes = self._existentes(validas)
+            novos = []
+            for numero, dispositivo, ano, mes, valor in validas:
+                chave = (dispositivo.pk, ano, mes)
+                if chave in existentes:
+                    # Reenvio igual: nada a fazer; valor diferente: a leitura gravada não é substituída
+                    if existentes[chave] == valor:
+                        resultado.duplicado(numero)
+                    else:
+                        resultado.conflito(numero, (
+                            f'Já existe uma leitura de {dispositivo.nome} em {mes}/{ano} com o valor '
+                            f'{existentes[chave]}; o valor {valor} não foi aplicado.'
+                        ))
+                    continue
+                existentes[chave] = valor  # também apanha repetições dentro do próprio lote
+                novos.append((numero, RegistoConsumo(
+                    dispositivo=dispositivo, valor=valor, timestamp=instante_do_mes(ano, mes)
+                )))
+
+            registos = [registo for _, registo in novos]
+            if registos:
+                RegistoConsumo.objects.bulk_create(registos, batch_size=self.tamanho_lote)
+                # O bulk_create não envia sinais: o resumo é atualizado aqui, de uma vez
+                resumo.registar_lote(registos)
+
+        if registos:
+            atualizar_derivados(registos)
+            for numero, _ in novos:
+                resultado.criado(numero)
+
+    # Uma query por lote: {(dispositivo, ano, mes): valor} dos registos no intervalo coberto pelo lote
+    def _existentes(self, validas):
+        periodos = [(ano, mes) for _, _, ano, mes, _ in validas]
+        inicio = intervalo_mes(*min(periodos))[0]
+        fim = intervalo_mes(*max(periodos))[1]
+        registos = RegistoConsumo.objects.filter(
+            dispositivo_id__in={dispositivo.pk for _, dispositivo, _, _, _ in validas},
+            timestamp__gte=inicio,
+            timestamp__lt=fim
+        ).order_by().values_list('dispositivo_id', 'timestamp', 'valor')
+        return {(dispositivo_id,) + resumo.periodo_de(timestamp): valor for dispositivo_id, timestamp, valor in registos}
+
+
+# Depois de escritas em lote (sem sinais): marca os residentes afetados (páginas em cache, ETags e relatórios PDF)
+# e volta a avaliar os alertas de orçamento dos meses importados
+def atualizar_derivados(registos):
+    versoes.tocar({registo.dispositivo.residente_id for registo in registos})
+    periodos = {(registo.dispositivo.residente_id,) + resumo.periodo_de(registo.timestamp) for registo in registos}
+    transaction.on_commit(lambda: orcamentos.reavaliar(periodos))
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import secrets
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .importacao import Importador, CRIADO, DUPLICADO, INVALIDO, CONFLITO
+from .models import ChaveMedidor, Residente
+
+# Máximo de leituras aceites num pedido (cada pedido é uma única transação)
+MAXIMO_LEITURAS = getattr(settings, 'INGESTAO_MAXIMO_LEITURAS', 5000)
+
+# Código devolvido para cada leitura: 201 = criada, 200 = já existia (reenvio igual), 422 = inválida,
+# 409 = já existia com outro valor (a correção não foi aplicada)
+CODIGOS = {CRIADO: 201, DUPLICADO: 200, INVALIDO: 422, CONFLITO: 409}
+
+
+class PedidoInvalido(Exception):
+    def __init__(self, mensagem, status=400):
+        super().__init__(mensagem)
+        self.status = status
+
+
+def hash_de(chave):
+    return hashlib.sha256(chave.encode('utf-8')).hexdigest()
+
+
+# Cria uma chave para um medidor; a chave em claro só existe no valor devolvido
+def gerar_chave(residente, nome):
+    chave = secrets.token_urlsafe(32)
+    registo = ChaveMedidor.objects.create(residente=residente, nome=nome, chave_hash=hash_de(chave))
+    return registo, chave
+
+
+# Cabeçalho "Authorization: Token <chave>" -> ChaveMedidor ativa (de um residente ativo) ou None
+def autenticar(cabecalho):
+    tipo, _, chave = (cabecalho or '').partition(' ')
+    if tipo.lower() != 'token' or not chave.strip():
+        return None
+    registo = ChaveMedidor.objects.select_related('residente').filter(
+        chave_hash=hash_de(chave.strip()), status=1, residente__status=1
+    ).first()
+    if registo:
+        ChaveMedidor.objects.filter(pk=registo.pk).update(ultimo_uso=timezone.now())
+    return registo
+
+
+# Corpo do pedido: uma lista de leituras ou {"leituras": [...]}
+def ler_pedido(corpo):
+    try:
+        dados = json.loads(corpo)
+    except (ValueError, UnicodeDecodeError):
+        raise PedidoInvalido('O corpo do pedido tem de ser JSON válido.')
+    if isinstance(dados, dict):
+        dados = dados.get('leituras')
+    if not isinstance(dados, list):
+        raise PedidoInvalido('Esperada uma lista de leituras (ou {"leituras": [...]}).')
+    if len(dados) > MAXIMO_LEITURAS:
+        raise PedidoInvalido(f'No máximo {MAXIMO_LEITURAS} leituras por pedido.', status=413)
+    return dados
+
+
+# Os medidores podem enviar o instante da leitura em vez de ano/mês (é guardada no mês correspondente)
+def _normalizar(leitura):
+    if leitura.get('timestamp') and 'ano' not in leitura and 'mes' not in leitura:
+        # parse_datetime devolve None se o formato não bate certo e lança ValueError se a data não existe (mês 13)
+        try:
+            instante = parse_datetime(str(leitura['timestamp']))
+        except (ValueError, TypeError):
+            instante = None
+        if instante is None:
+            raise ValidationError('Timestamp inválido (usar ISO 8601).')
+        if timezone.is_naive(instante):
+            instante = timezone.make_aware(instante)
+        instante = timezone.localtime(instante)
+        leitura = dict(leitura, ano=instante.year, mes=instante.month)
+    return leitura
+
+
+# Grava as leituras de um residente numa única transação; devolve o resultado por leitura
+def ingerir(residente, leituras):
+    importador = Importador(residente=residente, tamanho_lote=max(len(leituras), 1), detalhado=True)
+    resultado = importador.resultado
+
+    def validas():
+        for indice, leitura in enumerate(leituras):
+            if not isinstance(leitura, dict):
+                resultado.erro(indice, 'Cada leitura tem de ser um objeto JSON.')
+                continue
+            try:
+                yield indice, _normalizar(leitura)
+            except ValidationError as e:
+                resultado.erro(indice, ' '.join(e.messages))
+
+    with transaction.atomic():
+        # Bloqueia o residente: dois envios simultâneos do mesmo lote não criam registos repetidos
+        list(Residente.objects.select_for_update().filter(pk=residente.pk).values_list('pk'))
+        importador.importar(validas())
+
+    itens = []
+    for indice in range(len(leituras)):
+        estado, mensagem = resultado.estados[indice]
+        item = {'indice': indice, 'codigo': CODIGOS[estado], 'estado': estado}
+        if mensagem:
+            item['erro'] = mensagem
+        itens.append(item)
+    return {
+        'criados': resultado.criados,
+        'duplicados': resultado.duplicados,
+        'invalidos': len(resultado.erros),
+        'conflitos': len(resultado.conflitos),
+        'resultados': itens,
+    }
@@ -0,0 +1,40 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Gestao_Consumos import orcamentos
+
+
+class Command(BaseCommand):
+    help = ('Avalia as metas de orçamento (Orcamento_limite) de todos os residentes ativos num mês e grava o estado '
+            '(excedido / dentro / sem_meta) em AlertaOrcamento. Pode correr várias vezes: as linhas são atualizadas.')
+
+    def add_arguments(self, parser):
+        hoje = datetime.date.today()
+        parser.add_argument('--ano', type=int, default=hoje.year)
+        parser.add_argument('--mes', type=int, default=hoje.month)
+        parser.add_argument('--meses', type=int, default=1, help='Número de meses a avaliar, a terminar em --ano/--mes')
+        parser.add_argument('--processos', type=int, default=1, help='Processos em paralelo (1 = no processo atual)')
+        parser.add_argument('--tamanho-bloco', type=int, default=orcamentos.TAMANHO_BLOCO, help='Residentes por bloco')
+
+    def handle(self, *args, **options):
+        if not 1 <= options['mes'] <= 12:
+            raise CommandError('O mês tem de estar entre 1 e 12.')
+        if options['meses'] < 1 or options['processos'] < 1 or options['tamanho_bloco'] < 1:
+            raise CommandError('--meses, --processos e --tamanho-bloco têm de ser positivos.')
+
+        indice = options['ano'] * 12 + options['mes'] - 1
+        for deslocamento in reversed(range(options['meses'])):
+            ano, mes = divmod(indice - deslocamento, 12)
+            mes += 1
+            inicio = time.perf_counter()
+            if options['processos'] > 1:
+                contagem = orcamentos.avaliar_em_paralelo(ano, mes, options['processos'], options['tamanho_bloco'])
+            else:
+                contagem = orcamentos.avaliar(ano, mes, tamanho=options['tamanho_bloco'])
+            self.stdout.write(
+                f"{mes:02d}/{ano}: {contagem['excedido']} excedido, {contagem['dentro']} dentro, "
+                f"{contagem['sem_meta']} sem meta ({time.perf_counter() - inicio:.2f} s)"
+            )
+        self.stdout.write(self.style.SUCCESS('Alertas de orçamento atualizados.'))
@@ -0,0 +1,108 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from Gestao_Consumos.ingestao import gerar_chave, MAXIMO_LEITURAS
+from Gestao_Consumos.models import Residente, Tipo, Categoria, Dispositivo, RegistoConsumo, ResumoMensal
+
+
+class Command(BaseCommand):
+    help = ('Mede o débito da API de ingestão (/api/leituras/) numa base de dados de teste: '
+            'envia todas as leituras e volta a enviá-las (têm de ser todas reconhecidas como duplicadas).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--leituras', type=int, default=12000, help='Total de leituras a enviar')
+        parser.add_argument('--lote', type=int, default=1000, help='Leituras por pedido')
+        parser.add_argument('--dispositivos', type=int, default=50)
+        parser.add_argument('--minimo', type=float, default=1000,
+                            help='Falha se o débito (leituras/s) na primeira passagem ficar abaixo deste valor')
+        parser.add_argument('--json', action='store_true', help='Escreve o resultado em JSON')
+
+    def handle(self, *args, **options):
+        if not 1 <= options['lote'] <= MAXIMO_LEITURAS:
+            raise CommandError(f'O lote tem de estar entre 1 e {MAXIMO_LEITURAS}.')
+
+        setup_test_environment()
+        nome_original = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            resultado = self._medir(options)
+        finally:
+            connection.creation.destroy_test_db(nome_original, verbosity=0)
+            teardown_test_environment()
+
+        if options['json']:
+            self.stdout.write(json.dumps(resultado))
+        else:
+            for passagem in ('envio', 'reenvio'):
+                dados = resultado[passagem]
+                self.stdout.write(
+                    f"{passagem:8} {dados['leituras_por_segundo']:>9.0f} leituras/s "
+                    f"(pedido: mediana {dados['pedido_ms']['mediana']} ms, max {dados['pedido_ms']['max']} ms)"
+                )
+            self.stdout.write(f"Registos na BD: {resultado['registos']} (esperados {resultado['leituras']})")
+
+        if resultado['registos'] != resultado['leituras'] or resultado['reenvio']['criados']:
+            raise CommandError('O reenvio criou registos repetidos.')
+        if resultado['envio']['leituras_por_segundo'] < options['minimo']:
+            raise CommandError(f"Débito abaixo do mínimo ({options['minimo']:.0f} leituras/s).")
+
+    def _medir(self, options):
+        residente = Residente.objects.create(
+            nome='Benchmark', email='benchmark@exemplo.pt', telemovel='900000000', password='-', status=1
+        )
+        tipo = Tipo.objects.get_or_create(tipo='Agua')[0]
+        categoria = Categoria.objects.get_or_create(categoria='Consumidor', defaults={'status': 1})[0]
+        dispositivos = Dispositivo.objects.bulk_create([
+            Dispositivo(nome=f'Contador {i}', tipo=tipo, categoria=categoria, residente=residente, unidade='m3')
+            for i in range(options['dispositivos'])
+        ])
+        _, chave = gerar_chave(residente, 'benchmark')
+
+        # Leituras mensais distintas: (dispositivo, ano, mês) nunca se repete
+        leituras = []
+        for i in range(options['leituras']):
+            dispositivo = dispositivos[i % len(dispositivos)]
+            meses = i // len(dispositivos)
+            leituras.append({
+                'dispositivo_id': dispositivo.pk, 'ano': 2000 + meses // 12, 'mes': meses % 12 + 1,
+                'valor': f'{10 + i % 90}.{i % 100:02d}',
+            })
+        lotes = [leituras[i:i + options['lote']] for i in range(0, len(leituras), options['lote'])]
+
+        cliente = Client(HTTP_AUTHORIZATION=f'Token {chave}')
+        url = reverse('api_leituras')
+        resultado = {'leituras': len(leituras), 'lote': options['lote'], 'dispositivos': len(dispositivos)}
+        for passagem in ('envio', 'reenvio'):
+            tempos, criados, duplicados = [], 0, 0
+            for lote in lotes:
+                inicio = time.perf_counter()
+                resposta = cliente.post(url, json.dumps(lote), content_type='application/json')
+                tempos.append(time.perf_counter() - inicio)
+                if resposta.status_code != 200:
+                    raise CommandError(f'Resposta {resposta.status_code}: {resposta.content[:200]!r}')
+                dados = resposta.json()
+                if dados['invalidos']:
+                    raise CommandError(f"Leituras rejeitadas: {dados['resultados'][:3]}")
+                criados += dados['criados']
+                duplicados += dados['duplicados']
+            resultado[passagem] = {
+                'segundos': round(sum(tempos), 3),
+                'leituras_por_segundo': round(len(leituras) / sum(tempos), 1),
+                'pedido_ms': {
+                    'mediana': round(statistics.median(tempos) * 1000, 1),
+                    'max': round(max(tempos) * 1000, 1),
+                },
+                'criados': criados,
+                'duplicados': duplicados,
+            }
+
+        resultado['registos'] = RegistoConsumo.objects.filter(dispositivo__residente=residente).count()
+        resultado['linhas_resumo'] = ResumoMensal.objects.filter(residente=residente).count()
+        return resultado
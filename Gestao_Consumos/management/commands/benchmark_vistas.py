@@ -0,0 +1,147 @@
+import datetime
+import json
+import statistics
+import subprocess
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from Gestao_Consumos import relatorios_pdf
+from Gestao_Consumos.dados_sinteticos import gerar
+from Gestao_Consumos.models import Residente
+
+TAMANHOS = '10x4x2,50x6x3,200x8x3'
+ESPERA_PDF = 60
+
+
+def _tamanho(texto):
+    try:
+        residentes, dispositivos, anos = (int(parte) for parte in texto.lower().split('x'))
+    except ValueError:
+        raise CommandError(f'Tamanho inválido: {texto} (usar residentesxdispositivosxanos, ex.: 50x6x3)')
+    return residentes, dispositivos, anos
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _limpar_caches(residente):
+    for cache in caches.all():
+        cache.clear()
+    relatorios_pdf.apagar_residente(residente.pk)
+
+
+class Command(BaseCommand):
+    help = ('Gera dados sintéticos em várias dimensões (numa base de dados de teste SQLite) e mede o tempo e o '
+            'número de queries das vistas principais. Resultado em JSON, para comparar entre commits.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanhos', default=TAMANHOS,
+                            help='Lista residentesxdispositivosxanos separada por vírgulas (ex.: 10x4x2,50x6x3)')
+        parser.add_argument('--repeticoes', type=int, default=5, help='Pedidos com cache quente por vista')
+        parser.add_argument('--fornecedores', type=int, default=5)
+        parser.add_argument('--semente', type=int, default=1)
+        parser.add_argument('--saida', help='Ficheiro onde escrever o JSON (por omissão, o stdout)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Os benchmarks correm em SQLite: usar --settings=Projeto_appw.settings_benchmark')
+        tamanhos = [_tamanho(texto) for texto in options['tamanhos'].split(',') if texto.strip()]
+
+        resultado = {
+            'commit': _commit(),
+            'data': datetime.datetime.now().isoformat(timespec='seconds'),
+            'repeticoes': options['repeticoes'],
+            'tamanhos': [],
+        }
+        setup_test_environment()
+        try:
+            for residentes, dispositivos, anos in tamanhos:
+                self.stderr.write(f'A medir {residentes} residentes x {dispositivos} dispositivos x {anos} anos...')
+                nome_original = connection.settings_dict['NAME']
+                connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                try:
+                    resultado['tamanhos'].append(self._medir_tamanho(residentes, dispositivos, anos, options))
+                finally:
+                    connection.creation.destroy_test_db(nome_original, verbosity=0)
+        finally:
+            teardown_test_environment()
+
+        texto = json.dumps(resultado, indent=2)
+        if options['saida']:
+            with open(options['saida'], 'w', encoding='utf-8') as ficheiro:
+                ficheiro.write(texto)
+            self.stderr.write(f"Resultado escrito em {options['saida']}")
+        else:
+            self.stdout.write(texto)
+
+    def _medir_tamanho(self, residentes, dispositivos, anos, options):
+        dados = gerar(
+            residentes=residentes, dispositivos=dispositivos, anos=anos,
+            fornecedores=options['fornecedores'], semente=options['semente'],
+        )
+        ano = dados['anos'][-1]
+        residente = Residente.objects.filter(status=1).select_related('utilizador').order_by('pk').first()
+        cliente = Client()
+        cliente.force_login(residente.utilizador)
+        administrador = Client()
+        administrador.force_login(User.objects.create_superuser('benchmark', 'benchmark@exemplo.pt', None))
+
+        vistas = {
+            'dashboard': (cliente, f"{reverse('dashboard')}?ano={ano}&mes=6"),
+            'relatorios': (cliente, f"{reverse('relatorios')}?ano={ano}&mes=6"),
+            'gerar_pdf': (cliente, reverse('gerar_pdf', args=['anual', ano, 6])),
+            'lista_fornecedores': (cliente, reverse('lista_fornecedores')),
+            'registar_consumo': (cliente, reverse('registar_consumo')),
+            'gerir_utilizadores': (administrador, reverse('gerir_utilizadores')),
+        }
+        medidas = {}
+        for nome, (cliente_vista, url) in vistas.items():
+            _limpar_caches(residente)
+            medidas[nome] = {'frio': self._pedido(cliente_vista, url)}
+            if nome == 'gerar_pdf':
+                self._esperar_pdf(cliente_vista, url)
+            quentes = [self._pedido(cliente_vista, url) for _ in range(options['repeticoes'])]
+            tempos = [medida['ms'] for medida in quentes]
+            medidas[nome]['quente'] = {
+                'status': quentes[-1]['status'],
+                'queries': quentes[-1]['queries'],
+                'ms': {
+                    'mediana': round(statistics.median(tempos), 2),
+                    'min': round(min(tempos), 2),
+                    'max': round(max(tempos), 2),
+                },
+            }
+        return {'dados': dados, 'vistas': medidas}
+
+    def _pedido(self, cliente, url):
+        with CaptureQueriesContext(connection) as queries:
+            inicio = time.perf_counter()
+            resposta = cliente.get(url)
+            if resposta.streaming:
+                b''.join(resposta.streaming_content)
+            duracao = time.perf_counter() - inicio
+        if hasattr(resposta, 'close'):
+            resposta.close()
+        return {'status': resposta.status_code, 'queries': len(queries), 'ms': round(duracao * 1000, 2)}
+
+    # O PDF é gerado em segundo plano: espera que fique pronto antes das medições com cache quente
+    def _esperar_pdf(self, cliente, url):
+        limite = time.monotonic() + ESPERA_PDF
+        while time.monotonic() < limite:
+            if cliente.get(url).status_code == 200:
+                return
+            time.sleep(0.1)
+        raise CommandError('O relatório PDF não ficou pronto a tempo.')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Gestao_Consumos.ingestao import gerar_chave
+from Gestao_Consumos.models import Residente
+
+
+class Command(BaseCommand):
+    help = 'Cria uma chave de acesso à API de ingestão (/api/leituras/) para um medidor de um residente.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('residente', help='Email do residente')
+        parser.add_argument('nome', help='Nome do medidor/gateway')
+
+    def handle(self, *args, **options):
+        try:
+            residente = Residente.objects.get(email=options['residente'])
+        except Residente.DoesNotExist:
+            raise CommandError(f"Residente {options['residente']} não existe.")
+
+        registo, chave = gerar_chave(residente, options['nome'])
+        self.stdout.write(self.style.SUCCESS(f'Chave criada para "{registo.nome}" (guarde-a, não volta a ser mostrada):'))
+        self.stdout.write(chave)
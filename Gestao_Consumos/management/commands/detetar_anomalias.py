@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Gestao_Consumos import anomalias
+
+
+class Command(BaseCommand):
+    help = ('Compara todas as leituras (RegistoConsumo) com o histórico do próprio dispositivo (z-score robusto: '
+            'mediana e MAD) e grava as suspeitas em AnomaliaLeitura, substituindo a análise anterior. '
+            'As leituras sinalizadas aparecem no Django Admin.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limiar', type=float, default=anomalias.LIMIAR,
+                            help='Z-score robusto a partir do qual a leitura é sinalizada')
+        parser.add_argument('--dispositivo', type=int, action='append', dest='dispositivos',
+                            help='Analisar só este dispositivo (pode repetir-se)')
+
+    def handle(self, *args, **options):
+        if options['limiar'] <= 0:
+            raise CommandError('--limiar tem de ser positivo.')
+
+        inicio = time.perf_counter()
+        analisadas, sinalizadas = anomalias.analisar(options['dispositivos'], options['limiar'])
+        self.stdout.write(
+            f"{analisadas} leituras analisadas, {sinalizadas} sinalizadas ({time.perf_counter() - inicio:.2f} s)"
+        )
+        self.stdout.write(self.style.SUCCESS('Anomalias de leituras atualizadas.'))
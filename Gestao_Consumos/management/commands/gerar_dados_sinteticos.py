@@ -0,0 +1,24 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from Gestao_Consumos.dados_sinteticos import gerar
+
+
+class Command(BaseCommand):
+    help = 'Gera residentes, dispositivos, leituras mensais, fornecedores, tarifas e metas sintéticos (reprodutíveis pela semente).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--residentes', type=int, default=10)
+        parser.add_argument('--dispositivos', type=int, default=4, help='Dispositivos por residente')
+        parser.add_argument('--anos', type=int, default=2, help='Anos de leituras mensais (até ao ano atual)')
+        parser.add_argument('--fornecedores', type=int, default=3)
+        parser.add_argument('--semente', type=int, default=1)
+        parser.add_argument('--password', default='sintetico', help='Password das contas criadas')
+
+    def handle(self, *args, **options):
+        resultado = gerar(
+            residentes=options['residentes'], dispositivos=options['dispositivos'], anos=options['anos'],
+            fornecedores=options['fornecedores'], semente=options['semente'], password=options['password'],
+        )
+        self.stdout.write(self.style.SUCCESS(json.dumps(resultado)))
@@ -0,0 +1,40 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from Gestao_Consumos.importacao import Importador, ler_csv, TAMANHO_LOTE
+from Gestao_Consumos.models import Residente
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa leituras de consumo de um CSV (colunas: dispositivo ou dispositivo_id, ano, mes, valor[, unidade]).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('ficheiro', help='Caminho do ficheiro CSV (UTF-8)')
+        parser.add_argument('--residente', help='Email do residente; permite identificar dispositivos pelo nome (coluna dispositivo)')
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE, help='Linhas por transação')
+
+    def handle(self, *args, **options):
+        residente = None
+        if options['residente']:
+            try:
+                residente = Residente.objects.get(email=options['residente'])
+            except Residente.DoesNotExist:
+                raise CommandError(f"Residente {options['residente']} não existe.")
+
+        importador = Importador(residente=residente, tamanho_lote=options['lote'])
+        try:
+            with open(options['ficheiro'], newline='', encoding='utf-8-sig') as ficheiro:
+                resultado = importador.importar(ler_csv(ficheiro))
+        except OSError as e:
+            raise CommandError(f'Não foi possível ler o ficheiro: {e}')
+        except ValidationError as e:
+            raise CommandError(' '.join(e.messages))
+
+        for linha, mensagem in sorted(resultado.erros + resultado.conflitos):
+            self.stderr.write(f'Linha {linha}: {mensagem}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{resultado.criados} registos criados, {resultado.duplicados} duplicados ignorados, '
+            f'{len(resultado.conflitos)} em conflito com leituras existentes, {len(resultado.erros)} linhas com erros.'
+        ))
@@ -0,0 +1,69 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Corre num interpretador novo: mede django.setup() e o import do URLconf (que importa as views)
+SCRIPT = r'''
+import json, os, sys, time
+inicio = time.perf_counter()
+import django
+django.setup()
+depois_setup = time.perf_counter()
+from django.urls import get_resolver
+get_resolver().url_patterns
+fim = time.perf_counter()
+print(json.dumps({
+    'setup': depois_setup - inicio,
+    'urlconf': fim - depois_setup,
+    'total': fim - inicio,
+    'weasyprint': 'weasyprint' in sys.modules,
+    'numpy': 'numpy' in sys.modules,
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Mede o tempo de arranque (django.setup() + import do URLconf) em processos novos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticoes', type=int, default=5)
+        parser.add_argument('--json', action='store_true', help='Escreve o resultado em JSON')
+
+    def handle(self, *args, **options):
+        ambiente = dict(os.environ)
+        ambiente.setdefault('DJANGO_SETTINGS_MODULE', 'Projeto_appw.settings')
+        medicoes = []
+        for _ in range(options['repeticoes']):
+            processo = subprocess.run(
+                [sys.executable, '-c', SCRIPT], capture_output=True, text=True, env=ambiente, cwd=os.getcwd()
+            )
+            if processo.returncode != 0:
+                raise CommandError(processo.stderr.strip())
+            medicoes.append(json.loads(processo.stdout.strip().splitlines()[-1]))
+
+        resultado = {
+            'repeticoes': len(medicoes),
+            'weasyprint_importado': any(m['weasyprint'] for m in medicoes),
+            'numpy_importado': any(m['numpy'] for m in medicoes),
+        }
+        for fase in ('setup', 'urlconf', 'total'):
+            tempos = [m[fase] * 1000 for m in medicoes]
+            resultado[f'{fase}_ms'] = {
+                'mediana': round(statistics.median(tempos), 1),
+                'min': round(min(tempos), 1),
+                'max': round(max(tempos), 1),
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(resultado))
+            return
+        self.stdout.write(f"Arranque ({resultado['repeticoes']} processos):")
+        for fase in ('setup', 'urlconf', 'total'):
+            tempos = resultado[f'{fase}_ms']
+            self.stdout.write(f"  {fase:8} mediana {tempos['mediana']} ms (min {tempos['min']}, max {tempos['max']})")
+        self.stdout.write(f"  WeasyPrint importado no arranque: {'sim' if resultado['weasyprint_importado'] else 'não'}")
+        self.stdout.write(f"  NumPy importado no arranque: {'sim' if resultado['numpy_importado'] else 'não'}")
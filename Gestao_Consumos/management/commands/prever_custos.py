@@ -0,0 +1,32 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from Gestao_Consumos import previsao
+
+
+class Command(BaseCommand):
+    help = ('Prevê o consumo e o custo de cada tipo (luz, água, gás) no mês de referência e no seguinte para todos os '
+            'residentes ativos, a partir do histórico mensal (nível + sazonalidade + tendência), e grava-os em '
+            'PrevisaoCusto. Correr todas as noites, antes de avaliar_orcamentos.')
+
+    def add_arguments(self, parser):
+        hoje = datetime.date.today()
+        parser.add_argument('--ano', type=int, default=hoje.year)
+        parser.add_argument('--mes', type=int, default=hoje.month)
+        parser.add_argument('--historico', type=int, default=previsao.MESES_HISTORICO, help='Meses de histórico usados')
+
+    def handle(self, *args, **options):
+        if not 1 <= options['mes'] <= 12:
+            raise CommandError('O mês tem de estar entre 1 e 12.')
+        if options['historico'] < 1:
+            raise CommandError('--historico tem de ser positivo.')
+
+        inicio = time.perf_counter()
+        gravadas = previsao.prever(options['ano'], options['mes'], meses_historico=options['historico'])
+        self.stdout.write(
+            f"{gravadas} previsões a partir de {options['mes']:02d}/{options['ano']} "
+            f"({time.perf_counter() - inicio:.2f} s)"
+        )
+        self.stdout.write(self.style.SUCCESS('Previsões de custos atualizadas.'))
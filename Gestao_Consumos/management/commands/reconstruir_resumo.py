@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Gestao_Consumos import resumo
+from Gestao_Consumos.models import Residente
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói o resumo mensal (ResumoMensal) a partir dos registos de consumo e verifica-o.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--residente', help='Email do residente (por omissão, todos)')
+        parser.add_argument(
+            '--apenas-verificar', action='store_true',
+            help='Não reconstrói; apenas compara o resumo com a tabela de registos'
+        )
+
+    def handle(self, *args, **options):
+        residente = None
+        if options['residente']:
+            try:
+                residente = Residente.objects.get(email=options['residente'])
+            except Residente.DoesNotExist:
+                raise CommandError(f"Residente {options['residente']} não existe.")
+
+        if not options['apenas_verificar']:
+            criados = resumo.reconstruir(residente)
+            self.stdout.write(f'Resumo reconstruído: {criados} linhas.')
+
+        diferencas = resumo.verificar(residente)
+        for chave, esperado, atual in diferencas[:50]:
+            self.stdout.write(f'  {chave}: registos={esperado} resumo={atual}')
+        if diferencas:
+            raise CommandError(f'O resumo tem {len(diferencas)} diferenças em relação aos registos.')
+        self.stdout.write(self.style.SUCCESS('Resumo coerente com os registos de consumo.'))
@@ -0,0 +1,208 @@
+import io
+import json
+import logging
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.urls import reverse
+from django.utils import timezone
+
+from Gestao_Consumos.dados_sinteticos import DOMINIO_EMAIL
+from Gestao_Consumos.forms import ANOS_CHOICES
+from Gestao_Consumos.models import Residente, Dispositivo, FornecedorTipo
+
+
+# Cliente HTTP mínimo que chama a aplicação WSGI diretamente (sem servidor nem rede), com cookies e CSRF
+class SessaoWSGI:
+    def __init__(self, aplicacao):
+        self.aplicacao = aplicacao
+        self.cookies = {}
+
+    def pedido(self, metodo, caminho, dados=None):
+        corpo = urlencode(dados or {}).encode('utf-8')
+        caminho, _, query = caminho.partition('?')
+        environ = {
+            'REQUEST_METHOD': metodo,
+            'PATH_INFO': caminho,
+            'QUERY_STRING': query,
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(corpo)),
+            'wsgi.input': io.BytesIO(corpo),
+            'HTTP_COOKIE': '; '.join(f'{nome}={valor}' for nome, valor in self.cookies.items()),
+        }
+        # O token CSRF vai no cabeçalho, como num pedido AJAX
+        if 'csrftoken' in self.cookies:
+            environ['HTTP_X_CSRFTOKEN'] = self.cookies['csrftoken']
+        setup_testing_defaults(environ)
+
+        resposta = {}
+
+        def start_response(status, cabecalhos, exc_info=None):
+            resposta['status'] = int(status.split()[0])
+            resposta['cabecalhos'] = cabecalhos
+
+        iteravel = self.aplicacao(environ, start_response)
+        try:
+            for _ in iteravel:
+                pass
+        finally:
+            if hasattr(iteravel, 'close'):
+                iteravel.close()
+
+        for nome, valor in resposta['cabecalhos']:
+            if nome.lower() != 'set-cookie':
+                continue
+            for chave, morsel in SimpleCookie(valor).items():
+                if morsel['max-age'] == '0':
+                    self.cookies.pop(chave, None)
+                else:
+                    self.cookies[chave] = morsel.value
+        return resposta['status']
+
+
+class Command(BaseCommand):
+    help = ('Teste de carga: várias threads chamam Projeto_appw.wsgi.application com sessões de residentes sintéticos '
+            '(login, dashboard, registo de leitura, relatórios, PDF, mudança de fornecedor) e mostra o débito, os '
+            'percentis de latência e a taxa de erros por vista. Correr sobre a base de dados sintética: '
+            'gerar_dados_sinteticos e depois teste_carga, com o mesmo --settings.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--sessoes', type=int, default=100, help='Número total de sessões de residentes')
+        parser.add_argument('--password', default='sintetico', help='Password das contas sintéticas')
+        parser.add_argument('--semente', type=int, default=1)
+        parser.add_argument('--sem-pdf', action='store_true', help='Não pede relatórios PDF')
+        parser.add_argument('--json', action='store_true', help='Resultado em JSON')
+
+    def handle(self, *args, **options):
+        from Projeto_appw.wsgi import application
+
+        residentes = list(
+            Residente.objects.filter(email__endswith=f'@{DOMINIO_EMAIL}', status=1, utilizador__is_active=True)
+            .values_list('pk', 'email')
+        )
+        if not residentes:
+            raise CommandError('Não há residentes sintéticos ativos: correr primeiro gerar_dados_sinteticos.')
+        dispositivos = {}
+        for pk, residente_id in Dispositivo.objects.filter(
+            residente_id__in=[pk for pk, _ in residentes], status=1
+        ).values_list('pk', 'residente_id'):
+            dispositivos.setdefault(residente_id, []).append(pk)
+        servicos = list(FornecedorTipo.objects.filter(status=1).values_list('pk', flat=True))
+        if settings.DEBUG:
+            self.stderr.write(self.style.WARNING('DEBUG=True: as queries ficam em memória e os tempos pioram.'))
+
+        # Sob carga quase todos os pedidos passam o limiar de "pedido lento": o log só aparece com -v 2
+        if options['verbosity'] < 2:
+            logging.getLogger('Gestao_Consumos.metricas').setLevel(logging.ERROR)
+
+        aleatorio = random.Random(options['semente'])
+        guioes = [
+            self._guiao(aleatorio, email, dispositivos.get(pk, []), servicos, options)
+            for pk, email in (aleatorio.choice(residentes) for _ in range(options['sessoes']))
+        ]
+
+        medicoes = []
+        lock = threading.Lock()
+
+        def correr(guiao):
+            sessao = SessaoWSGI(application)
+            try:
+                for nome, metodo, caminho, dados in guiao:
+                    inicio = time.perf_counter()
+                    try:
+                        status = sessao.pedido(metodo, caminho, dados)
+                    except Exception:
+                        status = None
+                    duracao = (time.perf_counter() - inicio) * 1000
+                    with lock:
+                        medicoes.append((nome, status, duracao))
+            finally:
+                connections.close_all()
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads'], thread_name_prefix='teste-carga') as executor:
+            list(executor.map(correr, guioes))
+        duracao = time.perf_counter() - inicio
+
+        resultado = self._resumo(medicoes, duracao, options)
+        if options['json']:
+            self.stdout.write(json.dumps(resultado, indent=2))
+        else:
+            self._mostrar(resultado)
+
+    # Passos de uma sessão: (nome, método, caminho, dados do POST)
+    def _guiao(self, aleatorio, email, dispositivos, servicos, options):
+        hoje = timezone.localdate()
+        guiao = [
+            ('GET login', 'GET', reverse('login'), None),
+            ('POST login', 'POST', reverse('login'), {'username': email, 'password': options['password']}),
+            ('GET dashboard', 'GET', reverse('dashboard'), None),
+        ]
+        if dispositivos:
+            guiao.append(('POST registar_consumo', 'POST', reverse('registar_consumo'), {
+                'dispositivo': aleatorio.choice(dispositivos),
+                'valor': round(aleatorio.uniform(5, 300), 2),
+                'mes': aleatorio.randint(1, 12),
+                'ano': aleatorio.choice(ANOS_CHOICES)[0],
+            }))
+        guiao.append(('GET relatorios', 'GET', reverse('relatorios'), None))
+        if not options['sem_pdf']:
+            guiao.append(('GET gerar_pdf', 'GET', reverse('gerar_pdf', args=['anual', hoje.year, hoje.month]), None))
+        if servicos:
+            guiao.append(('POST associar_fornecedor', 'POST', reverse('associar_fornecedor'),
+                          {'fornecedor_tipo_pk': aleatorio.choice(servicos)}))
+        guiao.append(('POST logout', 'POST', reverse('logout'), None))
+        return guiao
+
+    def _resumo(self, medicoes, duracao, options):
+        vistas = {}
+        for nome, status, ms in medicoes:
+            vistas.setdefault(nome, []).append((status, ms))
+        resultado = {
+            'threads': options['threads'],
+            'sessoes': options['sessoes'],
+            'pedidos': len(medicoes),
+            'segundos': round(duracao, 2),
+            'pedidos_por_segundo': round(len(medicoes) / duracao, 1) if duracao else None,
+            'vistas': {},
+        }
+        for nome, lista in vistas.items():
+            tempos = sorted(ms for _, ms in lista)
+            # Erros: exceções e respostas 4xx/5xx (os redirecionamentos fazem parte do fluxo normal)
+            erros = sum(1 for status, _ in lista if status is None or status >= 400)
+            percentis = statistics.quantiles(tempos, n=100, method='inclusive') if len(tempos) > 1 else tempos * 99
+            resultado['vistas'][nome] = {
+                'pedidos': len(lista),
+                'p50_ms': round(percentis[49], 1),
+                'p95_ms': round(percentis[94], 1),
+                'p99_ms': round(percentis[98], 1),
+                'erros': erros,
+                'taxa_erros': round(erros / len(lista), 4),
+                'status': dict(sorted(
+                    (str(status), sum(1 for s, _ in lista if s == status)) for status in {s for s, _ in lista}
+                )),
+            }
+        return resultado
+
+    def _mostrar(self, resultado):
+        self.stdout.write(
+            f"{resultado['pedidos']} pedidos em {resultado['segundos']} s com {resultado['threads']} threads: "
+            f"{resultado['pedidos_por_segundo']} pedidos/s"
+        )
+        self.stdout.write(f"{'Vista':<26}{'Pedidos':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'Erros':>8}  Status")
+        for nome, vista in resultado['vistas'].items():
+            linha = (
+                f"{nome:<26}{vista['pedidos']:>9}{vista['p50_ms']:>10}{vista['p95_ms']:>10}{vista['p99_ms']:>10}"
+                f"{vista['taxa_erros']:>8.1%}  {vista['status']}"
+            )
+            self.stdout.write(self.style.ERROR(linha) if vista['erros'] else linha)
@@ -0,0 +1,122 @@
+import contextvars
+import threading
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates, Template
+
+# Amostras guardadas por vista (as mais recentes) para calcular percentis
+AMOSTRAS_POR_VISTA = getattr(settings, 'METRICAS_AMOSTRAS', 1000)
+PERCENTIS = (50, 90, 95, 99)
+# Métricas guardadas por amostra (todas em milissegundos, exceto queries)
+CAMPOS = ('total_ms', 'db_ms', 'queries', 'template_ms')
+
+_pedido_atual = contextvars.ContextVar('metricas_pedido', default=None)
+_amostras = {}
+_duracoes = {}
+_lock = threading.Lock()
+
+
+# Medições de um pedido: tempo na BD, queries (agrupadas pelo SQL, com os parâmetros à parte) e templates
+class MedicaoPedido:
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.db_ms = 0.0
+        self.queries = 0
+        self.template_ms = 0.0
+        self.sql = Counter()
+
+    # connection.execute_wrapper: mede cada query executada durante o pedido
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_ms += (time.perf_counter() - inicio) * 1000
+            self.queries += 1
+            self.sql[sql] += 1
+
+    def total_ms(self):
+        return (time.perf_counter() - self.inicio) * 1000
+
+    # As queries repetidas (mesmo SQL, parâmetros diferentes) denunciam padrões N+1
+    def repetidas(self, limite=5):
+        return [(sql, vezes) for sql, vezes in self.sql.most_common(limite) if vezes > 1]
+
+    def amostra(self):
+        return (self.total_ms(), self.db_ms, self.queries, self.template_ms)
+
+
+def iniciar():
+    medicao = MedicaoPedido()
+    return medicao, _pedido_atual.set(medicao)
+
+
+def terminar(token):
+    _pedido_atual.reset(token)
+
+
+def registar(nome, amostra):
+    with _lock:
+        _amostras.setdefault(nome, deque(maxlen=AMOSTRAS_POR_VISTA)).append(amostra)
+
+
+# Durações medidas fora dos pedidos (ex.: geração dos PDFs no pool de threads)
+def registar_duracao(nome, ms):
+    with _lock:
+        _duracoes.setdefault(nome, deque(maxlen=AMOSTRAS_POR_VISTA)).append(ms)
+
+
+def _percentis(valores):
+    ordenados = sorted(valores)
+    return {
+        f'p{p}': round(ordenados[min(len(ordenados) - 1, max(0, -(-p * len(ordenados) // 100) - 1))], 2)
+        for p in PERCENTIS
+    }
+
+
+# Percentis por nome de URL (e das durações em segundo plano), calculados no momento
+def resumo():
+    with _lock:
+        amostras = {nome: list(valores) for nome, valores in _amostras.items()}
+        duracoes = {nome: list(valores) for nome, valores in _duracoes.items()}
+    vistas = {}
+    for nome, lista in sorted(amostras.items()):
+        vistas[nome] = {'pedidos': len(lista)}
+        for i, campo in enumerate(CAMPOS):
+            vistas[nome][campo] = _percentis([amostra[i] for amostra in lista])
+    return {
+        'vistas': vistas,
+        'segundo_plano': {nome: {'execucoes': len(lista), 'ms': _percentis(lista)} for nome, lista in sorted(duracoes.items())},
+    }
+
+
+def limpar():
+    with _lock:
+        _amostras.clear()
+        _duracoes.clear()
+
+
+# ===== TEMPLATES =====
+
+# Backend de templates igual ao do Django, mas que soma o tempo de render ao pedido atual
+class TemplatesInstrumentados(DjangoTemplates):
+    def from_string(self, template_code):
+        return TemplateInstrumentado(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TemplateInstrumentado(template.template, self)
+
+
+class TemplateInstrumentado(Template):
+    def render(self, context=None, request=None):
+        medicao = _pedido_atual.get()
+        if medicao is None:
+            return super().render(context, request)
+        inicio = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            medicao.template_ms += (time.perf_counter() - inicio) * 1000
@@ -0,0 +1,111 @@
+import logging
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.utils.functional import SimpleLazyObject
+
+from . import metricas
+from .models import Residente
+
+logger = logging.getLogger('Gestao_Consumos.metricas')
+
+# Sessão: [id do utilizador, id do residente] (o id do utilizador protege contra sessões reaproveitadas)
+CHAVE_SESSAO = 'residente'
+
+
+# Residente da conta de login; o administrador sem residente fica com o residente "Root" do sistema
+def _resolver(user):
+    try:
+        return Residente.objects.get(utilizador=user)
+    except Residente.DoesNotExist:
+        pass
+
+    # Contas criadas fora do registo (ex.: createsuperuser): liga pelo email uma única vez
+    residente = Residente.objects.filter(email=user.email, utilizador__isnull=True).first() if user.email else None
+    if residente is None and user.is_superuser:
+        residente, _ = Residente.objects.get_or_create(
+            telemovel='999999999',
+            defaults={
+                'nome': 'Administrador (Root)',
+                'email': user.email,
+                'password': 'root_password_placeholder',
+                'morada': 'Sede Administrativa',
+                'cidade': 'Sistema',
+                'codigo_postal': '0000-000',
+                'status': 1
+            }
+        )
+        if residente.utilizador_id not in (None, user.pk):
+            return residente
+    if residente is not None:
+        residente.utilizador = user
+        residente.save(update_fields=['utilizador'])
+    return residente
+
+
+# Resolve o residente do pedido uma vez (e guarda o id na sessão para os pedidos seguintes)
+def obter_residente(request):
+    if hasattr(request, '_residente'):
+        return request._residente
+
+    user = request.user
+    residente = None
+    if user.is_authenticated:
+        guardado = request.session.get(CHAVE_SESSAO)
+        if guardado and guardado[0] == user.pk:
+            residente = Residente.objects.filter(pk=guardado[1]).first()
+        if residente is None:
+            residente = _resolver(user)
+            if residente is not None:
+                request.session[CHAVE_SESSAO] = [user.pk, residente.pk]
+
+    request._residente = residente
+    return residente
+
+
+# Disponibiliza request.residente (só faz a query se for usado)
+class ResidenteMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.residente = SimpleLazyObject(lambda: obter_residente(request))
+        return self.get_response(request)
+
+
+# Mede cada pedido (tempo total, queries e tempo na BD, render dos templates), devolve as medições no
+# cabeçalho Server-Timing, regista os pedidos lentos e acumula as amostras por nome de URL (ver metricas.py)
+class MetricasMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.limiar_ms = getattr(settings, 'METRICAS_PEDIDO_LENTO_MS', 500)
+        self.server_timing = getattr(settings, 'METRICAS_SERVER_TIMING', True)
+
+    def __call__(self, request):
+        medicao, token = metricas.iniciar()
+        try:
+            with ExitStack() as pilha:
+                for ligacao in connections.all():
+                    pilha.enter_context(ligacao.execute_wrapper(medicao))
+                response = self.get_response(request)
+        finally:
+            metricas.terminar(token)
+
+        total_ms, db_ms, queries, template_ms = amostra = medicao.amostra()
+        match = request.resolver_match
+        nome = match.view_name if match else '<sem rota>'
+        metricas.registar(nome, amostra)
+
+        if self.server_timing:
+            response['Server-Timing'] = (
+                f'total;dur={total_ms:.1f}, db;dur={db_ms:.1f};desc="{queries} queries", tpl;dur={template_ms:.1f}'
+            )
+        if total_ms >= self.limiar_ms:
+            repetidas = '\n'.join(f'  {vezes}x {sql[:300]}' for sql, vezes in medicao.repetidas())
+            logger.warning(
+                'Pedido lento: %s %s (%s) %.0f ms, %d queries (%.0f ms na BD), templates %.0f ms%s',
+                request.method, request.get_full_path(), nome, total_ms, queries, db_ms, template_ms,
+                '\nQueries repetidas:\n' + repetidas if repetidas else ''
+            )
+        return response
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+
+# Preenche o resumo com os registos já existentes
+def preencher_resumo(apps, schema_editor):
+    RegistoConsumo = apps.get_model('Gestao_Consumos', 'RegistoConsumo')
+    ResumoMensal = apps.get_model('Gestao_Consumos', 'ResumoMensal')
+    linhas = RegistoConsumo.objects.annotate(
+        ano=ExtractYear('timestamp'), mes=ExtractMonth('timestamp')
+    ).order_by().values(
+        'dispositivo__residente', 'dispositivo__tipo', 'dispositivo__categoria', 'ano', 'mes'
+    ).annotate(total=Sum('valor'), registos=Count('pk'))
+    ResumoMensal.objects.bulk_create([
+        ResumoMensal(
+            residente_id=linha['dispositivo__residente'], tipo_id=linha['dispositivo__tipo'],
+            categoria_id=linha['dispositivo__categoria'], ano=linha['ano'], mes=linha['mes'],
+            total=linha['total'], registos=linha['registos']
+        )
+        for linha in linhas
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Gestao_Consumos', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResumoMensal',
+            fields=[
+                ('id_resumo', models.AutoField(primary_key=True, serialize=False)),
+                ('ano', models.PositiveSmallIntegerField()),
+                ('mes', models.PositiveSmallIntegerField()),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('registos', models.IntegerField(default=0)),
+                ('categoria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Gestao_Consumos.categoria')),
+                ('residente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Gestao_Consumos.residente')),
+                ('tipo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Gestao_Consumos.tipo')),
+            ],
+            options={
+                'verbose_name': 'Resumo Mensal',
+                'verbose_name_plural': 'Resumos Mensais',
+                'unique_together': {('residente', 'tipo', 'categoria', 'ano', 'mes')},
+            },
+        ),
+        migrations.RunPython(preencher_resumo, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Gestao_Consumos', '0002_resumomensal'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fornecedorresidente',
+            index=models.Index(fields=['residente', 'status'], name='contrato_residente_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fornecedorvalor',
+            index=models.Index(fields=['fornecedor_tipo', 'timestamp'], name='tarifa_servico_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orcamento_limite',
+            index=models.Index(fields=['residente', 'timestamp'], name='orcamento_residente_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registoconsumo',
+            index=models.Index(fields=['dispositivo', 'timestamp'], name='registo_disp_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='resumomensal',
+            index=models.Index(fields=['residente', 'ano', 'mes'], name='resumo_residente_periodo_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:54
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Gestao_Consumos', '0003_indices_periodo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChaveMedidor',
+            fields=[
+                ('id_chave', models.AutoField(primary_key=True, serialize=False)),
+                ('nome', models.CharField(max_length=100)),
+                ('chave_hash', models.CharField(max_length=64, unique=True)),
+                ('status', models.IntegerField(default=1)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ultimo_uso', models.DateTimeField(blank=True, null=True)),
+                ('residente', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='Gestao_Consumos.residente')),
+            ],
+            options={
+                'verbose_name': 'Chave de Medidor',
+                'verbose_name_plural': 'Chaves de Medidores',
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Liga as contas existentes aos residentes pelo email (como era feito até aqui em cada pedido)
+def ligar_utilizadores(apps, schema_editor):
+    Residente = apps.get_model('Gestao_Consumos', 'Residente')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+
+    utilizadores = {}
+    for pk, email in User.objects.exclude(email='').order_by('pk').values_list('pk', 'email'):
+        utilizadores.setdefault(email.lower(), pk)
+
+    ligados = set()
+    for residente in Residente.objects.filter(utilizador__isnull=True).only('pk', 'email'):
+        utilizador_id = utilizadores.get((residente.email or '').lower())
+        if utilizador_id and utilizador_id not in ligados:
+            Residente.objects.filter(pk=residente.pk).update(utilizador_id=utilizador_id)
+            ligados.add(utilizador_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('Gestao_Consumos', '0004_chavemedidor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='residente',
+            name='utilizador',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='residente', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(ligar_utilizadores, migrations.RunPython.noop),
+    ]
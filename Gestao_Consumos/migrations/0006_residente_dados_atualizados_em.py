@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:03
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Gestao_Consumos', '0005_residente_utilizador'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='residente',
+            name='dados_atualizados_em',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
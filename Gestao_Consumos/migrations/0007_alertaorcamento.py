@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:20
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Gestao_Consumos', '0006_residente_dados_atualizados_em'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertaOrcamento',
+            fields=[
+                ('id_alerta', models.AutoField(primary_key=True, serialize=False)),
+                ('ano', models.PositiveSmallIntegerField()),
+                ('mes', models.PositiveSmallIntegerField()),
+                ('custo', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('meta', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('estado', models.CharField(choices=[('excedido', 'Excedido'), ('dentro', 'Dentro do orçamento'), ('sem_meta', 'Sem meta')], max_length=10)),
+                ('avaliado_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('residente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Gestao_Consumos.residente')),
+            ],
+            options={
+                'verbose_name': 'Alerta de Orçamento',
+                'verbose_name_plural': 'Alertas de Orçamento',
+                'indexes': [models.Index(fields=['ano', 'mes', 'estado'], name='alerta_periodo_estado_idx')],
+                'unique_together': {('residente', 'ano', 'mes')},
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:24
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Gestao_Consumos', '0007_alertaorcamento'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrevisaoCusto',
+            fields=[
+                ('id_previsao', models.AutoField(primary_key=True, serialize=False)),
+                ('ano', models.PositiveSmallIntegerField()),
+                ('mes', models.PositiveSmallIntegerField()),
+                ('consumo', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('custo', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('meses_historico', models.PositiveSmallIntegerField(default=0)),
+                ('calculado_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('residente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Gestao_Consumos.residente')),
+                ('tipo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Gestao_Consumos.tipo')),
+            ],
+            options={
+                'verbose_name': 'Previsão de Custo',
+                'verbose_name_plural': 'Previsões de Custos',
+                'unique_together': {('residente', 'tipo', 'ano', 'mes')},
+            },
+        ),
+    ]
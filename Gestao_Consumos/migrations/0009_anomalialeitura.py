@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:30
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Gestao_Consumos', '0008_previsaocusto'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnomaliaLeitura',
+            fields=[
+                ('id_anomalia', models.AutoField(primary_key=True, serialize=False)),
+                ('pontuacao', models.FloatField()),
+                ('valor_habitual', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('detetada_em', models.DateTimeField(default=django.utils.timezone.now)),
+                ('registo', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='Gestao_Consumos.registoconsumo')),
+            ],
+            options={
+                'verbose_name': 'Anomalia de Leitura',
+                'verbose_name_plural': 'Anomalias de Leituras',
+                'ordering': ['-detetada_em'],
+            },
+        ),
+    ]
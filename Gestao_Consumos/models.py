@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
 from django.core.exceptions import ValidationError
@@ -16,6 +17,13 @@ class Residente(models.Model):
     
     #Se for 0 está inativo, se for 1 está ativo no sistema (Histórico guardado)
     status = models.IntegerField(default=0)
+    #Conta de login (auth.User) deste residente
+    utilizador = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True, related_name='residente'
+    )
+    #Última alteração dos dados mostrados ao residente (registos, metas, dispositivos, contratos, tarifas)
+    #Usada como versão para ETag/Last-Modified (ver versoes.py)
+    dados_atualizados_em = models.DateTimeField(default=timezone.now)
     #Django Admin
     class Meta:
         verbose_name = "Residente"
@@ -120,6 +128,9 @@ class RegistoConsumo(models.Model):
         verbose_name = "Registo de Consumo"
         verbose_name_plural = "Registos de Consumo"
         ordering = ['-timestamp'] 
+        indexes = [
+            models.Index(fields=['dispositivo', 'timestamp'], name='registo_disp_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.dispositivo.nome} - {self.valor} ({self.timestamp.strftime('%Y-%m-%d')})"
@@ -176,6 +187,9 @@ class FornecedorValor(models.Model):
         verbose_name = "Tarifa / Preço"
         verbose_name_plural = "Histórico de Tarifas"
         ordering = ['-timestamp'] #Ordenar por data decrescente
+        indexes = [
+            models.Index(fields=['fornecedor_tipo', 'timestamp'], name='tarifa_servico_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.fornecedor_tipo} - {self.valor}€"
@@ -195,6 +209,9 @@ class FornecedorResidente(models.Model):
     class Meta:
         verbose_name = "Contrato de Residente"
         verbose_name_plural = "Contratos de Residentes"
+        indexes = [
+            models.Index(fields=['residente', 'status'], name='contrato_residente_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.residente.nome} - {self.fornecedor_tipo}"
@@ -213,7 +230,138 @@ class Orcamento_limite(models.Model):
         verbose_name_plural = "Orçamentos e Limites"
 
         unique_together = ('residente', 'tipo', 'timestamp') 
+        #O unique_together já cobre (residente, tipo, timestamp); este serve as metas do mês sem tipo
+        indexes = [
+            models.Index(fields=['residente', 'timestamp'], name='orcamento_residente_ts_idx'),
+        ]
+
+
+    def __str__(self):
+        return f"{self.residente.nome} - Limite {self.tipo.tipo}: {self.valor}€"
+
+#Tabela de resumo mensal dos consumos por residente, tipo e categoria
+#Mantida incrementalmente a partir do RegistoConsumo (ver resumo.py)
+class ResumoMensal(models.Model):
+    id_resumo = models.AutoField(primary_key=True)
+    residente = models.ForeignKey(Residente, on_delete=models.CASCADE)
+    tipo = models.ForeignKey(Tipo, on_delete=models.CASCADE)
+    categoria = models.ForeignKey(Categoria, on_delete=models.CASCADE)
+    ano = models.PositiveSmallIntegerField()
+    mes = models.PositiveSmallIntegerField()
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    registos = models.IntegerField(default=0)
+
+    #Django Admin
+    class Meta:
+        verbose_name = "Resumo Mensal"
+        verbose_name_plural = "Resumos Mensais"
+
+        unique_together = ('residente', 'tipo', 'categoria', 'ano', 'mes')
+        indexes = [
+            models.Index(fields=['residente', 'ano', 'mes'], name='resumo_residente_periodo_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.residente_id} - {self.tipo_id}/{self.categoria_id} ({self.mes}/{self.ano}): {self.total}"
+
+
+#Chaves de acesso dos medidores/gateways que enviam leituras pela API de ingestão
+#Só se guarda o hash (SHA-256) da chave; a chave em claro é mostrada uma única vez
+class ChaveMedidor(models.Model):
+    id_chave = models.AutoField(primary_key=True)
+    residente = models.ForeignKey(Residente, on_delete=models.PROTECT)
+    nome = models.CharField(max_length=100)
+    chave_hash = models.CharField(max_length=64, unique=True)
+    # Status: 0 = Revogada, 1 = Ativa
+    status = models.IntegerField(default=1)
+    timestamp = models.DateTimeField(default=timezone.now)
+    ultimo_uso = models.DateTimeField(blank=True, null=True)
+
+    #Django Admin
+    class Meta:
+        verbose_name = "Chave de Medidor"
+        verbose_name_plural = "Chaves de Medidores"
 
+    def __str__(self):
+        return f"{self.residente.nome} - {self.nome}"
+
+
+#Estado do orçamento de cada residente em cada mês (custo total do mês vs soma das metas)
+#Calculado pelo comando avaliar_orcamentos (em lote) e pelo dashboard; uma linha por residente/mês
+class AlertaOrcamento(models.Model):
+    EXCEDIDO = 'excedido'
+    DENTRO = 'dentro'
+    SEM_META = 'sem_meta'
+    ESTADOS = [
+        (EXCEDIDO, 'Excedido'),
+        (DENTRO, 'Dentro do orçamento'),
+        (SEM_META, 'Sem meta'),
+    ]
+
+    id_alerta = models.AutoField(primary_key=True)
+    residente = models.ForeignKey(Residente, on_delete=models.CASCADE)
+    ano = models.PositiveSmallIntegerField()
+    mes = models.PositiveSmallIntegerField()
+    custo = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    meta = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    estado = models.CharField(max_length=10, choices=ESTADOS)
+    avaliado_em = models.DateTimeField(default=timezone.now)
+
+    #Django Admin
+    class Meta:
+        verbose_name = "Alerta de Orçamento"
+        verbose_name_plural = "Alertas de Orçamento"
+
+        unique_together = ('residente', 'ano', 'mes')
+        #Listagem de quem excedeu o orçamento num mês
+        indexes = [
+            models.Index(fields=['ano', 'mes', 'estado'], name='alerta_periodo_estado_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.residente.nome} ({self.mes}/{self.ano}): {self.get_estado_display()}"
+
+
+#Previsão do consumo e do custo de cada tipo para o mês atual e o seguinte (comando prever_custos)
+#O consumo da luz já desconta a produção prevista dos geradores
+class PrevisaoCusto(models.Model):
+    id_previsao = models.AutoField(primary_key=True)
+    residente = models.ForeignKey(Residente, on_delete=models.CASCADE)
+    tipo = models.ForeignKey(Tipo, on_delete=models.CASCADE)
+    ano = models.PositiveSmallIntegerField()
+    mes = models.PositiveSmallIntegerField()
+    consumo = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    custo = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    #Meses com leituras usados na previsão (poucos meses = previsão pouco fiável)
+    meses_historico = models.PositiveSmallIntegerField(default=0)
+    calculado_em = models.DateTimeField(default=timezone.now)
+
+    #Django Admin
+    class Meta:
+        verbose_name = "Previsão de Custo"
+        verbose_name_plural = "Previsões de Custos"
+
+        unique_together = ('residente', 'tipo', 'ano', 'mes')
+
+    def __str__(self):
+        return f"{self.residente_id} - {self.tipo_id} ({self.mes}/{self.ano}): {self.custo}€"
+
+
+#Leituras suspeitas: muito afastadas do histórico do próprio dispositivo (comando detetar_anomalias e registo manual)
+class AnomaliaLeitura(models.Model):
+    id_anomalia = models.AutoField(primary_key=True)
+    registo = models.OneToOneField(RegistoConsumo, on_delete=models.CASCADE)
+    #Z-score robusto: distância à mediana do dispositivo, em desvios (MAD)
+    pontuacao = models.FloatField()
+    #Mediana das leituras do dispositivo
+    valor_habitual = models.DecimalField(max_digits=10, decimal_places=2)
+    detetada_em = models.DateTimeField(default=timezone.now)
+
+    #Django Admin
+    class Meta:
+        verbose_name = "Anomalia de Leitura"
+        verbose_name_plural = "Anomalias de Leituras"
+        ordering = ['-detetada_em']
 
     def __str__(self):
-        return f"{self.residente.nome} - Limite {self.tipo.tipo}: {self.valor}€"
\ No newline at end of file
+        return f"Registo {self.registo_id}: {self.pontuacao:.1f}"
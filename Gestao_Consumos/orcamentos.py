@@ -0,0 +1,141 @@
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+import django
+from django.db import connection, connections
+from django.db.models import Sum
+from django.utils import timezone
+
+from .custos import consumos_liquidos, custos_de
+from .models import AlertaOrcamento, Orcamento_limite, Residente, ResumoMensal
+from .periodos import filtro_mes
+from .tarifas import LinhaTemporalTarifas
+
+# Residentes avaliados de cada vez: o número de queries é fixo por bloco
+TAMANHO_BLOCO = 500
+CAMPOS_ATUALIZADOS = ['custo', 'meta', 'estado', 'avaliado_em']
+
+
+# Mesma regra do dashboard: só há alerta quando existe meta
+def estado_de(custo, meta):
+    if meta > 0 and custo > meta:
+        return AlertaOrcamento.EXCEDIDO
+    if meta > 0:
+        return AlertaOrcamento.DENTRO
+    return AlertaOrcamento.SEM_META
+
+
+def _novo_alerta(residente_id, ano, mes, custo, meta, agora):
+    return AlertaOrcamento(
+        residente_id=residente_id, ano=ano, mes=mes, custo=Decimal(str(custo)).quantize(Decimal('0.01')),
+        meta=Decimal(str(meta)).quantize(Decimal('0.01')), estado=estado_de(custo, meta), avaliado_em=agora
+    )
+
+
+# INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE: voltar a avaliar o mesmo mês só atualiza as linhas
+def _gravar(alertas):
+    # O MySQL não aceita indicar a chave do conflito (usa qualquer índice único)
+    chave = ['residente', 'ano', 'mes'] if connection.features.supports_update_conflicts_with_target else None
+    AlertaOrcamento.objects.bulk_create(
+        alertas, update_conflicts=True, unique_fields=chave, update_fields=CAMPOS_ATUALIZADOS, batch_size=TAMANHO_BLOCO
+    )
+
+
+def _avaliar_bloco(ano, mes, residente_ids):
+    # O instante é tirado antes de ler os dados: uma escrita concorrente durante a avaliação fica com uma versão
+    # (dados_atualizados_em) posterior e o alerta gravado aparece como desatualizado (ver alerta_atual)
+    agora = timezone.now()
+
+    # Somas do mês por residente x tipo x categoria, lidas do resumo mensal
+    somas = defaultdict(lambda: defaultdict(float))
+    for residente_id, tipo_nome, categoria_nome, total in ResumoMensal.objects.filter(
+        residente_id__in=residente_ids, ano=ano, mes=mes
+    ).values_list('residente_id', 'tipo__tipo', 'categoria__categoria', 'total'):
+        somas[residente_id][(tipo_nome, categoria_nome)] += float(total)
+
+    metas = dict(
+        Orcamento_limite.objects.filter(residente_id__in=residente_ids, **filtro_mes(ano, mes))
+        .order_by().values('residente_id').annotate(total=Sum('valor')).values_list('residente_id', 'total')
+    )
+    # Contratos e tarifas do bloco (duas queries)
+    tarifas = LinhaTemporalTarifas.carregar(residente_ids)
+
+    alertas = []
+    for residente_id in residente_ids:
+        custos = custos_de(consumos_liquidos(somas.get(residente_id, {})), tarifas.precos_do_mes(residente_id, ano, mes))
+        alertas.append(_novo_alerta(
+            residente_id, ano, mes, round(sum(custos.values()), 2), float(metas.get(residente_id) or 0), agora
+        ))
+    _gravar(alertas)
+
+    contagem = {estado: 0 for estado, _ in AlertaOrcamento.ESTADOS}
+    for alerta in alertas:
+        contagem[alerta.estado] += 1
+    return contagem
+
+
+def _somar(contagens):
+    total = {estado: 0 for estado, _ in AlertaOrcamento.ESTADOS}
+    for contagem in contagens:
+        for estado, quantos in contagem.items():
+            total[estado] += quantos
+    return total
+
+
+def _blocos(residente_ids, tamanho):
+    return [residente_ids[i:i + tamanho] for i in range(0, len(residente_ids), tamanho)]
+
+
+def _residentes_ativos():
+    return list(Residente.objects.filter(status=1).order_by('pk').values_list('pk', flat=True))
+
+
+# Avalia o orçamento de um mês para todos os residentes ativos (ou só para os indicados)
+def avaliar(ano, mes, residente_ids=None, tamanho=TAMANHO_BLOCO):
+    if residente_ids is None:
+        residente_ids = _residentes_ativos()
+    return _somar(_avaliar_bloco(ano, mes, bloco) for bloco in _blocos(list(residente_ids), tamanho))
+
+
+# Volta a avaliar os meses afetados por uma escrita: {(residente_id, ano, mes)} (sinais e escritas em lote)
+def reavaliar(periodos):
+    por_mes = defaultdict(set)
+    for residente_id, ano, mes in periodos:
+        por_mes[(ano, mes)].add(residente_id)
+    for (ano, mes), residente_ids in sorted(por_mes.items()):
+        avaliar(ano, mes, sorted(residente_ids))
+
+
+# ===== EXECUÇÃO EM PARALELO (ProcessPoolExecutor) =====
+
+# Com o arranque "spawn" (Windows/macOS) cada processo tem de configurar o Django
+def _iniciar_processo():
+    django.setup()
+
+
+def _avaliar_bloco_no_processo(argumentos):
+    try:
+        return _avaliar_bloco(*argumentos)
+    finally:
+        connections.close_all()
+
+
+# Divide os residentes em blocos e avalia-os em vários processos (cada um com a sua ligação à BD)
+def avaliar_em_paralelo(ano, mes, processos, tamanho=TAMANHO_BLOCO):
+    blocos = _blocos(_residentes_ativos(), tamanho)
+    # Os processos filhos não podem reutilizar a ligação do processo principal
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=processos, initializer=_iniciar_processo) as executor:
+        return _somar(executor.map(_avaliar_bloco_no_processo, [(ano, mes, bloco) for bloco in blocos]))
+
+
+# ===== DASHBOARD =====
+
+# Alerta do mês, se foi avaliado depois da última alteração dos dados do residente (ver versoes.py).
+# Só lê: os alertas são gravados pelo comando avaliar_orcamentos e pelos sinais das leituras e metas
+def alerta_atual(residente, ano, mes):
+    alerta = AlertaOrcamento.objects.filter(residente=residente, ano=ano, mes=mes).first()
+    if alerta is None or residente.dados_atualizados_em is None or alerta.avaliado_em < residente.dados_atualizados_em:
+        return None
+    return alerta
@@ -0,0 +1,60 @@
+import datetime
+
+from django.db.models import Q
+from django.utils import timezone
+
+
+# Instante de referência de um mês: os registos mensais são guardados no dia 1, às 12h
+def instante_do_mes(ano, mes):
+    return timezone.make_aware(datetime.datetime(int(ano), int(mes), 1, 12, 0, 0))
+
+
+# Intervalo semiaberto [início do mês, início do mês seguinte) na hora local
+def intervalo_mes(ano, mes):
+    ano, mes = int(ano), int(mes)
+    inicio = timezone.make_aware(datetime.datetime(ano, mes, 1))
+    if mes == 12:
+        fim = timezone.make_aware(datetime.datetime(ano + 1, 1, 1))
+    else:
+        fim = timezone.make_aware(datetime.datetime(ano, mes + 1, 1))
+    return inicio, fim
+
+
+# Intervalo semiaberto [1 de janeiro, 1 de janeiro do ano seguinte)
+def intervalo_ano(ano):
+    ano = int(ano)
+    return timezone.make_aware(datetime.datetime(ano, 1, 1)), timezone.make_aware(datetime.datetime(ano + 1, 1, 1))
+
+
+# Filtros por período que o MySQL consegue resolver com um índice
+# (timestamp__year/__month aplicam funções à coluna e obrigam a ler a tabela toda)
+def filtro_mes(ano, mes, campo='timestamp'):
+    inicio, fim = intervalo_mes(ano, mes)
+    return {f'{campo}__gte': inicio, f'{campo}__lt': fim}
+
+
+def filtro_ano(ano, campo='timestamp'):
+    inicio, fim = intervalo_ano(ano)
+    return {f'{campo}__gte': inicio, f'{campo}__lt': fim}
+
+
+# Intervalo entre duas datas (inclusive), qualquer uma opcional: [desde 00:00, dia seguinte a ate 00:00)
+def filtro_datas(desde=None, ate=None, campo='timestamp'):
+    filtro = {}
+    if desde:
+        filtro[f'{campo}__gte'] = timezone.make_aware(datetime.datetime.combine(desde, datetime.time()))
+    if ate:
+        filtro[f'{campo}__lt'] = timezone.make_aware(
+            datetime.datetime.combine(ate + datetime.timedelta(days=1), datetime.time())
+        )
+    return filtro
+
+
+# Meses entre (ano, mes) e (ano, mes), inclusive, nas tabelas com campos ano/mes (ex.: ResumoMensal)
+def filtro_meses(desde=None, ate=None):
+    filtro = Q()
+    if desde:
+        filtro &= Q(ano__gt=desde[0]) | Q(ano=desde[0], mes__gte=desde[1])
+    if ate:
+        filtro &= Q(ano__lt=ate[0]) | Q(ano=ate[0], mes__lte=ate[1])
+    return filtro
@@ -0,0 +1,184 @@
+from decimal import Decimal
+
+import numpy as np
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import versoes
+from .custos import consumos_liquidos, custos_de
+from .models import Categoria, PrevisaoCusto, Residente, ResumoMensal, Tipo
+from .periodos import filtro_meses
+from .tarifas import LinhaTemporalTarifas, TIPOS
+
+# Meses de histórico usados (três anos chegam para o perfil sazonal)
+MESES_HISTORICO = 36
+# Meses previstos a partir do mês de referência (o atual e o seguinte)
+MESES_PREVISTOS = 2
+# Com menos meses do que isto a tendência é ruído: fica só o nível e a sazonalidade
+MINIMO_TENDENCIA = 6
+CAMPOS_ATUALIZADOS = ['consumo', 'custo', 'meses_historico', 'calculado_em']
+TAMANHO_LOTE = 500
+
+
+def _indice(ano, mes):
+    return int(ano) * 12 + int(mes) - 1
+
+
+def _mes_de(indice):
+    ano, mes = divmod(indice, 12)
+    return ano, mes + 1
+
+
+# Histórico mensal em matriz: uma linha por série (residente, tipo, categoria), uma coluna por mês (NaN = sem leituras)
+def _carregar_historico(residente_ids, inicio, fim):
+    tipos = dict(Tipo.objects.values_list('pk', 'tipo'))
+    categorias = dict(Categoria.objects.values_list('pk', 'categoria'))
+    linhas = ResumoMensal.objects.filter(
+        filtro_meses(_mes_de(inicio), _mes_de(fim)), residente_id__in=residente_ids
+    ).order_by().values_list('residente_id', 'tipo_id', 'categoria_id', 'ano', 'mes').annotate(
+        soma=Sum('total')
+    ).values_list('residente_id', 'tipo_id', 'categoria_id', 'ano', 'mes', 'soma')
+
+    series = {}
+    posicoes, colunas, valores = [], [], []
+    for residente_id, tipo_id, categoria_id, ano, mes, soma in linhas:
+        chave = (residente_id, tipos[tipo_id], categorias[categoria_id])
+        posicoes.append(series.setdefault(chave, len(series)))
+        colunas.append(_indice(ano, mes) - inicio)
+        valores.append(float(soma or 0))
+
+    historico = np.full((len(series), fim - inicio + 1), np.nan)
+    historico[posicoes, colunas] = valores
+    return list(series), historico
+
+
+def _declive(desvio_tempo, desvio_valor):
+    variancia = (desvio_tempo ** 2).sum(axis=1)
+    covariancia = (desvio_tempo * desvio_valor).sum(axis=1)
+    return np.where(variancia > 0, covariancia / np.where(variancia > 0, variancia, 1), 0.0), variancia
+
+
+# Previsão de todas as séries de uma vez (historico: séries x meses, NaN = sem leituras).
+# Cada mês previsto parte da média do mesmo mês do calendário nos anos anteriores (sazonalidade) deslocada pela
+# tendência; a tendência é a regressão dentro de cada mês do calendário, para não confundir inverno/verão com subida.
+# Sem esse mês no histórico usa-se a média de todos os meses; com poucos meses não há tendência.
+def prever_series(historico, inicio, alvos):
+    existe = ~np.isnan(historico)
+    pesos = existe.astype(float)
+    valores = np.where(existe, historico, 0.0)
+    tempo = np.arange(historico.shape[1], dtype=float)
+    meses_calendario = (inicio + np.arange(historico.shape[1])) % 12
+
+    quantos = pesos.sum(axis=1)
+    media = valores.sum(axis=1) / np.maximum(quantos, 1)
+    tempo_medio = (pesos * tempo).sum(axis=1) / np.maximum(quantos, 1)
+
+    # Médias por mês do calendário: séries x 12
+    contagem = np.zeros((historico.shape[0], 12))
+    media_mes = np.zeros((historico.shape[0], 12))
+    tempo_mes = np.zeros((historico.shape[0], 12))
+    for mes_calendario in range(12):
+        coluna = meses_calendario == mes_calendario
+        contagem[:, mes_calendario] = pesos[:, coluna].sum(axis=1)
+        divisor = np.maximum(contagem[:, mes_calendario], 1)
+        media_mes[:, mes_calendario] = valores[:, coluna].sum(axis=1) / divisor
+        tempo_mes[:, mes_calendario] = (pesos[:, coluna] * tempo[coluna]).sum(axis=1) / divisor
+
+    # Tendência dentro de cada mês do calendário (precisa de meses repetidos); senão, sobre todos os meses
+    declive_sazonal, variancia_sazonal = _declive(
+        (tempo - tempo_mes[:, meses_calendario]) * pesos, (valores - media_mes[:, meses_calendario]) * pesos
+    )
+    declive_global, _ = _declive((tempo - tempo_medio[:, None]) * pesos, (valores - media[:, None]) * pesos)
+    declive = np.where(variancia_sazonal > 0, declive_sazonal, declive_global)
+    declive = np.where(quantos >= MINIMO_TENDENCIA, declive, 0.0)
+
+    previsoes = np.empty((historico.shape[0], len(alvos)))
+    for posicao, alvo in enumerate(alvos):
+        coluna, mes_calendario = alvo - inicio, alvo % 12
+        previsoes[:, posicao] = np.where(
+            contagem[:, mes_calendario] > 0,
+            media_mes[:, mes_calendario] + declive * (coluna - tempo_mes[:, mes_calendario]),
+            media + declive * (coluna - tempo_medio),
+        )
+    return np.clip(previsoes, 0.0, None), quantos.astype(int)
+
+
+def _gravar(previsoes):
+    # O MySQL não aceita indicar a chave do conflito (usa qualquer índice único)
+    chave = ['residente', 'tipo', 'ano', 'mes'] if connection.features.supports_update_conflicts_with_target else None
+    PrevisaoCusto.objects.bulk_create(
+        previsoes, update_conflicts=True, unique_fields=chave, update_fields=CAMPOS_ATUALIZADOS, batch_size=TAMANHO_LOTE
+    )
+
+
+# Grava só as previsões que mudaram e muda a versão só dos residentes cujo consumo ou custo previsto mudou
+# (os dashboards em cache e as ETags dependem dela): repetir o comando sem dados novos não invalida nada
+def _gravar_alteradas(previsoes, residente_ids, alvos):
+    gravadas = {
+        (residente_id, tipo_id, ano, mes): (consumo, custo, meses)
+        for residente_id, tipo_id, ano, mes, consumo, custo, meses in PrevisaoCusto.objects.filter(
+            filtro_meses(_mes_de(alvos[0]), _mes_de(alvos[-1])), residente_id__in=residente_ids
+        ).values_list('residente_id', 'tipo_id', 'ano', 'mes', 'consumo', 'custo', 'meses_historico')
+    }
+    alteradas = []
+    tocados = set()
+    for previsao in previsoes:
+        anterior = gravadas.get((previsao.residente_id, previsao.tipo_id, previsao.ano, previsao.mes))
+        if anterior == (previsao.consumo, previsao.custo, previsao.meses_historico):
+            continue
+        alteradas.append(previsao)
+        if anterior is None or anterior[:2] != (previsao.consumo, previsao.custo):
+            tocados.add(previsao.residente_id)
+    if alteradas:
+        _gravar(alteradas)
+    versoes.tocar(tocados)
+
+
+# Prevê o consumo e o custo de cada tipo no mês de referência e no seguinte para os residentes ativos
+# (ou só para os indicados) e grava-os em PrevisaoCusto. Devolve o número de previsões gravadas.
+def prever(ano, mes, residente_ids=None, meses_historico=MESES_HISTORICO):
+    if residente_ids is None:
+        residente_ids = list(Residente.objects.filter(status=1).values_list('pk', flat=True))
+    referencia = _indice(ano, mes)
+    inicio, fim = referencia - meses_historico, referencia - 1
+    alvos = [referencia + deslocamento for deslocamento in range(MESES_PREVISTOS)]
+
+    series, historico = _carregar_historico(residente_ids, inicio, fim)
+    if not series:
+        return 0
+    previstos, quantos = prever_series(historico, inicio, alvos)
+
+    # Volta a juntar as séries por residente: na luz a produção prevista dos geradores desconta no consumo
+    somas = {}
+    meses_com_dados = {}
+    for (residente_id, tipo_nome, categoria_nome), linha, meses in zip(series, previstos, quantos):
+        somas.setdefault(residente_id, {})[(tipo_nome, categoria_nome)] = linha
+        if categoria_nome == 'Consumidor':
+            meses_com_dados[(residente_id, tipo_nome)] = int(meses)
+
+    tipos = dict(Tipo.objects.values_list('tipo', 'pk'))
+    tarifas = LinhaTemporalTarifas.carregar(list(somas))
+    agora = timezone.now()
+    previsoes = []
+    for residente_id, series_residente in somas.items():
+        for posicao, alvo in enumerate(alvos):
+            alvo_ano, alvo_mes = _mes_de(alvo)
+            consumos = consumos_liquidos({chave: float(linha[posicao]) for chave, linha in series_residente.items()})
+            # Meses futuros: contrato e tarifa em vigor hoje (a pesquisa devolve o último conhecido)
+            custos = custos_de(consumos, tarifas.precos_do_mes(residente_id, alvo_ano, alvo_mes))
+            for tipo_nome in TIPOS:
+                # Sem leituras de consumo deste tipo não há o que prever
+                if (residente_id, tipo_nome) not in meses_com_dados or tipo_nome not in tipos:
+                    continue
+                previsoes.append(PrevisaoCusto(
+                    residente_id=residente_id, tipo_id=tipos[tipo_nome], ano=alvo_ano, mes=alvo_mes,
+                    consumo=Decimal(str(round(consumos[tipo_nome], 2))), custo=Decimal(str(custos[tipo_nome])),
+                    meses_historico=meses_com_dados[(residente_id, tipo_nome)], calculado_em=agora,
+                ))
+    residentes = sorted(somas)
+    for i in range(0, len(residentes), TAMANHO_LOTE):
+        bloco = set(residentes[i:i + TAMANHO_LOTE])
+        _gravar_alteradas([previsao for previsao in previsoes if previsao.residente_id in bloco], bloco, alvos)
+    return len(previsoes)
+
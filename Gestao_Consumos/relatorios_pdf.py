@@ -0,0 +1,172 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+
+from . import metricas, renderizador_pdf
+
+logger = logging.getLogger(__name__)
+
+# Pasta onde ficam os PDFs gerados: <pasta>/<id_residente>/<versão>/<chave>.pdf (+ <chave>.json com os metadados)
+# A versão é a dos dados do residente (Residente.dados_atualizados_em, ver versoes.py): qualquer alteração muda a
+# pasta e os relatórios antigos deixam de ser encontrados, sem apagar ficheiros que um render ainda esteja a escrever.
+# O estado dos pedidos também fica no disco (<chave>.pendente / <chave>.erro): com vários workers (gunicorn/uwsgi)
+# o pedido de estado pode chegar a um processo diferente do que está a gerar o PDF
+PASTA = Path(getattr(settings, 'RELATORIOS_PDF_DIR', Path(settings.BASE_DIR) / 'relatorios_pdf'))
+WORKERS = getattr(settings, 'RELATORIOS_PDF_WORKERS', 2)
+# Um pedido pendente há mais tempo do que isto foi abandonado (ex.: o worker reiniciou) e pode ser repetido
+PRAZO_PENDENTE = getattr(settings, 'RELATORIOS_PDF_PRAZO', 600)
+
+PRONTO = 'pronto'
+EM_CURSO = 'em_curso'
+ERRO = 'erro'
+DESCONHECIDO = 'desconhecido'
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _obter_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='relatorios-pdf')
+        return _executor
+
+
+# A chave do relatório é o hash do HTML: o mesmo conteúdo gera sempre o mesmo ficheiro
+def chave_de(html_string):
+    return hashlib.sha256(html_string.encode('utf-8')).hexdigest()
+
+
+def versao_de(residente):
+    if residente.dados_atualizados_em is None:
+        return 0
+    return int(residente.dados_atualizados_em.timestamp() * 1_000_000)
+
+
+def _pasta(residente):
+    return PASTA / str(residente.pk) / str(versao_de(residente))
+
+
+# Apaga as pastas de versões anteriores do residente (nunca as de versões mais recentes do que a do pedido)
+def _limpar_versoes_antigas(residente):
+    versao = versao_de(residente)
+    try:
+        pastas = list((PASTA / str(residente.pk)).iterdir())
+    except OSError:
+        return
+    for pasta in pastas:
+        if pasta.is_dir() and pasta.name.isdigit() and int(pasta.name) < versao:
+            shutil.rmtree(pasta, ignore_errors=True)
+
+
+# Marca o pedido como pendente; False se outro processo já o marcou (e o prazo ainda não passou)
+def _marcar_pendente(pasta, chave):
+    pendente = pasta / f'{chave}.pendente'
+    pasta.mkdir(parents=True, exist_ok=True)
+    try:
+        os.close(os.open(pendente, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except FileExistsError:
+        if _pendente(pendente):
+            return False
+        pendente.touch()
+        return True
+
+
+def _pendente(caminho):
+    try:
+        return time.time() - caminho.stat().st_mtime < PRAZO_PENDENTE
+    except OSError:
+        return False
+
+
+def _escrever_atomico(caminho, conteudo):
+    # A pasta pode ter sido apagada entretanto (versão antiga): o ficheiro fica numa pasta que a próxima limpeza remove
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    temporario = caminho.with_name(caminho.name + '.tmp')
+    temporario.write_bytes(conteudo)
+    os.replace(temporario, caminho)
+
+
+def _gerar(pasta, chave, html_string, metadados):
+    try:
+        inicio = time.perf_counter()
+        pdf = renderizador_pdf.renderizar(html_string)
+        # O render corre fora do pedido: a duração vai para as métricas em segundo plano
+        metricas.registar_duracao('render_pdf', (time.perf_counter() - inicio) * 1000)
+        _escrever_atomico(pasta / f'{chave}.pdf', pdf)
+        _escrever_atomico(pasta / f'{chave}.json', json.dumps(metadados).encode('utf-8'))
+    except Exception as e:
+        logger.exception('Erro ao gerar o relatório %s', chave)
+        try:
+            _escrever_atomico(pasta / f'{chave}.erro', str(e).encode('utf-8'))
+        except OSError:
+            logger.exception('Erro ao registar a falha do relatório %s', chave)
+    finally:
+        (pasta / f'{chave}.pendente').unlink(missing_ok=True)
+
+
+# Pede a geração de um relatório; devolve a chave (que serve de id do pedido)
+def pedir(residente, html_string, nome_ficheiro, tipo, ano, mes):
+    chave = chave_de(html_string)
+    if estado(residente, chave) == PRONTO:
+        return chave
+    pasta = _pasta(residente)
+    metadados = {'residente': residente.pk, 'nome_ficheiro': nome_ficheiro, 'tipo': tipo, 'ano': ano, 'mes': mes}
+    if not _marcar_pendente(pasta, chave):
+        return chave
+    _limpar_versoes_antigas(residente)
+    (pasta / f'{chave}.erro').unlink(missing_ok=True)
+    _obter_executor().submit(_gerar, pasta, chave, html_string, metadados)
+    return chave
+
+
+def estado(residente, chave):
+    pasta = _pasta(residente)
+    if (pasta / f'{chave}.pdf').exists() and (pasta / f'{chave}.json').exists():
+        return PRONTO
+    if _pendente(pasta / f'{chave}.pendente'):
+        return EM_CURSO
+    if (pasta / f'{chave}.erro').exists():
+        return ERRO
+    return DESCONHECIDO
+
+
+def erro(residente, chave):
+    try:
+        return (_pasta(residente) / f'{chave}.erro').read_text(encoding='utf-8')
+    except OSError:
+        return None
+
+
+# Caminho e metadados de um relatório pronto (da versão atual dos dados), ou None
+def obter(residente, chave):
+    pasta = _pasta(residente)
+    try:
+        metadados = json.loads((pasta / f'{chave}.json').read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return None
+    if not (pasta / f'{chave}.pdf').exists():
+        return None
+    return pasta / f'{chave}.pdf', metadados
+
+
+# Apaga todos os relatórios de um residente (benchmarks com cache fria; em produção basta mudar a versão)
+def apagar_residente(residente_id):
+    shutil.rmtree(PASTA / str(residente_id), ignore_errors=True)
+
+
+# Arranca o pool já com o WeasyPrint carregado (para processos dedicados a PDFs)
+def aquecer_workers():
+    executor = _obter_executor()
+    for futuro in [executor.submit(renderizador_pdf.aquecer) for _ in range(WORKERS)]:
+        futuro.result()
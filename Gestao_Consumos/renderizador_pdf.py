@@ -0,0 +1,42 @@
+import os
+import threading
+
+# O WeasyPrint (Pango/cairo) só é importado quando é preciso gerar um PDF:
+# os workers que nunca geram relatórios não pagam o tempo de import nem a memória
+_HTML = None
+_lock = threading.Lock()
+
+# Configuração de paths para o GTK (Windows)
+GIO_LIB_PATH = r'C:\Program Files\GTK3-Runtime\bin'
+
+
+def _configurar_gtk():
+    if os.name == 'nt' and os.path.exists(GIO_LIB_PATH):
+        if GIO_LIB_PATH not in os.environ['PATH'].split(os.pathsep):
+            os.environ['PATH'] = GIO_LIB_PATH + os.pathsep + os.environ['PATH']
+
+
+def _obter_html():
+    global _HTML
+    if _HTML is None:
+        with _lock:
+            if _HTML is None:
+                _configurar_gtk()
+                from weasyprint import HTML  # Para gerar PDFs
+                _HTML = HTML
+    return _HTML
+
+
+def carregado():
+    return _HTML is not None
+
+
+# Converte HTML em PDF (bytes)
+def renderizar(html_string):
+    return _obter_html()(string=html_string).write_pdf()
+
+
+# Aquecimento opcional para workers dedicados a PDFs: importa o WeasyPrint e
+# gera um documento mínimo para carregar fontes e caches antes do primeiro pedido
+def aquecer():
+    renderizar('<html><body><p>.</p></body></html>')
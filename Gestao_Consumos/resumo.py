@@ -0,0 +1,228 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+from django.utils import timezone
+
+from .models import RegistoConsumo, ResumoMensal
+
+# Permite desligar a atualização automática (sinais) durante operações em lote
+_estado = threading.local()
+
+
+@contextmanager
+def suspenso():
+    anterior = getattr(_estado, 'suspenso', False)
+    _estado.suspenso = True
+    try:
+        yield
+    finally:
+        _estado.suspenso = anterior
+
+
+def esta_suspenso():
+    return getattr(_estado, 'suspenso', False)
+
+
+# Ano e mês de um registo, no fuso horário local (igual a timestamp__year/__month)
+def periodo_de(timestamp):
+    if timezone.is_aware(timestamp):
+        timestamp = timezone.localtime(timestamp)
+    return timestamp.year, timestamp.month
+
+
+# Chave do resumo: (residente, tipo, categoria, ano, mes)
+def chave_de(dispositivo, timestamp):
+    ano, mes = periodo_de(timestamp)
+    return (dispositivo.residente_id, dispositivo.tipo_id, dispositivo.categoria_id, ano, mes)
+
+
+# A partir deste número de linhas afetadas, as variações são aplicadas em lote
+LIMIAR_LOTE = 20
+
+
+def _filtro_chave(chave):
+    residente_id, tipo_id, categoria_id, ano, mes = chave
+    return dict(residente_id=residente_id, tipo_id=tipo_id, categoria_id=categoria_id, ano=ano, mes=mes)
+
+
+# Uma linha de cada vez, com F(): seguro com escritas concorrentes na mesma linha
+def _aplicar_linha(chave, delta_valor, delta_registos):
+    filtro = _filtro_chave(chave)
+    atualizados = ResumoMensal.objects.filter(**filtro).update(
+        total=F('total') + delta_valor,
+        registos=F('registos') + delta_registos
+    )
+    if atualizados:
+        return
+    try:
+        # A linha ainda não existe; se outro processo a criar entretanto volta-se a atualizar
+        with transaction.atomic():
+            ResumoMensal.objects.create(total=delta_valor, registos=delta_registos, **filtro)
+    except IntegrityError:
+        ResumoMensal.objects.filter(**filtro).update(
+            total=F('total') + delta_valor,
+            registos=F('registos') + delta_registos
+        )
+
+
+# Muitas linhas (importações): bloqueia as existentes, atualiza-as com um bulk_update e cria as novas
+def _aplicar_lote(variacoes):
+    existentes = {}
+    candidatas = ResumoMensal.objects.select_for_update().filter(
+        residente_id__in={chave[0] for chave in variacoes},
+        ano__in={chave[3] for chave in variacoes},
+        mes__in={chave[4] for chave in variacoes},
+    )
+    for linha in candidatas:
+        chave = (linha.residente_id, linha.tipo_id, linha.categoria_id, linha.ano, linha.mes)
+        if chave in variacoes:
+            existentes[chave] = linha
+
+    atualizar, criar = [], []
+    for chave, (delta_valor, delta_registos) in variacoes.items():
+        linha = existentes.get(chave)
+        if linha is None:
+            criar.append(ResumoMensal(total=delta_valor, registos=delta_registos, **_filtro_chave(chave)))
+        else:
+            linha.total += delta_valor
+            linha.registos += delta_registos
+            atualizar.append(linha)
+    ResumoMensal.objects.bulk_update(atualizar, ['total', 'registos'], batch_size=500)
+    try:
+        with transaction.atomic():
+            ResumoMensal.objects.bulk_create(criar, batch_size=500)
+    except IntegrityError:
+        # Alguma linha foi criada entretanto por outro processo: volta ao caminho linha a linha
+        for linha in criar:
+            _aplicar_linha(
+                (linha.residente_id, linha.tipo_id, linha.categoria_id, linha.ano, linha.mes),
+                linha.total, linha.registos
+            )
+
+
+# Aplica variações {chave: (delta_valor, delta_registos)} à tabela de resumo
+def aplicar_variacoes(variacoes):
+    variacoes = {chave: delta for chave, delta in variacoes.items() if delta[0] or delta[1]}
+    if not variacoes:
+        return
+    with transaction.atomic():
+        if len(variacoes) >= LIMIAR_LOTE:
+            _aplicar_lote(variacoes)
+        else:
+            for chave, (delta_valor, delta_registos) in variacoes.items():
+                _aplicar_linha(chave, delta_valor, delta_registos)
+        # Linhas que ficaram sem registos deixam de ser necessárias
+        residentes = {chave[0] for chave in variacoes}
+        ResumoMensal.objects.filter(residente_id__in=residentes, registos__lte=0).delete()
+
+
+def _acumular(variacoes, chave, valor, registos):
+    delta_valor, delta_registos = variacoes[chave]
+    variacoes[chave] = (delta_valor + Decimal(str(valor)), delta_registos + registos)
+
+
+# Soma ao resumo uma lista de registos novos (por exemplo, depois de um bulk_create)
+def registar_lote(registos):
+    variacoes = defaultdict(lambda: (Decimal('0'), 0))
+    for registo in registos:
+        _acumular(variacoes, chave_de(registo.dispositivo, registo.timestamp), registo.valor, 1)
+    aplicar_variacoes(variacoes)
+
+
+# Variações de um registo criado, alterado ou apagado (anterior/novo são (chave, valor) ou None)
+def atualizar_registo(anterior, novo):
+    variacoes = defaultdict(lambda: (Decimal('0'), 0))
+    if anterior:
+        _acumular(variacoes, anterior[0], -Decimal(str(anterior[1])), -1)
+    if novo:
+        _acumular(variacoes, novo[0], novo[1], 1)
+    aplicar_variacoes(variacoes)
+
+
+# Somas por (ano, mes) dos registos de um dispositivo, numa query
+def _somas_dispositivo(dispositivo_id):
+    return RegistoConsumo.objects.filter(dispositivo_id=dispositivo_id).annotate(
+        ano=ExtractYear('timestamp'), mes=ExtractMonth('timestamp')
+    ).order_by().values('ano', 'mes').annotate(total=Sum('valor'), registos=Count('pk'))
+
+
+# Retira do resumo todos os registos de um dispositivo (antes de um apagar em lote)
+def descontar_dispositivo(dispositivo):
+    variacoes = defaultdict(lambda: (Decimal('0'), 0))
+    for linha in _somas_dispositivo(dispositivo.pk):
+        chave = (dispositivo.residente_id, dispositivo.tipo_id, dispositivo.categoria_id, linha['ano'], linha['mes'])
+        _acumular(variacoes, chave, -linha['total'], -linha['registos'])
+    aplicar_variacoes(variacoes)
+
+
+# Move os registos de um dispositivo quando muda de tipo, categoria ou residente
+def mover_dispositivo(dispositivo, residente_id, tipo_id, categoria_id):
+    variacoes = defaultdict(lambda: (Decimal('0'), 0))
+    for linha in _somas_dispositivo(dispositivo.pk):
+        antiga = (residente_id, tipo_id, categoria_id, linha['ano'], linha['mes'])
+        nova = (dispositivo.residente_id, dispositivo.tipo_id, dispositivo.categoria_id, linha['ano'], linha['mes'])
+        _acumular(variacoes, antiga, -linha['total'], -linha['registos'])
+        _acumular(variacoes, nova, linha['total'], linha['registos'])
+    aplicar_variacoes(variacoes)
+
+
+# Agregação feita diretamente sobre a tabela de registos (fonte de verdade)
+def _agregar_registos(residente=None):
+    registos = RegistoConsumo.objects.all()
+    if residente is not None:
+        registos = registos.filter(dispositivo__residente=residente)
+    return registos.annotate(
+        ano=ExtractYear('timestamp'), mes=ExtractMonth('timestamp')
+    ).order_by().values(
+        'dispositivo__residente', 'dispositivo__tipo', 'dispositivo__categoria', 'ano', 'mes'
+    ).annotate(total=Sum('valor'), registos=Count('pk'))
+
+
+def _chave_linha(linha):
+    return (
+        linha['dispositivo__residente'], linha['dispositivo__tipo'], linha['dispositivo__categoria'],
+        linha['ano'], linha['mes']
+    )
+
+
+# Reconstrói o resumo de raiz (de todos os residentes ou só de um)
+def reconstruir(residente=None):
+    with transaction.atomic():
+        existentes = ResumoMensal.objects.all()
+        if residente is not None:
+            existentes = existentes.filter(residente=residente)
+        existentes.delete()
+
+        novos = []
+        for linha in _agregar_registos(residente).iterator(chunk_size=2000):
+            residente_id, tipo_id, categoria_id, ano, mes = _chave_linha(linha)
+            novos.append(ResumoMensal(
+                residente_id=residente_id, tipo_id=tipo_id, categoria_id=categoria_id,
+                ano=ano, mes=mes, total=linha['total'], registos=linha['registos']
+            ))
+        ResumoMensal.objects.bulk_create(novos, batch_size=1000)
+    return len(novos)
+
+
+# Compara o resumo com a tabela de registos; devolve a lista de diferenças
+def verificar(residente=None):
+    esperado = {_chave_linha(linha): (linha['total'], linha['registos']) for linha in _agregar_registos(residente)}
+
+    atual_qs = ResumoMensal.objects.all()
+    if residente is not None:
+        atual_qs = atual_qs.filter(residente=residente)
+    atual = {
+        (r.residente_id, r.tipo_id, r.categoria_id, r.ano, r.mes): (r.total, r.registos)
+        for r in atual_qs
+    }
+
+    diferencas = []
+    for chave in sorted(set(esperado) | set(atual)):
+        if esperado.get(chave) != atual.get(chave):
+            diferencas.append((chave, esperado.get(chave), atual.get(chave)))
+    return diferencas
@@ -0,0 +1,175 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from django.utils import timezone
+
+from . import cache_tarifas, orcamentos, resumo, versoes
+from .models import (
+    Residente, Dispositivo, RegistoConsumo, Fornecedor, FornecedorValor, FornecedorTipo, FornecedorResidente,
+    Orcamento_limite
+)
+
+
+# ===== RESUMO MENSAL (ResumoMensal) =====
+
+# Guarda o estado anterior do registo para se poder descontar do resumo
+@receiver(pre_save, sender=RegistoConsumo)
+def guardar_registo_anterior(sender, instance, raw=False, **kwargs):
+    instance._resumo_anterior = None
+    if raw or resumo.esta_suspenso() or instance.pk is None:
+        return
+    anterior = RegistoConsumo.objects.filter(pk=instance.pk).values(
+        'valor', 'timestamp', 'dispositivo__residente', 'dispositivo__tipo', 'dispositivo__categoria'
+    ).first()
+    if anterior:
+        ano, mes = resumo.periodo_de(anterior['timestamp'])
+        chave = (
+            anterior['dispositivo__residente'], anterior['dispositivo__tipo'],
+            anterior['dispositivo__categoria'], ano, mes
+        )
+        instance._resumo_anterior = (chave, anterior['valor'])
+
+
+@receiver(post_save, sender=RegistoConsumo)
+def atualizar_resumo_registo(sender, instance, raw=False, **kwargs):
+    if raw or resumo.esta_suspenso():
+        return
+    novo = (resumo.chave_de(instance.dispositivo, instance.timestamp), instance.valor)
+    resumo.atualizar_registo(getattr(instance, '_resumo_anterior', None), novo)
+
+
+@receiver(post_delete, sender=RegistoConsumo)
+def descontar_resumo_registo(sender, instance, **kwargs):
+    if resumo.esta_suspenso():
+        return
+    resumo.atualizar_registo((resumo.chave_de(instance.dispositivo, instance.timestamp), instance.valor), None)
+
+
+# Se um dispositivo mudar de tipo/categoria/residente, os seus consumos mudam de linha no resumo
+@receiver(pre_save, sender=Dispositivo)
+def guardar_dispositivo_anterior(sender, instance, raw=False, **kwargs):
+    instance._resumo_anterior = None
+    if raw or instance.pk is None:
+        return
+    instance._resumo_anterior = Dispositivo.objects.filter(pk=instance.pk).values_list(
+        'residente_id', 'tipo_id', 'categoria_id'
+    ).first()
+
+
+@receiver(post_save, sender=Dispositivo)
+def mover_resumo_dispositivo(sender, instance, raw=False, **kwargs):
+    anterior = getattr(instance, '_resumo_anterior', None)
+    if raw or resumo.esta_suspenso() or not anterior:
+        return
+    if anterior != (instance.residente_id, instance.tipo_id, instance.categoria_id):
+        resumo.mover_dispositivo(instance, *anterior)
+
+
+# ===== CACHE DE TARIFAS E CONTRATOS =====
+
+# Invalida já e outra vez depois do commit, para não ficar em cache um estado por confirmar
+def _invalidar(funcao, *args):
+    funcao(*args)
+    transaction.on_commit(lambda: funcao(*args))
+
+
+@receiver(post_save, sender=FornecedorValor)
+@receiver(post_delete, sender=FornecedorValor)
+@receiver(post_save, sender=FornecedorTipo)
+@receiver(post_delete, sender=FornecedorTipo)
+@receiver(post_save, sender=Fornecedor)
+@receiver(post_delete, sender=Fornecedor)
+def invalidar_cache_tarifas(sender, instance, **kwargs):
+    _invalidar(cache_tarifas.invalidar_tarifas)
+
+
+@receiver(post_save, sender=FornecedorResidente)
+@receiver(post_delete, sender=FornecedorResidente)
+def invalidar_cache_contratos(sender, instance, **kwargs):
+    _invalidar(cache_tarifas.invalidar_contratos, instance.residente_id)
+
+
+# ===== VERSÃO DOS DADOS DO RESIDENTE (ETag/Last-Modified e pasta dos relatórios PDF) =====
+
+@receiver(pre_save, sender=Residente)
+def marcar_residente(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Alterações ao perfil (nome, morada...) também aparecem nas páginas
+    if not raw and update_fields is None:
+        instance.dados_atualizados_em = timezone.now()
+
+
+@receiver(post_save, sender=RegistoConsumo)
+@receiver(post_delete, sender=RegistoConsumo)
+def marcar_registo(sender, instance, raw=False, **kwargs):
+    # As escritas em lote marcam os residentes afetados de uma vez (importacao.atualizar_derivados)
+    if not raw and not resumo.esta_suspenso():
+        versoes.tocar([instance.dispositivo.residente_id])
+
+
+@receiver(post_save, sender=Dispositivo)
+@receiver(post_delete, sender=Dispositivo)
+def marcar_dispositivo(sender, instance, raw=False, **kwargs):
+    if not raw:
+        anterior = getattr(instance, '_resumo_anterior', None)
+        versoes.tocar([instance.residente_id, anterior[0] if anterior else None])
+
+
+@receiver(post_save, sender=Orcamento_limite)
+@receiver(post_delete, sender=Orcamento_limite)
+@receiver(post_save, sender=FornecedorResidente)
+@receiver(post_delete, sender=FornecedorResidente)
+def marcar_residente_relacionado(sender, instance, raw=False, **kwargs):
+    if not raw:
+        versoes.tocar([instance.residente_id])
+
+
+@receiver(post_save, sender=FornecedorValor)
+@receiver(post_delete, sender=FornecedorValor)
+def marcar_tarifa(sender, instance, raw=False, **kwargs):
+    if not raw:
+        versoes.tocar_servicos([instance.fornecedor_tipo_id])
+
+
+@receiver(post_save, sender=FornecedorTipo)
+@receiver(post_delete, sender=FornecedorTipo)
+def marcar_servico(sender, instance, raw=False, **kwargs):
+    if not raw:
+        versoes.tocar_servicos([instance.pk])
+
+
+@receiver(post_save, sender=Fornecedor)
+def marcar_fornecedor(sender, instance, raw=False, **kwargs):
+    if not raw:
+        versoes.tocar_servicos(FornecedorTipo.objects.filter(fornecedor=instance).values('pk'))
+
+
+# ===== ALERTAS DE ORÇAMENTO (AlertaOrcamento) =====
+
+# Depois do commit (e da mudança de versão do residente): o alerta gravado fica com o valor lido e o instante da leitura
+def _reavaliar_orcamentos(periodos):
+    periodos = {periodo for periodo in periodos if periodo[0]}
+    if periodos:
+        transaction.on_commit(lambda: orcamentos.reavaliar(periodos))
+
+
+@receiver(post_save, sender=RegistoConsumo)
+@receiver(post_delete, sender=RegistoConsumo)
+def reavaliar_orcamento_registo(sender, instance, raw=False, **kwargs):
+    # As escritas em lote reavaliam os meses afetados de uma vez (importacao.atualizar_derivados)
+    if raw or resumo.esta_suspenso():
+        return
+    periodos = {(instance.dispositivo.residente_id,) + resumo.periodo_de(instance.timestamp)}
+    # Numa edição, também o mês (e o residente) em que a leitura estava antes
+    anterior = getattr(instance, '_resumo_anterior', None)
+    if anterior:
+        residente_id, _, _, ano, mes = anterior[0]
+        periodos.add((residente_id, ano, mes))
+    _reavaliar_orcamentos(periodos)
+
+
+@receiver(post_save, sender=Orcamento_limite)
+@receiver(post_delete, sender=Orcamento_limite)
+def reavaliar_orcamento_meta(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _reavaliar_orcamentos({(instance.residente_id,) + resumo.periodo_de(instance.timestamp)})
@@ -0,0 +1,95 @@
+from bisect import bisect_right
+from collections import defaultdict
+
+from .models import FornecedorResidente, FornecedorValor
+from .periodos import instante_do_mes
+
+TIPOS = ('Luz', 'Agua', 'Gas')
+
+# Preço usado quando o residente não tem contrato ou o fornecedor não tem tarifa
+PRECO_POR_OMISSAO = 1.0
+
+
+# Histórico de tarifas e contratos em memória, ordenado por data, com pesquisa binária
+class LinhaTemporalTarifas:
+
+    def __init__(self, tarifas, contratos):
+        # tarifas: {fornecedor_tipo_id: ([timestamps], [valores])}
+        # contratos: {(residente_id, tipo): ([timestamps], [fornecedor_tipo_id], fornecedor_tipo_id ativo)}
+        self.tarifas = tarifas
+        self.contratos = contratos
+
+    # Carrega todo o histórico em duas queries (opcionalmente só de alguns residentes)
+    @classmethod
+    def carregar(cls, residentes=None):
+        contratos_qs = FornecedorResidente.objects.order_by('timestamp', 'pk')
+        if residentes is not None:
+            contratos_qs = contratos_qs.filter(residente__in=residentes)
+        linhas_contratos = list(contratos_qs.values_list(
+            'residente_id', 'fornecedor_tipo__tipo__tipo', 'fornecedor_tipo_id', 'timestamp', 'status'
+        ))
+
+        tarifas_qs = FornecedorValor.objects.order_by('timestamp', 'pk')
+        if residentes is not None:
+            tarifas_qs = tarifas_qs.filter(fornecedor_tipo_id__in={linha[2] for linha in linhas_contratos})
+        linhas_tarifas = tarifas_qs.values_list('fornecedor_tipo_id', 'timestamp', 'valor')
+
+        return cls.de_linhas(linhas_tarifas, linhas_contratos)
+
+    # Constrói o índice a partir de linhas já ordenadas por timestamp
+    @classmethod
+    def de_linhas(cls, linhas_tarifas, linhas_contratos):
+        tarifas = defaultdict(lambda: ([], []))
+        for fornecedor_tipo_id, timestamp, valor in linhas_tarifas:
+            tarifas[fornecedor_tipo_id][0].append(timestamp)
+            tarifas[fornecedor_tipo_id][1].append(float(valor))
+
+        contratos = {}
+        for residente_id, tipo_nome, fornecedor_tipo_id, timestamp, status in linhas_contratos:
+            instantes, fornecedores, ativo = contratos.get((residente_id, tipo_nome), ([], [], None))
+            instantes.append(timestamp)
+            fornecedores.append(fornecedor_tipo_id)
+            if status == 1:
+                ativo = fornecedor_tipo_id
+            contratos[(residente_id, tipo_nome)] = (instantes, fornecedores, ativo)
+
+        return cls(dict(tarifas), contratos)
+
+    # Tarifa em vigor num instante; antes da primeira tarifa conhecida usa-se a mais antiga
+    def preco_em(self, fornecedor_tipo_id, instante):
+        historico = self.tarifas.get(fornecedor_tipo_id)
+        if not historico:
+            return PRECO_POR_OMISSAO
+        instantes, valores = historico
+        posicao = bisect_right(instantes, instante)
+        return valores[max(posicao - 1, 0)]
+
+    # Serviço contratado num instante; antes do primeiro contrato usa-se o contrato ativo
+    def contrato_em(self, residente_id, tipo_nome, instante):
+        historico = self.contratos.get((residente_id, tipo_nome))
+        if not historico:
+            return None
+        instantes, fornecedores, ativo = historico
+        posicao = bisect_right(instantes, instante)
+        if posicao == 0:
+            return ativo
+        return fornecedores[posicao - 1]
+
+    # Preço de um tipo para um residente em vários instantes de uma vez
+    def precos_em(self, residente_id, tipo_nome, instantes):
+        precos = []
+        for instante in instantes:
+            fornecedor_tipo_id = self.contrato_em(residente_id, tipo_nome, instante)
+            precos.append(self.preco_em(fornecedor_tipo_id, instante) if fornecedor_tipo_id else PRECO_POR_OMISSAO)
+        return precos
+
+    # Preços por tipo em vigor num mês: {tipo: preco}
+    def precos_do_mes(self, residente_id, ano, mes):
+        instante = instante_do_mes(ano, mes)
+        return {tipo_nome: self.precos_em(residente_id, tipo_nome, [instante])[0] for tipo_nome in TIPOS}
+
+    # Preços dos 12 meses de um ano: {mes: {tipo: preco}}
+    def precos_do_ano(self, residente_id, ano):
+        instantes = [instante_do_mes(ano, mes) for mes in range(1, 13)]
+        por_tipo = {tipo_nome: self.precos_em(residente_id, tipo_nome, instantes) for tipo_nome in TIPOS}
+        return {mes: {tipo_nome: por_tipo[tipo_nome][mes - 1] for tipo_nome in TIPOS} for mes in range(1, 13)}
@@ -1 +1,872 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.exceptions import ValidationError
+from django.core.cache import cache, caches
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+
+from . import analise, anomalias, cache_paginas, exportacao, historico, ingestao, orcamentos, previsao, relatorios_pdf, resumo, versoes
+from .custos import calcular_custos
+from .importacao import Importador, ler_csv
+from .middleware import obter_residente
+from .models import (
+    Residente, Tipo, Categoria, Dispositivo, RegistoConsumo, Fornecedor,
+    FornecedorTipo, FornecedorValor, FornecedorResidente, Orcamento_limite, ResumoMensal, AlertaOrcamento,
+    PrevisaoCusto, AnomaliaLeitura
+)
+from .periodos import filtro_ano, filtro_mes, instante_do_mes
+from .tarifas import LinhaTemporalTarifas, PRECO_POR_OMISSAO
+
+
+# Cria um residente com dispositivos, contratos, metas e leituras mensais
+def criar_dados(n_residentes=1, n_dispositivos=3, anos=(2025,), n_fornecedores=1):
+    tipos = {nome: Tipo.objects.get_or_create(tipo=nome)[0] for nome in ('Luz', 'Agua', 'Gas')}
+    categorias = {
+        nome: Categoria.objects.get_or_create(categoria=nome, defaults={'status': 1})[0]
+        for nome in ('Consumidor', 'Gerador')
+    }
+
+    servicos = {nome: [] for nome in tipos}
+    for f in range(n_fornecedores):
+        fornecedor = Fornecedor.objects.create(nome=f'Fornecedor {f}', nif=f'50000000{f}')
+        for nome, tipo in tipos.items():
+            servico = FornecedorTipo.objects.create(
+                fornecedor=fornecedor, tipo=tipo, unidade='kWh' if nome == 'Luz' else 'm3'
+            )
+            FornecedorValor.objects.create(fornecedor_tipo=servico, valor=Decimal('0.150'), timestamp=instante_do_mes(2024, 1))
+            FornecedorValor.objects.create(fornecedor_tipo=servico, valor=Decimal('0.200'), timestamp=instante_do_mes(2025, 7))
+            servicos[nome].append(servico)
+
+    residentes = []
+    for r in range(n_residentes):
+        email = f'residente{r}@exemplo.pt'
+        residente = Residente.objects.create(
+            nome=f'Residente {r}', email=email, telemovel=f'91000{r:04d}', password='pw', status=1, cidade='Porto',
+            utilizador=User.objects.create_user(username=email, email=email, password='pw')
+        )
+        for nome in tipos:
+            FornecedorResidente.objects.create(
+                fornecedor_tipo=servicos[nome][r % n_fornecedores], residente=residente,
+                status=1, timestamp=instante_do_mes(2024, 1)
+            )
+        Orcamento_limite.objects.create(residente=residente, tipo=tipos['Luz'], valor=Decimal('20'), timestamp=instante_do_mes(anos[0], 3))
+
+        for d in range(n_dispositivos):
+            nome = ('Luz', 'Agua', 'Gas')[d % 3]
+            dispositivo = Dispositivo.objects.create(
+                nome=f'{nome} {d}', tipo=tipos[nome],
+                categoria=categorias['Gerador' if nome == 'Luz' and d % 6 == 3 else 'Consumidor'],
+                residente=residente, unidade='kWh' if nome == 'Luz' else 'm3'
+            )
+            for ano in anos:
+                for mes in range(1, 13):
+                    RegistoConsumo.objects.create(
+                        dispositivo=dispositivo, valor=Decimal(50 + mes + d), timestamp=instante_do_mes(ano, mes)
+                    )
+        residentes.append(residente)
+    return residentes
+
+
+class ResidentePedidoTestCase(TestCase):
+    # O residente é resolvido uma vez por pedido, pela ligação User -> Residente (com o id guardado na sessão)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.residente, cls.outro = criar_dados(n_residentes=2, n_dispositivos=0)
+
+    def pedido(self, user, sessao=None):
+        request = RequestFactory().get('/')
+        request.user = user
+        request.session = sessao if sessao is not None else SessionStore()
+        return request
+
+    def test_uma_query_por_pedido(self):
+        sessao = SessionStore()
+        obter_residente(self.pedido(self.residente.utilizador, sessao))
+        request = self.pedido(self.residente.utilizador, sessao)
+        # Com o id na sessão: uma query, e nenhuma nas chamadas seguintes do mesmo pedido
+        with self.assertNumQueries(1):
+            self.assertEqual(obter_residente(request), self.residente)
+            self.assertEqual(obter_residente(request), self.residente)
+
+    def test_sessao_de_outro_utilizador_nao_e_reaproveitada(self):
+        sessao = SessionStore()
+        obter_residente(self.pedido(self.residente.utilizador, sessao))
+        self.assertEqual(obter_residente(self.pedido(self.outro.utilizador, sessao)), self.outro)
+
+    def test_conta_antiga_liga_pelo_email(self):
+        Residente.objects.filter(pk=self.outro.pk).update(utilizador=None)
+        user = User.objects.get(pk=self.outro.utilizador_id)
+        self.assertEqual(obter_residente(self.pedido(user)), self.outro)
+        self.assertEqual(Residente.objects.get(pk=self.outro.pk).utilizador_id, user.pk)
+
+    def test_sem_login(self):
+        self.assertIsNone(obter_residente(self.pedido(AnonymousUser())))
+
+
+class ResumoMensalTestCase(TestCase):
+    # O resumo mantido pelos sinais tem de coincidir sempre com os registos (resumo.verificar)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.residente, cls.outro = criar_dados(n_residentes=2, n_dispositivos=3)
+        cls.dispositivo = Dispositivo.objects.filter(residente=cls.residente, tipo__tipo='Agua').first()
+
+    def test_criar_editar_apagar(self):
+        registo = RegistoConsumo.objects.create(dispositivo=self.dispositivo, valor=Decimal('7'), timestamp=instante_do_mes(2026, 1))
+        self.assertEqual(resumo.verificar(), [])
+
+        registo.valor = Decimal('9.5')
+        registo.save()
+        self.assertEqual(resumo.verificar(), [])
+        # Mudar de mês desconta no mês antigo e soma no novo
+        registo.timestamp = instante_do_mes(2026, 2)
+        registo.save()
+        self.assertEqual(resumo.verificar(), [])
+        self.assertFalse(ResumoMensal.objects.filter(residente=self.residente, ano=2026, mes=1).exists())
+
+        registo.delete()
+        self.assertEqual(resumo.verificar(), [])
+        self.assertFalse(ResumoMensal.objects.filter(residente=self.residente, ano=2026).exists())
+
+    def test_mover_dispositivo(self):
+        self.dispositivo.residente = self.outro
+        self.dispositivo.save()
+        self.assertEqual(resumo.verificar(), [])
+
+        self.dispositivo.tipo = Tipo.objects.get(tipo='Gas')
+        self.dispositivo.save()
+        self.assertEqual(resumo.verificar(), [])
+
+    def test_reconstruir_corrige_diferencas(self):
+        RegistoConsumo.objects.filter(dispositivo=self.dispositivo).update(valor=Decimal('1'))
+        self.assertEqual(len(resumo.verificar(self.residente)), 12)
+        resumo.reconstruir(self.residente)
+        self.assertEqual(resumo.verificar(), [])
+
+
+class CachePaginasTestCase(TestCase):
+    # Cálculos das páginas em cache por versão dos dados do residente: uma escrita muda a chave
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.residente, cls.outro = criar_dados(n_residentes=2, n_dispositivos=3)
+
+    def setUp(self):
+        cache.clear()
+
+    def obter(self, residente, valor):
+        calcular = mock.Mock(return_value=valor)
+        return cache_paginas.obter(residente, 'teste', calcular, 2025, 3), calcular.called
+
+    def test_chave_muda_com_a_versao(self):
+        residente = Residente.objects.get(pk=self.residente.pk)
+        self.assertEqual(self.obter(residente, 1), (1, True))
+        self.assertEqual(self.obter(residente, 2), (1, False))
+
+        chave = cache_paginas._chave(residente, 'teste', (2025, 3))
+        versoes.tocar([residente.pk])
+        residente.refresh_from_db()
+        self.assertNotEqual(cache_paginas._chave(residente, 'teste', (2025, 3)), chave)
+        self.assertEqual(self.obter(residente, 3), (3, True))
+
+    def test_escritas_de_outro_residente_nao_invalidam(self):
+        residente = Residente.objects.get(pk=self.residente.pk)
+        self.obter(residente, 1)
+        RegistoConsumo.objects.create(
+            dispositivo=Dispositivo.objects.filter(residente=self.outro).first(), valor=1, timestamp=instante_do_mes(2026, 1)
+        )
+        residente.refresh_from_db()
+        self.assertEqual(self.obter(residente, 2), (1, False))
+
+    def test_dashboard_mostra_leitura_nova(self):
+        self.client.login(username=self.residente.email, password='pw')
+        url = reverse('dashboard') + '?ano=2026&mes=1'
+        antes = self.client.get(url).context['custo_total']
+        RegistoConsumo.objects.create(
+            dispositivo=Dispositivo.objects.get(residente=self.residente, nome='Agua 1'),
+            valor=Decimal('100'), timestamp=instante_do_mes(2026, 1)
+        )
+        self.assertGreater(self.client.get(url).context['custo_total'], antes)
+
+
+class IndicesTestCase(TestCase):
+    # As queries principais dos relatórios têm de usar os índices compostos (EXPLAIN)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.residente = criar_dados(n_residentes=2, n_dispositivos=4)[0]
+        cls.dispositivo = Dispositivo.objects.filter(residente=cls.residente).first()
+
+    def setUp(self):
+        cache.clear()
+
+    def assertUsaIndice(self, queryset, nome_indice):
+        plano = queryset.explain()
+        self.assertIn(nome_indice, plano, f'O índice {nome_indice} não foi usado:\n{plano}')
+
+    def test_registos_do_mes_por_dispositivo(self):
+        qs = RegistoConsumo.objects.filter(dispositivo=self.dispositivo, **filtro_mes(2025, 3))
+        self.assertUsaIndice(qs, 'registo_disp_ts_idx')
+
+    def test_historico_do_dispositivo_no_ano(self):
+        qs = RegistoConsumo.objects.filter(dispositivo=self.dispositivo, **filtro_ano(2025)).order_by('-timestamp')
+        self.assertUsaIndice(qs, 'registo_disp_ts_idx')
+
+    def test_resumo_do_mes(self):
+        qs = ResumoMensal.objects.filter(residente=self.residente, ano=2025, mes=3)
+        self.assertUsaIndice(qs, 'resumo_residente_periodo_idx')
+
+    def test_metas_do_mes(self):
+        qs = Orcamento_limite.objects.filter(residente=self.residente, **filtro_mes(2025, 3))
+        self.assertUsaIndice(qs, 'orcamento_residente_ts_idx')
+
+    def test_contratos_ativos(self):
+        qs = FornecedorResidente.objects.filter(residente=self.residente, status=1)
+        self.assertUsaIndice(qs, 'contrato_residente_status_idx')
+
+    def test_tarifas_do_servico(self):
+        servico = FornecedorTipo.objects.first()
+        qs = FornecedorValor.objects.filter(fornecedor_tipo=servico, timestamp__lte=instante_do_mes(2025, 3)).order_by('-timestamp')
+        self.assertUsaIndice(qs, 'tarifa_servico_ts_idx')
+
+    def test_intervalo_de_dezembro_termina_em_janeiro(self):
+        filtro = filtro_mes(2025, 12)
+        self.assertEqual((filtro['timestamp__lt'].year, filtro['timestamp__lt'].month), (2026, 1))
+        self.assertEqual(RegistoConsumo.objects.filter(dispositivo=self.dispositivo, **filtro).count(), 1)
+
+
+# Número de queries de cada vista (caches vazias): tem de ser o mesmo com poucos e com muitos dados
+ORCAMENTO_QUERIES = {
+    'dashboard': 9,
+    'relatorios': 9,
+    'pdf_mensal': 7,
+    'pdf_anual': 7,
+    'lista_fornecedores': 6,
+    'registar_consumo': 8,
+    'gerir_utilizadores': 6,
+}
+
+
+class OrcamentoQueriesMixin:
+    # Regressões N+1: as queries não podem crescer com dispositivos, leituras, fornecedores ou residentes
+    DADOS = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        criar_dados(**cls.DADOS)
+        User.objects.create_superuser('admin', 'admin@exemplo.pt', 'pw')
+        # O dashboard lê o alerta de orçamento já avaliado (como depois do comando avaliar_orcamentos)
+        orcamentos.avaliar(2025, 3)
+
+    def setUp(self):
+        # O primeiro pedido guarda o residente na sessão; as medições começam depois
+        self.client.login(username='residente0@exemplo.pt', password='pw')
+        self.client.get(reverse('definicoes'))
+        cache.clear()
+        caches['paginas'].clear()
+
+    def assertOrcamento(self, nome, url, cliente=None):
+        with self.assertNumQueries(ORCAMENTO_QUERIES[nome]):
+            resposta = (cliente or self.client).get(url)
+        self.assertIn(resposta.status_code, (200, 302))
+        return resposta
+
+    def test_dashboard(self):
+        self.assertOrcamento('dashboard', reverse('dashboard') + '?ano=2025&mes=3')
+
+    def test_relatorios(self):
+        self.assertOrcamento('relatorios', reverse('relatorios') + '?ano=2025&mes=3')
+
+    # O PDF em si é gerado em segundo plano (sem queries): só conta a preparação do HTML
+    def test_pdf_mensal(self):
+        with mock.patch.object(relatorios_pdf, 'pedir', return_value='0' * 64):
+            self.assertOrcamento('pdf_mensal', reverse('gerar_pdf', args=['mensal', 2025, 3]))
+
+    def test_pdf_anual(self):
+        with mock.patch.object(relatorios_pdf, 'pedir', return_value='0' * 64):
+            self.assertOrcamento('pdf_anual', reverse('gerar_pdf', args=['anual', 2025, 1]))
+
+    def test_lista_fornecedores(self):
+        self.assertOrcamento('lista_fornecedores', reverse('lista_fornecedores'))
+
+    def test_registar_consumo(self):
+        self.assertOrcamento('registar_consumo', reverse('registar_consumo'))
+
+    def test_gerir_utilizadores(self):
+        admin = self.client_class()
+        admin.login(username='admin', password='pw')
+        admin.get(reverse('definicoes'))
+        self.assertOrcamento('gerir_utilizadores', reverse('gerir_utilizadores'), admin)
+
+
+class OrcamentoQueriesPoucosDadosTestCase(OrcamentoQueriesMixin, TestCase):
+    DADOS = {'n_residentes': 1, 'n_dispositivos': 3, 'anos': (2025,), 'n_fornecedores': 1}
+
+
+class OrcamentoQueriesMuitosDadosTestCase(OrcamentoQueriesMixin, TestCase):
+    DADOS = {'n_residentes': 8, 'n_dispositivos': 12, 'anos': (2024, 2025), 'n_fornecedores': 3}
+
+
+class AlertaOrcamentoTestCase(TestCase):
+    # A avaliação em lote tem de dar o mesmo resultado que o dashboard, com um número fixo de queries
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.residentes = criar_dados(n_residentes=4, n_dispositivos=3, n_fornecedores=2)
+        # Meta de 20 € em março (criar_dados): o primeiro residente fica com uma meta folgada
+        Orcamento_limite.objects.filter(residente=cls.residentes[0]).update(valor=Decimal('999'))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_igual_ao_calculo_do_dashboard(self):
+        orcamentos.avaliar(2025, 3)
+        for residente in self.residentes:
+            alerta = AlertaOrcamento.objects.get(residente=residente, ano=2025, mes=3)
+            self.assertEqual(float(alerta.custo), calcular_custos(residente, 2025, 3)['custo_total'])
+        estados = dict(AlertaOrcamento.objects.values_list('residente_id', 'estado'))
+        self.assertEqual(estados[self.residentes[0].pk], AlertaOrcamento.DENTRO)
+        self.assertEqual(estados[self.residentes[1].pk], AlertaOrcamento.EXCEDIDO)
+
+    def test_sem_meta(self):
+        contagem = orcamentos.avaliar(2025, 4)
+        self.assertEqual(contagem[AlertaOrcamento.SEM_META], len(self.residentes))
+
+    def test_repetir_atualiza_as_mesmas_linhas(self):
+        orcamentos.avaliar(2025, 3)
+        Orcamento_limite.objects.filter(residente=self.residentes[1]).update(valor=Decimal('999'))
+        orcamentos.avaliar(2025, 3)
+        self.assertEqual(AlertaOrcamento.objects.filter(ano=2025, mes=3).count(), len(self.residentes))
+        self.assertEqual(AlertaOrcamento.objects.get(residente=self.residentes[1], ano=2025, mes=3).estado,
+                         AlertaOrcamento.DENTRO)
+
+    def test_queries_nao_crescem_com_os_residentes(self):
+        # Resumo, metas, contratos, tarifas e o INSERT ... ON CONFLICT
+        with self.assertNumQueries(5):
+            orcamentos.avaliar(2025, 3, [residente.pk for residente in self.residentes[:1]])
+        with self.assertNumQueries(5):
+            orcamentos.avaliar(2025, 3, [residente.pk for residente in self.residentes])
+
+    def test_dashboard_calcula_alerta_desatualizado_sem_gravar(self):
+        residente = self.residentes[0]
+        orcamentos.avaliar(2025, 3)
+        dispositivo = Dispositivo.objects.filter(residente=residente, tipo__tipo='Luz', categoria__categoria='Consumidor').first()
+        RegistoConsumo.objects.filter(dispositivo=dispositivo, **filtro_mes(2025, 3)).update(valor=Decimal('99999'))
+        resumo.reconstruir(residente)
+        versoes.tocar([residente.pk])
+
+        self.client.login(username=residente.email, password='pw')
+        resposta = self.client.get(reverse('dashboard') + '?ano=2025&mes=3')
+        self.assertEqual(resposta.context['status_alerta'], AlertaOrcamento.EXCEDIDO)
+        # Um GET não escreve: o alerta gravado fica como estava (e um mês nunca avaliado continua sem alerta)
+        self.assertEqual(AlertaOrcamento.objects.get(residente=residente, ano=2025, mes=3).estado, AlertaOrcamento.DENTRO)
+        self.client.get(reverse('dashboard') + '?ano=2024&mes=3')
+        self.assertFalse(AlertaOrcamento.objects.filter(residente=residente, ano=2024, mes=3).exists())
+
+    def test_gravar_leitura_reavalia_o_mes(self):
+        residente = self.residentes[0]
+        orcamentos.avaliar(2025, 3)
+        registo = RegistoConsumo.objects.filter(
+            dispositivo__residente=residente, dispositivo__tipo__tipo='Luz',
+            dispositivo__categoria__categoria='Consumidor', **filtro_mes(2025, 3)
+        ).first()
+        registo.valor = Decimal('99999')
+        with self.captureOnCommitCallbacks(execute=True):
+            registo.save()
+
+        alerta = orcamentos.alerta_atual(Residente.objects.get(pk=residente.pk), 2025, 3)
+        self.assertIsNotNone(alerta)
+        self.assertEqual(alerta.estado, AlertaOrcamento.EXCEDIDO)
+
+
+# Queries da análise entre residentes (versão, somas, contratos, tarifas, tipos, locais e custos):
+# não podem depender do número de residentes
+ANALISE_QUERIES = 7
+
+
+class AnaliseQueriesMixin:
+    # Subclasses definem DADOS (argumentos de criar_dados)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.residentes = criar_dados(**cls.DADOS)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_queries_nao_crescem_com_os_residentes(self):
+        with self.assertNumQueries(ANALISE_QUERIES):
+            analise.agregar(('cidade', 'mes'))
+        # Segunda vez do cache: só a query da versão
+        with self.assertNumQueries(1):
+            analise.agregar(('cidade', 'mes'))
+
+    def test_custo_igual_ao_dos_residentes(self):
+        _, linhas = analise.agregar(('mes',))
+        custos = {linha['chave'][1]: 0.0 for linha in linhas}
+        for linha in linhas:
+            custos[linha['chave'][1]] += linha['custo']
+        for mes in (3, 9):
+            esperado = sum(calcular_custos(residente, 2025, mes)['custo_total'] for residente in self.residentes)
+            self.assertAlmostEqual(custos[f'2025-{mes:02d}'], esperado, places=1)
+
+    def test_escrita_invalida_o_cache(self):
+        _, antes = analise.agregar(('tipo',))
+        RegistoConsumo.objects.create(
+            dispositivo=Dispositivo.objects.filter(residente=self.residentes[0], tipo__tipo='Agua').first(),
+            valor=Decimal('1000'), timestamp=instante_do_mes(2026, 1)
+        )
+        _, depois = analise.agregar(('tipo',))
+        self.assertNotEqual(antes, depois)
+
+
+class AnalisePoucosResidentesTestCase(AnaliseQueriesMixin, TestCase):
+    DADOS = {'n_residentes': 1, 'n_dispositivos': 3}
+
+
+class AnaliseMuitosResidentesTestCase(AnaliseQueriesMixin, TestCase):
+    DADOS = {'n_residentes': 6, 'n_dispositivos': 6, 'n_fornecedores': 2}
+
+
+class PrevisaoCustoTestCase(TestCase):
+    # Previsão vetorizada: sazonalidade, tendência, históricos curtos e desconto da produção na luz
+
+    def test_series(self):
+        inicio = 2024 * 12
+        historico = np.full((3, 24), np.nan)
+        historico[0] = 10 + np.arange(24)                    # só tendência
+        historico[1] = np.tile(np.arange(12) * 5.0, 2)       # só sazonalidade
+        historico[2, [20, 23]] = [4.0, 6.0]                  # dois meses: média, sem tendência
+        previsoes, meses = previsao.prever_series(historico, inicio, [inicio + 24, inicio + 25])
+        np.testing.assert_allclose(previsoes, [[34, 35], [0, 5], [5, 5]])
+        self.assertEqual(list(meses), [24, 24, 2])
+
+    def test_prever_grava_e_mostra_no_dashboard(self):
+        # Dois anos iguais: a previsão de janeiro é o janeiro anterior; na luz o gerador produz mais do que se gasta
+        residente = criar_dados(n_residentes=1, n_dispositivos=6, anos=(2024, 2025))[0]
+        self.assertEqual(previsao.prever(2026, 1), 6)
+
+        janeiro = {
+            linha.tipo.tipo: linha
+            for linha in PrevisaoCusto.objects.filter(residente=residente, ano=2026, mes=1).select_related('tipo')
+        }
+        self.assertEqual(janeiro['Luz'].consumo, 0)
+        self.assertEqual(janeiro['Agua'].consumo, Decimal('107'))
+        self.assertEqual(janeiro['Agua'].custo, Decimal('21.40'))
+        self.assertEqual(janeiro['Agua'].meses_historico, 24)
+
+        cache.clear()
+        self.client.login(username=residente.email, password='pw')
+        resposta = self.client.get(reverse('dashboard') + '?ano=2026&mes=1')
+        self.assertEqual(resposta.context['custo_previsto'], float(sum(linha.custo for linha in janeiro.values())))
+
+    def test_so_muda_a_versao_de_quem_tem_previsao_diferente(self):
+        residentes = criar_dados(n_residentes=2, n_dispositivos=3, anos=(2024, 2025))
+        previsao.prever(2026, 1)
+        versoes_antes = dict(Residente.objects.values_list('pk', 'dados_atualizados_em'))
+
+        # Sem dados novos não há nada a gravar nem a invalidar: só as 8 leituras (residentes, tipos, categorias,
+        # resumo, tipos, contratos, tarifas e previsões gravadas)
+        with self.assertNumQueries(8):
+            previsao.prever(2026, 1)
+        self.assertEqual(dict(Residente.objects.values_list('pk', 'dados_atualizados_em')), versoes_antes)
+
+        alterado, igual = residentes
+        RegistoConsumo.objects.filter(dispositivo__residente=alterado, **filtro_mes(2025, 1)).update(valor=Decimal('500'))
+        resumo.reconstruir(alterado)
+        alterado.refresh_from_db()
+        versao_alterado = alterado.dados_atualizados_em
+        previsao.prever(2026, 1)
+        self.assertGreater(Residente.objects.get(pk=alterado.pk).dados_atualizados_em, versao_alterado)
+        self.assertEqual(Residente.objects.get(pk=igual.pk).dados_atualizados_em, versoes_antes[igual.pk])
+
+
+class AnomaliaLeituraTestCase(TestCase):
+    # Uma leitura com um zero a mais tem de ser sinalizada; as variações normais do dispositivo não
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.residente = criar_dados(n_residentes=1, n_dispositivos=3)[0]
+        cls.dispositivo = Dispositivo.objects.filter(residente=cls.residente, tipo__tipo='Agua').first()
+        cls.errado = RegistoConsumo.objects.get(dispositivo=cls.dispositivo, **filtro_mes(2025, 6))
+
+    def test_analise_em_lote(self):
+        self.assertEqual(anomalias.analisar(), (36, 0))
+        RegistoConsumo.objects.filter(pk=self.errado.pk).update(valor=self.errado.valor * 10)
+        self.assertEqual(anomalias.analisar(), (36, 1))
+        anomalia = AnomaliaLeitura.objects.get()
+        self.assertEqual(anomalia.registo_id, self.errado.pk)
+        self.assertGreater(anomalia.pontuacao, anomalias.LIMIAR)
+
+    def test_registo_manual(self):
+        RegistoConsumo.objects.filter(pk=self.errado.pk).delete()
+        self.client.login(username=self.residente.email, password='pw')
+        resposta = self.client.post(reverse('registar_consumo'), {
+            'dispositivo': self.dispositivo.pk, 'valor': '570', 'mes': 6, 'ano': 2025,
+        }, follow=True)
+        self.assertContains(resposta, 'Confirme a leitura')
+        self.assertEqual(AnomaliaLeitura.objects.get().registo.valor, Decimal('570'))
+
+    def test_edicao_volta_a_verificar(self):
+        self.client.login(username=self.residente.email, password='pw')
+        url = reverse('editar_consumo', args=[self.errado.pk])
+        dados = {'dispositivo': self.dispositivo.pk, 'mes': 6, 'ano': 2025}
+        resposta = self.client.post(url, dict(dados, valor='570'), follow=True)
+        self.assertContains(resposta, 'Confirme a leitura')
+        self.assertTrue(AnomaliaLeitura.objects.filter(registo=self.errado).exists())
+        # Corrigida a leitura, a sinalização desaparece
+        self.client.post(url, dict(dados, valor='57'))
+        self.assertFalse(AnomaliaLeitura.objects.filter(registo=self.errado).exists())
+
+
+class HistoricoTestCase(TestCase):
+    # Paginação por chave do histórico: várias leituras no mesmo instante (um por mês) não podem repetir nem faltar
+
+    @classmethod
+    def setUpTestData(cls):
+        # 4 dispositivos x 12 meses: cada instante tem 4 leituras e as páginas acabam a meio de um mês
+        cls.residente = criar_dados(n_residentes=1, n_dispositivos=4)[0]
+        cls.esperado = list(historico.registos_de(cls.residente).values_list('pk', flat=True))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_paginas_com_instantes_iguais(self):
+        vistos, cursor = [], None
+        while True:
+            linhas, cursor = historico.pagina(historico.registos_de(self.residente), cursor, tamanho=5)
+            vistos += [registo.pk for registo in linhas]
+            if cursor is None:
+                break
+        self.assertEqual(vistos, self.esperado)
+
+    def test_scroll_infinito_segue_o_cursor(self):
+        self.client.login(username=self.residente.email, password='pw')
+        pagina = self.client.get(reverse('registar_consumo'))
+        vistos = [registo.pk for registo in pagina.context['historico']]
+        proximo = pagina.context['proximo']
+        self.assertIsNotNone(proximo)
+        while proximo:
+            dados = self.client.get(reverse('historico_consumos'), {'cursor': proximo}).json()
+            vistos += [registo['id'] for registo in dados['registos']]
+            proximo = dados['proximo']
+        self.assertEqual(vistos, self.esperado)
+
+
+class PedidosCondicionaisTestCase(TestCase):
+    # ETag/304: nada mudou -> 304; uma gravação muda a ETag; mensagens por mostrar obrigam a gerar a página
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.residente = criar_dados(n_residentes=1, n_dispositivos=3)[0]
+        cls.dispositivo = Dispositivo.objects.filter(residente=cls.residente, tipo__tipo='Agua').first()
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username=self.residente.email, password='pw')
+        self.url = reverse('relatorios') + '?ano=2025&mes=3'
+
+    def test_sem_alteracoes_responde_304(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_gravar_muda_a_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.post(reverse('registar_consumo'), {
+            'dispositivo': self.dispositivo.pk, 'valor': '12', 'mes': 1, 'ano': 2026,
+        }, follow=True)
+        resposta = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertNotEqual(resposta['ETag'], etag)
+
+    def test_mensagens_pendentes_nao_dao_304(self):
+        etag = self.client.get(self.url)['ETag']
+        # Pedido de um PDF que não existe: mensagem de erro e redirect para os relatórios, sem mudar os dados
+        self.client.get(reverse('estado_pdf', args=['0' * 64]))
+        resposta = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(resposta, 'Não foi possível gerar o relatório')
+        self.assertFalse(resposta.has_header('ETag'))
+        # Depois de mostrada, a página volta a poder ser servida com 304
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class ApiLeiturasTestCase(TestCase):
+    # Ingestão dos medidores: autenticação, erros por leitura, reenvios idempotentes e correções em conflito
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.residente = criar_dados(n_residentes=1, n_dispositivos=3)[0]
+        cls.dispositivo = Dispositivo.objects.filter(residente=cls.residente, tipo__tipo='Agua').first()
+        _, cls.chave = ingestao.gerar_chave(cls.residente, 'Contador')
+
+    def setUp(self):
+        cache.clear()
+
+    def enviar(self, leituras, chave=None):
+        return self.client.post(
+            reverse('api_leituras'), json.dumps(leituras), content_type='application/json',
+            HTTP_AUTHORIZATION=f'Token {chave or self.chave}'
+        )
+
+    def leitura(self, mes, valor, **extra):
+        return {'dispositivo_id': self.dispositivo.pk, 'ano': 2026, 'mes': mes, 'valor': valor, **extra}
+
+    def test_autenticacao(self):
+        resposta = self.client.post(reverse('api_leituras'), '[]', content_type='application/json')
+        self.assertEqual(resposta.status_code, 401)
+        self.assertEqual(self.enviar([self.leitura(1, '10')], chave='errada').status_code, 401)
+        self.assertFalse(RegistoConsumo.objects.filter(dispositivo=self.dispositivo, **filtro_ano(2026)).exists())
+
+    def test_leitura_invalida_nao_estraga_o_lote(self):
+        resposta = self.enviar([
+            self.leitura(1, '10'),
+            self.leitura(2, 'abc'),
+            {'dispositivo_id': self.dispositivo.pk, 'timestamp': '2026-13-01T00:00:00', 'valor': '5'},
+            self.leitura(3, '12'),
+        ])
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual([item['codigo'] for item in resposta.json()['resultados']], [201, 422, 422, 201])
+        self.assertEqual(RegistoConsumo.objects.filter(dispositivo=self.dispositivo, **filtro_ano(2026)).count(), 2)
+
+    def test_reenvio_igual_e_idempotente(self):
+        leituras = [self.leitura(1, '10'), self.leitura(2, '11.5')]
+        self.assertEqual(self.enviar(leituras).json()['criados'], 2)
+        resposta = self.enviar([self.leitura(1, '10.00'), self.leitura(2, '11.5')]).json()
+        self.assertEqual((resposta['criados'], resposta['duplicados'], resposta['conflitos']), (0, 2, 0))
+        self.assertEqual([item['codigo'] for item in resposta['resultados']], [200, 200])
+        self.assertEqual(RegistoConsumo.objects.filter(dispositivo=self.dispositivo, **filtro_ano(2026)).count(), 2)
+
+    def test_reenvio_com_outro_valor_e_conflito(self):
+        self.enviar([self.leitura(1, '10')])
+        resposta = self.enviar([self.leitura(1, '100'), self.leitura(2, '20'), self.leitura(2, '21')]).json()
+        self.assertEqual([item['estado'] for item in resposta['resultados']], ['conflito', 'criado', 'conflito'])
+        self.assertEqual(resposta['resultados'][0]['codigo'], 409)
+        self.assertEqual(RegistoConsumo.objects.get(dispositivo=self.dispositivo, **filtro_mes(2026, 1)).valor, Decimal('10'))
+
+
+
+class ExportacaoTestCase(TestCase):
+    # Exportação em blocos: todas as linhas uma vez, com a tarifa e o contrato em vigor no instante de cada registo
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.residente = criar_dados(n_residentes=1, n_dispositivos=3)[0]
+        cls.agua = Dispositivo.objects.get(residente=cls.residente, nome='Agua 1')
+        # Em abril de 2025 a água passa para um serviço com outra tarifa
+        servico = FornecedorTipo.objects.create(
+            fornecedor=Fornecedor.objects.create(nome='Outro', nif='509999999'), tipo=cls.agua.tipo, unidade='m3'
+        )
+        FornecedorValor.objects.create(fornecedor_tipo=servico, valor=Decimal('0.900'), timestamp=instante_do_mes(2024, 1))
+        FornecedorResidente.objects.create(
+            fornecedor_tipo=servico, residente=cls.residente, status=1, timestamp=instante_do_mes(2025, 4)
+        )
+        cls.servico = servico
+
+    def test_preco_em_nos_limites(self):
+        tarifas = LinhaTemporalTarifas.carregar([self.residente])
+        antigo = FornecedorResidente.objects.filter(residente=self.residente, fornecedor_tipo__tipo__tipo='Agua').earliest('timestamp')
+        servico = antigo.fornecedor_tipo_id
+        # No instante exato da nova tarifa já vale a nova; antes da primeira tarifa vale a mais antiga
+        self.assertEqual(tarifas.preco_em(servico, instante_do_mes(2025, 7) - datetime.timedelta(seconds=1)), 0.15)
+        self.assertEqual(tarifas.preco_em(servico, instante_do_mes(2025, 7)), 0.2)
+        self.assertEqual(tarifas.preco_em(servico, instante_do_mes(2000, 1)), 0.15)
+        self.assertEqual(tarifas.preco_em(-1, instante_do_mes(2025, 7)), PRECO_POR_OMISSAO)
+
+        self.assertEqual(tarifas.contrato_em(self.residente.pk, 'Agua', instante_do_mes(2025, 3)), servico)
+        self.assertEqual(tarifas.contrato_em(self.residente.pk, 'Agua', instante_do_mes(2025, 4)), self.servico.pk)
+
+    def test_linhas_com_a_tarifa_de_cada_mes(self):
+        registos = exportacao.registos_de(self.residente, {'dispositivo': self.agua})
+        tarifas = {linha[10]: linha[12] for linha in exportacao.linhas(registos, tamanho=5)}
+        self.assertEqual([tarifas[mes] for mes in (3, 4, 7)], [0.15, 0.9, 0.9])
+
+    def test_blocos_nao_repetem_nem_perdem_linhas(self):
+        registos = exportacao.registos_de(self.residente)
+        pks = [linha[0] for linha in exportacao.linhas(registos, tamanho=7)]
+        self.assertEqual(pks, sorted(registos.values_list('pk', flat=True)))
+
+    def test_resposta_em_streaming(self):
+        self.client.login(username=self.residente.email, password='pw')
+        resposta = self.client.get(reverse('exportar_consumos') + '?formato=jsonl')
+        self.assertTrue(resposta.streaming)
+        linhas = [json.loads(linha) for linha in b''.join(resposta.streaming_content).decode('utf-8').splitlines()]
+        self.assertEqual(len(linhas), RegistoConsumo.objects.filter(dispositivo__residente=self.residente).count())
+        self.assertEqual(set(linhas[0]), set(exportacao.COLUNAS))
+
+
+class ImportacaoCsvTestCase(TestCase):
+    # Importação de CSV: linhas válidas e inválidas, duplicados, conflitos, lotes e identificação dos dispositivos
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.residente = criar_dados(n_residentes=1, n_dispositivos=3)[0]
+        cls.agua = Dispositivo.objects.get(residente=cls.residente, nome='Agua 1')
+        cls.gas = Dispositivo.objects.get(residente=cls.residente, nome='Gas 2')
+
+    def importar(self, texto, residente=True, **opcoes):
+        importador = Importador(residente=self.residente if residente else None, **opcoes)
+        return importador.importar(ler_csv(io.StringIO(texto)))
+
+    def registos(self, dispositivo, ano=2026):
+        return dict(
+            (timestamp.month, valor) for timestamp, valor in
+            RegistoConsumo.objects.filter(dispositivo=dispositivo, **filtro_ano(ano)).values_list('timestamp', 'valor')
+        )
+
+    def test_ficheiro_valido(self):
+        resultado = self.importar(
+            'dispositivo,ano,mes,valor,unidade\n'
+            'Agua 1,2026,1,10.5,m3\n'
+            'Gas 2,2026,1,"7,25",\n'
+        )
+        self.assertEqual((resultado.criados, resultado.duplicados, resultado.erros), (2, 0, []))
+        self.assertEqual(self.registos(self.agua), {1: Decimal('10.5')})
+        self.assertEqual(self.registos(self.gas), {1: Decimal('7.25')})
+        self.assertEqual(resumo.verificar(), [])
+
+    def test_linhas_invalidas(self):
+        resultado = self.importar(
+            'dispositivo,ano,mes,valor,unidade\n'
+            'Agua 1,2026,13,1,\n'
+            'Agua 1,2026,1,-3,\n'
+            'Agua 1,2026,2,1.234,\n'
+            'Agua 1,2026,3,1,kWh\n'
+            'Desconhecido,2026,1,1,\n'
+            ',2026,1,1,\n'
+            'Agua 1,2026,4,12,\n'
+        )
+        self.assertEqual(resultado.criados, 1)
+        self.assertEqual([linha for linha, _ in resultado.erros], [2, 3, 4, 5, 6, 7])
+        self.assertEqual(self.registos(self.agua), {4: Decimal('12')})
+
+        with self.assertRaises(ValidationError):
+            self.importar('nome,ano,mes,valor\nAgua 1,2026,1,1\n')
+
+    def test_duplicados_e_conflitos(self):
+        texto = 'dispositivo,ano,mes,valor\nAgua 1,2026,1,10\nAgua 1,2026,2,11\n'
+        self.importar(texto)
+        resultado = self.importar(texto + 'Agua 1,2026,2,99\nAgua 1,2026,3,12\nAgua 1,2026,3,12\n')
+        self.assertEqual((resultado.criados, resultado.duplicados), (1, 3))
+        self.assertEqual([linha for linha, _ in resultado.conflitos], [4])
+        self.assertEqual(self.registos(self.agua), {1: Decimal('10'), 2: Decimal('11'), 3: Decimal('12')})
+
+    def test_lotes(self):
+        linhas = ''.join(f'Agua 1,2026,{mes},{mes}\n' for mes in range(1, 13))
+        # A repetição do mês 1 fica noutro lote: tem de ser apanhada pela verificação na base de dados
+        resultado = self.importar('dispositivo,ano,mes,valor\n' + linhas + 'Agua 1,2026,1,1\n', tamanho_lote=5)
+        self.assertEqual((resultado.criados, resultado.duplicados), (12, 1))
+        self.assertEqual(len(self.registos(self.agua)), 12)
+        self.assertEqual(resumo.verificar(), [])
+
+    def test_nome_com_algarismos_nao_e_um_numero(self):
+        numerado = Dispositivo.objects.create(
+            nome='123', tipo=self.agua.tipo, categoria=self.agua.categoria, residente=self.residente, unidade='m3'
+        )
+        outro = Dispositivo.objects.create(
+            pk=numerado.pk + 1000, nome='Outro', tipo=self.agua.tipo, categoria=self.agua.categoria,
+            residente=self.residente, unidade='m3'
+        )
+        resultado = self.importar(
+            'dispositivo,dispositivo_id,ano,mes,valor\n'
+            f'{outro.pk},,2026,1,5\n'
+            f',{outro.pk},2026,2,6\n'
+            '123,,2026,1,7\n'
+            'Outro,,2026,3,8\n'
+        )
+        self.assertEqual([linha for linha, _ in resultado.erros], [2])
+        self.assertEqual(self.registos(outro), {2: Decimal('6'), 3: Decimal('8')})
+        self.assertEqual(self.registos(numerado), {1: Decimal('7')})
+
+        # Sem residente os nomes não chegam (repetem-se entre residentes): só o dispositivo_id
+        resultado = self.importar(
+            f'dispositivo,dispositivo_id,ano,mes,valor\n123,,2026,3,1\n,{self.gas.pk},2026,3,1\n', residente=False
+        )
+        self.assertEqual((resultado.criados, [linha for linha, _ in resultado.erros]), (1, [2]))
+
+class RelatoriosPdfTestCase(TestCase):
+    # O estado dos pedidos fica no disco (qualquer worker responde) e a pasta muda com a versão dos dados
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.residente = criar_dados(n_residentes=1, n_dispositivos=3)[0]
+
+    def setUp(self):
+        pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(pasta.cleanup)
+        patcher = mock.patch.object(relatorios_pdf, 'PASTA', Path(pasta.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.residente.refresh_from_db()
+
+    def test_estado_partilhado_entre_processos(self):
+        libertar = threading.Event()
+
+        def renderizar(html_string):
+            libertar.wait(5)
+            return b'%PDF-1.7'
+
+        with mock.patch.object(relatorios_pdf.renderizador_pdf, 'renderizar', side_effect=renderizar):
+            chave = relatorios_pdf.pedir(self.residente, '<p>a</p>', 'a.pdf', 'mensal', 2025, 3)
+            self.assertEqual(relatorios_pdf.estado(self.residente, chave), relatorios_pdf.EM_CURSO)
+            pasta = relatorios_pdf._pasta(self.residente)
+            self.assertTrue((pasta / f'{chave}.pendente').exists())
+            # Outro worker não volta a pedir o mesmo relatório
+            self.assertFalse(relatorios_pdf._marcar_pendente(pasta, chave))
+            libertar.set()
+            self.assertEsperar(self.residente, chave, relatorios_pdf.PRONTO)
+        self.assertFalse((pasta / f'{chave}.pendente').exists())
+
+    def test_erro_fica_registado(self):
+        with mock.patch.object(relatorios_pdf.renderizador_pdf, 'renderizar', side_effect=RuntimeError('sem fontes')), \
+                self.assertLogs('Gestao_Consumos.relatorios_pdf', 'ERROR'):
+            chave = relatorios_pdf.pedir(self.residente, '<p>b</p>', 'b.pdf', 'mensal', 2025, 3)
+            self.assertEsperar(self.residente, chave, relatorios_pdf.ERRO)
+        self.assertEqual(relatorios_pdf.erro(self.residente, chave), 'sem fontes')
+
+    def test_alteracao_dos_dados_nao_reaproveita_render_em_curso(self):
+        libertar = threading.Event()
+
+        def renderizar(html_string):
+            libertar.wait(5)
+            return b'%PDF-1.7'
+
+        with mock.patch.object(relatorios_pdf.renderizador_pdf, 'renderizar', side_effect=renderizar):
+            antigo = Residente.objects.get(pk=self.residente.pk)
+            chave = relatorios_pdf.pedir(antigo, '<p>c</p>', 'c.pdf', 'mensal', 2025, 3)
+            # Uma leitura gravada a meio do render muda a versão: o PDF que está a ser escrito já não serve
+            RegistoConsumo.objects.filter(dispositivo__residente=self.residente).first().save()
+            self.residente.refresh_from_db()
+            self.assertEqual(relatorios_pdf.estado(self.residente, chave), relatorios_pdf.DESCONHECIDO)
+            novo = relatorios_pdf.pedir(self.residente, '<p>d</p>', 'd.pdf', 'mensal', 2025, 3)
+            libertar.set()
+            self.assertEsperar(self.residente, novo, relatorios_pdf.PRONTO)
+            self.assertEsperar(antigo, chave, relatorios_pdf.PRONTO)
+            self.assertIsNone(relatorios_pdf.obter(self.residente, chave))
+            # Na próxima limpeza a pasta da versão antiga desaparece (espera pelo render para não apagar a pasta
+            # temporária com ele ainda a escrever)
+            ultimo = relatorios_pdf.pedir(self.residente, '<p>e</p>', 'e.pdf', 'mensal', 2025, 3)
+            self.assertEsperar(self.residente, ultimo, relatorios_pdf.PRONTO)
+        self.assertEqual(
+            [pasta.name for pasta in (relatorios_pdf.PASTA / str(self.residente.pk)).iterdir()],
+            [str(relatorios_pdf.versao_de(self.residente))]
+        )
+
+    def assertEsperar(self, residente, chave, estado):
+        for _ in range(100):
+            if relatorios_pdf.estado(residente, chave) == estado:
+                return
+            time.sleep(0.02)
+        self.fail(f'O relatório não chegou ao estado {estado}.')
@@ -0,0 +1,52 @@
+import datetime
+import hashlib
+
+from django.contrib import messages
+from django.utils import timezone
+
+from .middleware import obter_residente
+from .models import Residente, FornecedorResidente
+
+
+# Marca os dados de residentes como alterados (um UPDATE para todos)
+def tocar(residente_ids):
+    residente_ids = {pk for pk in residente_ids if pk}
+    if residente_ids:
+        Residente.objects.filter(pk__in=residente_ids).update(dados_atualizados_em=timezone.now())
+
+
+# Mudou uma tarifa/serviço: afeta quem tem ou teve contrato com esses serviços (os custos antigos também mudam)
+def tocar_servicos(fornecedor_tipo_ids):
+    Residente.objects.filter(
+        pk__in=FornecedorResidente.objects.filter(fornecedor_tipo_id__in=fornecedor_tipo_ids).values('residente_id')
+    ).update(dados_atualizados_em=timezone.now())
+
+
+# ===== PEDIDOS CONDICIONAIS (django.views.decorators.http.condition) =====
+
+# Com mensagens por mostrar (ex.: "Atualizado com sucesso!" depois de um redirect) a página tem de ser gerada:
+# um 304 reaproveitava a cópia do browser e as mensagens perdiam-se. len() não as marca como lidas
+def _mensagens_pendentes(request):
+    return bool(len(messages.get_messages(request)))
+
+
+# Nunca anterior ao início do dia: as páginas dependem da data atual
+def ultima_alteracao(request, *args, **kwargs):
+    residente = obter_residente(request)
+    if residente is None or residente.dados_atualizados_em is None or _mensagens_pendentes(request):
+        return None
+    inicio_do_dia = timezone.make_aware(datetime.datetime.combine(timezone.localdate(), datetime.time()))
+    return max(residente.dados_atualizados_em, inicio_do_dia)
+
+
+# A ETag junta o residente, a versão dos dados, o URL (ano/mês/tipo) e o dia de hoje
+# (as páginas usam a data atual por omissão e o PDF imprime-a)
+def etag(request, *args, **kwargs):
+    residente = obter_residente(request)
+    if residente is None or residente.dados_atualizados_em is None or _mensagens_pendentes(request):
+        return None
+    partes = (
+        residente.pk, residente.dados_atualizados_em.isoformat(),
+        request.get_full_path(), timezone.localdate().isoformat(),
+    )
+    return hashlib.sha1(repr(partes).encode('utf-8')).hexdigest()
@@ -1,34 +1,40 @@
-import os , json , datetime
+import io , json , datetime
+from urllib.parse import urlencode
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.db import transaction, models
-from django.db.models import Sum
+from django.db.models import Sum, Q, Prefetch
 from django.db.models.functions import ExtractMonth, ExtractYear
 from django.core.exceptions import ValidationError
-from django.http import HttpResponse, JsonResponse
+from django.core.paginator import Paginator
+from django.http import HttpResponse, JsonResponse, FileResponse, Http404, StreamingHttpResponse
+from django.urls import reverse
+from django.conf import settings
 from django.template.loader import render_to_string
-from weasyprint import HTML  # Para gerar PDFs
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth import authenticate, login
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, condition
 
 from .models import (
     Residente, Dispositivo, RegistoConsumo, Orcamento_limite,
     Fornecedor, FornecedorTipo, FornecedorValor, FornecedorResidente,
-    Tipo, Categoria
+    Tipo, Categoria, AlertaOrcamento, PrevisaoCusto
 )
 
 from .forms import (
     RegistoResidenteForm, DispositivoForm, EditarPerfilForm,
-    ConsumoManualForm, CriarMetaForm, EditarMetaForm
+    ConsumoManualForm, CriarMetaForm, EditarMetaForm, ImportarConsumosForm, FiltroHistoricoForm,
+    FiltroAnaliseForm
 )
-
-# Configuração de paths para o GTK
-if os.name == 'nt':
-    GIO_LIB_PATH = r'C:\Program Files\GTK3-Runtime\bin'
-    if os.path.exists(GIO_LIB_PATH):
-        os.environ['PATH'] = GIO_LIB_PATH + os.pathsep + os.environ['PATH']
+from .custos import calcular_custos, calcular_serie_anual
+from .periodos import filtro_ano, filtro_mes, filtro_datas, instante_do_mes
+from . import cache_tarifas
+from . import relatorios_pdf, resumo, ingestao, exportacao, historico, versoes, cache_paginas, metricas, analise, orcamentos
+from .importacao import Importador, ler_csv
+from .middleware import obter_residente
 
 MESES = {
     1: 'Janeiro', 2: 'Fevereiro', 3: 'Março', 4: 'Abril', 5: 'Maio',
@@ -38,33 +44,9 @@ MESES = {
 
 # ===== FUNÇÕES HELPERS =====
 
-def _get_residente_or_redirect(user, redirect_to='dashboard'):
-    try:
-      
-        return Residente.objects.get(email=user.email)
-    except Residente.DoesNotExist:
-   
-        if user.is_superuser:
-          
-            residente_root, created = Residente.objects.get_or_create(
-                telemovel='999999999',  
-                defaults={
-                    'nome': 'Administrador (Root)',
-                    'email': user.email,
-                    'password': 'root_password_placeholder',
-                    'morada': 'Sede Administrativa',
-                    'cidade': 'Sistema',
-                    'codigo_postal': '0000-000',
-                    'status': 1
-                }
-            )
-            if not created and residente_root.email != user.email:
-                residente_root.email = user.email
-                residente_root.save()
-                
-            return residente_root
-    
-        return None
+# Residente do utilizador autenticado (resolvido uma vez por pedido, ver middleware.py)
+def _get_residente_or_redirect(request, redirect_to='dashboard'):
+    return obter_residente(request)
 
 # Função helper para extrair e validar ano e mês dos parâmetros GET
 def _parse_ano_mes(request, default_date=None):
@@ -77,54 +59,24 @@ def _parse_ano_mes(request, default_date=None):
         ano, mes = default_date.year, default_date.month
     return ano, mes
 
-#Preços recentes dos fornecedores
-def get_latest_price(fornecedor_tipo):
-    tarifa = FornecedorValor.objects.filter(fornecedor_tipo=fornecedor_tipo).order_by('-timestamp').first()
-    return float(tarifa.valor) if tarifa else 1.0
-
-# Função para obter o contrato ativo de um fornecedor para um tipo (Luz, Água, Gás)
-def get_active_contract(residente, tipo_nome):
-    return FornecedorResidente.objects.filter(
-        residente=residente,
-        fornecedor_tipo__tipo__tipo=tipo_nome,
-        status=1  # Apenas contratos ativos
-    ).order_by('-timestamp').first()
-
-# Função para somar apenas consumo (não produção) de um tipo específico
-def somar_apenas_consumo(tipo_nome, registos_base):
-    soma = registos_base.filter(
-        dispositivo__tipo__tipo=tipo_nome,
-        dispositivo__categoria__categoria='Consumidor'
-    ).aggregate(Sum('valor'))['valor__sum']
-    return float(soma) if soma else 0.0
-
-
-# Considera consumo líquido de luz (consumo - produção)
-def calcular_custos_por_tipo(registos_base, residente):
-    # Obter preços dos fornecedores ativos para cada tipo de utilidade
-    PRECOS = {}
-    for tipo_nome in ('Luz', 'Agua', 'Gas'):
-        contrato = get_active_contract(residente, tipo_nome)
-        PRECOS[tipo_nome] = get_latest_price(contrato.fornecedor_tipo) if contrato else 1.0
-
-    # Calcular consumo de luz: gasto - produção
-    gasto_luz = somar_apenas_consumo('Luz', registos_base)
-    producao_luz_val = registos_base.filter(
-        dispositivo__tipo__tipo='Luz',
-        dispositivo__categoria__categoria='Gerador'
-    ).aggregate(Sum('valor'))['valor__sum'] or 0.0
-
-    # Consumo líquido de luz nunca pode ser negativo
-    consumo_luz_liquido = max(0, float(gasto_luz) - float(producao_luz_val))
-    consumo_agua = somar_apenas_consumo('Agua', registos_base)
-    consumo_gas = somar_apenas_consumo('Gas', registos_base)
-
-    # Retorna dicionário com custos calculados (consumo * preço por unidade)
-    return {
-        'Luz': round(consumo_luz_liquido * PRECOS['Luz'], 2),
-        'Agua': round(consumo_agua * PRECOS['Agua'], 2),
-        'Gas': round(consumo_gas * PRECOS['Gas'], 2),
-    }
+# Resposta em streaming com os registos de consumo (?formato=csv|jsonl&desde=AAAA-MM-DD&ate=AAAA-MM-DD)
+def _exportar(request, residente, tarifas, nome):
+    formato = request.GET.get('formato', 'csv')
+    if formato not in exportacao.FORMATOS:
+        return HttpResponse('Formato inválido (csv ou jsonl).', status=400)
+    try:
+        desde = datetime.date.fromisoformat(request.GET['desde']) if request.GET.get('desde') else None
+        ate = datetime.date.fromisoformat(request.GET['ate']) if request.GET.get('ate') else None
+    except ValueError:
+        return HttpResponse('Datas inválidas (usar AAAA-MM-DD).', status=400)
+
+    registos = exportacao.registos_de(residente, filtro_datas(desde, ate))
+    content_type, extensao = exportacao.FORMATOS[formato]
+    resposta = StreamingHttpResponse(
+        exportacao.gerar(formato, exportacao.linhas(registos, tarifas)), content_type=content_type
+    )
+    resposta['Content-Disposition'] = f'attachment; filename="{nome}_{datetime.date.today():%Y%m%d}.{extensao}"'
+    return resposta
 
 def registar(request):
     if request.method == 'POST':
@@ -132,13 +84,17 @@ def registar(request):
         if form.is_valid():
             residente = form.save()
             # Verifica se utilizador Django já existe
-            if not User.objects.filter(username=residente.email).exists():
-                User.objects.create_user(
+            utilizador = User.objects.filter(username=residente.email).first()
+            if utilizador is None:
+                utilizador = User.objects.create_user(
                     username=residente.email,
                     email=residente.email,
                     password=residente.password,
                     first_name=residente.nome
                 )
+            if not hasattr(utilizador, 'residente'):
+                residente.utilizador = utilizador
+                residente.save(update_fields=['utilizador'])
             messages.success(request, 'Conta criada! Faça login.')
             return redirect('login')
     else:
@@ -147,73 +103,77 @@ def registar(request):
 
 
 @login_required(login_url='login')
+# Responde 304 se os dados do residente não mudaram desde a última visita (ver versoes.py)
+@condition(etag_func=versoes.etag, last_modified_func=versoes.ultima_alteracao)
 def dashboard(request):
-    residente = _get_residente_or_redirect(request.user)
+    residente = _get_residente_or_redirect(request)
     ano, mes = _parse_ano_mes(request)
 
-    registos_mes = RegistoConsumo.objects.filter(
-        dispositivo__residente=residente,
-        timestamp__year=ano,
-        timestamp__month=mes
-    )
-
-    custos = calcular_custos_por_tipo(registos_mes, residente)
-    gasto_luz_val = registos_mes.filter(
-        dispositivo__tipo__tipo='Luz',
-        dispositivo__categoria__categoria='Consumidor'
-    ).aggregate(Sum('valor'))['valor__sum'] or 0
-
-    prod_luz_val = registos_mes.filter(
-        dispositivo__tipo__tipo='Luz',
-        dispositivo__categoria__categoria='Gerador'
-    ).aggregate(Sum('valor'))['valor__sum'] or 0
-
-    consumo_luz_liquido = max(0, float(gasto_luz_val) - float(prod_luz_val))
-    consumo_agua = somar_apenas_consumo('Agua', registos_mes)
-    consumo_gas = somar_apenas_consumo('Gas', registos_mes)
-
-    custo_total = round(sum(custos.values()), 2)
-
-    metas_total_query = Orcamento_limite.objects.filter(
-        residente=residente, timestamp__month=mes, timestamp__year=ano
-    ).aggregate(Sum('valor'))['valor__sum']
-    meta_orcamento_total = float(metas_total_query) if metas_total_query else 0.00
-
-    if custo_total > meta_orcamento_total and meta_orcamento_total > 0:
-        status_alerta = 'excedido'
-    elif meta_orcamento_total > 0:
-        status_alerta = 'dentro'
-    else:
-        status_alerta = 'sem_meta'
-
-    dispositivos = Dispositivo.objects.filter(residente=residente)
+    # Cálculos do mês em cache até à próxima alteração dos dados do residente (ver cache_paginas.py)
+    calculado = cache_paginas.obter(residente, 'dashboard', lambda: _calcular_dashboard(residente, ano, mes), ano, mes)
 
     # Prepara contexto para template
     context = {
         'residente': residente,
-        'dispositivos': dispositivos,
-        'total_dispositivos': dispositivos.count(),
         'ano_atual': ano,
         'mes_atual': mes,
         'anos_range': range(2025, 2031),
         'meses_range': range(1, 13),
-        'consumo_luz': round(consumo_luz_liquido, 2),
-        'consumo_agua': round(consumo_agua, 2),
-        'consumo_gas': round(consumo_gas, 2),
+        **calculado,
+    }
+    return render(request, 'Gestao_Consumos/dashboard.html', context)
+
+def _calcular_dashboard(residente, ano, mes):
+    # Consumos e custos do mês numa só passagem (ver custos.py)
+    resumo = calcular_custos(residente, ano, mes)
+    custos = resumo['custos']
+    consumos = resumo['consumos']
+    custo_total = resumo['custo_total']
+
+    # Estado do orçamento: o alerta gravado se estiver atualizado; senão é calculado aqui, sem gravar (um GET não escreve)
+    alerta = orcamentos.alerta_atual(residente, ano, mes)
+    if alerta is not None:
+        meta_orcamento_total = float(alerta.meta)
+        status_alerta = alerta.estado
+    else:
+        metas_total_query = Orcamento_limite.objects.filter(
+            residente=residente, **filtro_mes(ano, mes)
+        ).aggregate(Sum('valor'))['valor__sum']
+        meta_orcamento_total = float(metas_total_query) if metas_total_query else 0.00
+        status_alerta = orcamentos.estado_de(custo_total, meta_orcamento_total)
+
+    # Previsão do custo do mês (comando prever_custos); None se o mês não foi previsto
+    custo_previsto = PrevisaoCusto.objects.filter(
+        residente=residente, ano=ano, mes=mes
+    ).aggregate(Sum('custo'))['custo__sum']
+    estado_previsao = None
+    if custo_previsto is not None:
+        custo_previsto = round(float(custo_previsto), 2)
+        estado_previsao = orcamentos.estado_de(custo_previsto, meta_orcamento_total)
+
+    dispositivos = list(Dispositivo.objects.filter(residente=residente).select_related('tipo', 'categoria'))
+
+    return {
+        'dispositivos': dispositivos,
+        'total_dispositivos': len(dispositivos),
+        'consumo_luz': round(consumos['Luz'], 2),
+        'consumo_agua': round(consumos['Agua'], 2),
+        'consumo_gas': round(consumos['Gas'], 2),
         'custo_luz': custos['Luz'],
         'custo_agua': custos['Agua'],
         'custo_gas': custos['Gas'],
         'custo_total': custo_total,
         'meta_orcamento_total': round(meta_orcamento_total, 2),
         'status_alerta': status_alerta,
+        'custo_previsto': custo_previsto,
+        'estado_previsao': estado_previsao,
     }
-    return render(request, 'Gestao_Consumos/dashboard.html', context)
 
 
 
 @login_required(login_url='login')
 def adicionar_dispositivo(request):
-    residente = _get_residente_or_redirect(request.user)
+    residente = _get_residente_or_redirect(request)
     if request.method == 'POST':
         form = DispositivoForm(request.POST)
         if form.is_valid():
@@ -255,7 +215,7 @@ def editar_dispositivo_post(request, id):
 
 @login_required(login_url='login')
 def lista_dispositivos(request):
-    residente = _get_residente_or_redirect(request.user)
+    residente = _get_residente_or_redirect(request)
     if not residente:
         return redirect('dashboard')
 
@@ -270,11 +230,14 @@ def lista_dispositivos(request):
 
 @login_required(login_url='login')
 def apagar_dispositivo(request, id):
-    residente = _get_residente_or_redirect(request.user)
+    residente = _get_residente_or_redirect(request)
     dispositivo = get_object_or_404(Dispositivo, pk=id, residente=residente)
     try:
         with transaction.atomic():
-            RegistoConsumo.objects.filter(dispositivo=dispositivo).delete()
+            # Desconta o dispositivo do resumo mensal de uma vez, em vez de registo a registo
+            resumo.descontar_dispositivo(dispositivo)
+            with resumo.suspenso():
+                RegistoConsumo.objects.filter(dispositivo=dispositivo).delete()
             dispositivo.delete()
     except Exception as e:
         messages.error(request, f'Erro ao apagar dispositivo: {e}')
@@ -283,41 +246,132 @@ def apagar_dispositivo(request, id):
 
 @login_required(login_url='login')
 def registar_consumo(request):
-    residente = _get_residente_or_redirect(request.user)
+    residente = _get_residente_or_redirect(request)
     if request.method == 'POST':
         form = ConsumoManualForm(residente, request.POST)
         if form.is_valid():
             registo = form.save(commit=False)
             mes = int(form.cleaned_data['mes'])
             ano = int(form.cleaned_data['ano'])
-            registo.timestamp = datetime.datetime(ano, mes, 1, 12, 0, 0)
+            registo.timestamp = instante_do_mes(ano, mes)
             registo.save()
             messages.success(request, 'Consumo registado com sucesso!')
+            _verificar_leitura(request, registo)
             return redirect('registar_consumo')
     else:
         form = ConsumoManualForm(residente)
 
-    # Obtém histórico de registos (mais recentes primeiro)
-    historico = RegistoConsumo.objects.filter(dispositivo__residente=residente).order_by('-timestamp')
+    filtro, registos, proximo = _pagina_historico(request, residente)
     return render(request, 'Gestao_Consumos/registar_consumo.html', {
         'form': form,
-        'historico': historico,
+        'filtro': filtro,
+        'historico': registos,
+        'proximo': proximo,
+        'filtros_url': _filtros_url(filtro),
         'residente': residente
     })
 
+# Leitura muito diferente das anteriores do dispositivo (ex.: um zero a mais): fica sinalizada e o residente é avisado
+def _verificar_leitura(request, registo):
+    # Import local: o NumPy só é carregado quando há leituras a verificar (ver medir_arranque)
+    from . import anomalias
+    anomalia = anomalias.verificar(registo)
+    if anomalia:
+        messages.warning(
+            request, f'O valor {registo.valor} é muito diferente do habitual para {registo.dispositivo.nome} '
+                     f'(cerca de {anomalia.valor_habitual}). Confirme a leitura.'
+        )
+
+# Página do histórico (mais recentes primeiro) com os filtros do pedido GET
+def _pagina_historico(request, residente):
+    filtro = FiltroHistoricoForm(residente, request.GET)
+    filtros = filtro.cleaned_data if filtro.is_valid() else {}
+    registos = historico.registos_de(residente, **filtros)
+    linhas, proximo = historico.pagina(registos, request.GET.get('cursor'))
+    return filtro, linhas, proximo
+
+# Filtros ativos em formato querystring (para os links "mais antigos" e o pedido JSON)
+def _filtros_url(filtro):
+    if not filtro.is_valid():
+        return ''
+    valores = {nome: getattr(valor, 'pk', valor) for nome, valor in filtro.cleaned_data.items() if valor}
+    return urlencode(valores)
+
+# Versão JSON do histórico para o scroll infinito (?cursor=...&dispositivo=&tipo=&ano=)
+@login_required(login_url='login')
+def historico_consumos(request):
+    residente = _get_residente_or_redirect(request)
+    if not residente:
+        return JsonResponse({'erro': 'Residente não encontrado.'}, status=404)
+    _, registos, proximo = _pagina_historico(request, residente)
+    return JsonResponse({'registos': [historico.para_json(r) for r in registos], 'proximo': proximo})
+
+# Importação de leituras em massa (CSV lido em streaming e gravado em lotes)
+@login_required(login_url='login')
+def importar_consumos(request):
+    residente = _get_residente_or_redirect(request)
+    if not residente:
+        return redirect('dashboard')
+
+    resultado = None
+    if request.method == 'POST':
+        form = ImportarConsumosForm(request.POST, request.FILES)
+        if form.is_valid():
+            ficheiro = io.TextIOWrapper(form.cleaned_data['ficheiro'].file, encoding='utf-8-sig', newline='')
+            try:
+                resultado = Importador(residente=residente).importar(ler_csv(ficheiro))
+            except ValidationError as e:
+                form.add_error('ficheiro', e)
+            except UnicodeDecodeError:
+                form.add_error('ficheiro', 'O ficheiro tem de estar em UTF-8.')
+    else:
+        form = ImportarConsumosForm()
+
+    return render(request, 'Gestao_Consumos/importar_consumos.html', {
+        'form': form,
+        'resultado': resultado,
+        'erros': sorted(resultado.erros + resultado.conflitos)[:200] if resultado else [],
+        'residente': residente,
+        'dispositivos': Dispositivo.objects.filter(residente=residente, status=1),
+    })
+
+# API de ingestão para medidores/gateways (autenticação por chave: "Authorization: Token <chave>")
+# Sem sessão nem cookies, por isso não precisa de CSRF
+@csrf_exempt
+@require_POST
+def api_leituras(request):
+    chave = ingestao.autenticar(request.headers.get('Authorization'))
+    if chave is None:
+        return JsonResponse({'erro': 'Chave de acesso inválida ou revogada.'}, status=401)
+    try:
+        leituras = ingestao.ler_pedido(request.body)
+    except ingestao.PedidoInvalido as e:
+        return JsonResponse({'erro': str(e)}, status=e.status)
+    return JsonResponse(ingestao.ingerir(chave.residente, leituras))
+
+# Exportação do histórico completo do residente
+@login_required(login_url='login')
+def exportar_consumos(request):
+    residente = _get_residente_or_redirect(request)
+    if not residente:
+        return redirect('dashboard')
+    return _exportar(request, residente, cache_tarifas.linha_temporal(residente), f'consumos_{residente.pk}')
+
 @login_required(login_url='login')
 def editar_consumo(request, id):
-    registo = get_object_or_404(RegistoConsumo, pk=id)
-    residente = _get_residente_or_redirect(request.user)
+    residente = _get_residente_or_redirect(request)
+    registo = get_object_or_404(RegistoConsumo, pk=id, dispositivo__residente=residente)
     if request.method == 'POST':
         form = ConsumoManualForm(residente, request.POST, instance=registo)
         if form.is_valid():
             registo_editado = form.save(commit=False)
             mes = int(form.cleaned_data['mes'])
             ano = int(form.cleaned_data['ano'])
-            registo_editado.timestamp = datetime.datetime(ano, mes, 1, 12, 0, 0)
+            registo_editado.timestamp = instante_do_mes(ano, mes)
             registo_editado.save()
             messages.success(request, 'Atualizado com sucesso!')
+            # Uma correção retira a sinalização; uma edição com um valor fora do habitual passa a estar sinalizada
+            _verificar_leitura(request, registo_editado)
             return redirect('registar_consumo')
     else:
         dados_iniciais = {'mes': registo.timestamp.month, 'ano': registo.timestamp.year}
@@ -328,8 +382,10 @@ def editar_consumo(request, id):
 
 @login_required(login_url='login')
 def apagar_consumo(request, id):
-    registo = get_object_or_404(RegistoConsumo, pk=id)
-    if registo.dispositivo.residente.email == request.user.email:
+    residente = _get_residente_or_redirect(request)
+    # A posse é verificada na própria query (o dispositivo vem junto para o sinal do resumo)
+    registo = RegistoConsumo.objects.select_related('dispositivo').filter(pk=id, dispositivo__residente=residente).first()
+    if registo:
         registo.delete()
         messages.success(request, 'Registo eliminado.')
     return redirect('registar_consumo')
@@ -338,7 +394,7 @@ def apagar_consumo(request, id):
 
 @login_required(login_url='login')
 def definicoes(request):
-    residente = _get_residente_or_redirect(request.user)
+    residente = _get_residente_or_redirect(request)
     if not residente:
         return redirect('dashboard')
 
@@ -356,8 +412,10 @@ def definicoes(request):
 
 
 @login_required(login_url='login')
+# Responde 304 se os dados do residente não mudaram desde a última visita (ver versoes.py)
+@condition(etag_func=versoes.etag, last_modified_func=versoes.ultima_alteracao)
 def relatorios(request):
-    residente = _get_residente_or_redirect(request.user)
+    residente = _get_residente_or_redirect(request)
     if not residente:
         return redirect('dashboard')
 
@@ -371,8 +429,7 @@ def relatorios(request):
             exists = Orcamento_limite.objects.filter(
                 residente=residente,
                 tipo=form.cleaned_data['tipo'],
-                timestamp__month=form.cleaned_data['mes'],
-                timestamp__year=form.cleaned_data['ano']
+                **filtro_mes(form.cleaned_data['ano'], form.cleaned_data['mes'])
             ).exists()
             if exists:
                 return redirect(f"/relatorios/?ano={ano_selecionado}&mes={mes_selecionado}")
@@ -386,47 +443,50 @@ def relatorios(request):
     else:
         form = CriarMetaForm()
 
-    registos_base = RegistoConsumo.objects.filter(dispositivo__residente=residente)
-    registos_mes = registos_base.filter(timestamp__year=ano_selecionado, timestamp__month=mes_selecionado)
-
-    custos_mensais = calcular_custos_por_tipo(registos_mes, residente)
-    # Prepara dados do gráfico de distribuição
-    dados_distribuicao = {'labels': list(custos_mensais.keys()), 'data': list(custos_mensais.values())}
-
-    registos_ano = registos_base.filter(timestamp__year=ano_selecionado)
-    trend_data = {}
-    for mes_num in range(1, 13):
-        custos_mes_loop = calcular_custos_por_tipo(
-            registos_ano.filter(timestamp__month=mes_num), residente
-        )
-        trend_data[mes_num] = round(sum(custos_mes_loop.values()), 2)
+    calculado = cache_paginas.obter(
+        residente, 'relatorios', lambda: _calcular_relatorios(residente, ano_selecionado, mes_selecionado),
+        ano_selecionado, mes_selecionado
+    )
 
     MESES_NOMES_LIST = [MESES[i] for i in range(1, 13)]
-    # Prepara dados do gráfico de tendência 
-    dados_tendencia = {'labels': MESES_NOMES_LIST, 'data': [trend_data.get(m + 1, 0) for m in range(12)]}
-
-    historico_metas = Orcamento_limite.objects.filter(residente=residente).order_by('-timestamp')
-
     return render(request, 'Gestao_Consumos/relatorios.html', {
         'residente': residente,
         'form': form,
-        'metas': historico_metas,
         'ano_atual': ano_selecionado,
         'mes_atual': mes_selecionado,
         'nome_mes_atual': nome_mes_atual,
         
         'anos_range': range(2025, 2031),
         'meses_nomes': [(i + 1, MESES_NOMES_LIST[i]) for i in range(12)],
+        **calculado,
+    })
+
+def _calcular_relatorios(residente, ano_selecionado, mes_selecionado):
+    # Histórico de tarifas/contratos carregado uma vez para o mês e para a série anual
+    tarifas = cache_tarifas.linha_temporal(residente)
+    custos_mensais = calcular_custos(residente, ano_selecionado, mes_selecionado, tarifas)['custos']
+    # Prepara dados do gráfico de distribuição
+    dados_distribuicao = {'labels': list(custos_mensais.keys()), 'data': list(custos_mensais.values())}
+
+    serie_anual = calcular_serie_anual(residente, ano_selecionado, tarifas)
+
+    # Prepara dados do gráfico de tendência 
+    dados_tendencia = {'labels': [MESES[i] for i in range(1, 13)], 'data': [mes['custo_total'] for mes in serie_anual]}
+
+    historico_metas = list(Orcamento_limite.objects.filter(residente=residente).select_related('tipo').order_by('-timestamp'))
+
+    return {
+        'metas': historico_metas,
         'dados_distribuicao_json': json.dumps(dados_distribuicao),
         'dados_tendencia_json': json.dumps(dados_tendencia),
-    })
+    }
 
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
 @login_required(login_url='login')
 def editar_meta(request, id):
-    residente = _get_residente_or_redirect(request.user)
+    residente = _get_residente_or_redirect(request)
     meta = get_object_or_404(Orcamento_limite, pk=id, residente=residente)
     if request.method == 'POST':
         form = EditarMetaForm(request.POST, instance=meta)
@@ -445,28 +505,29 @@ def editar_meta(request, id):
 
 @login_required(login_url='login')
 def apagar_meta(request, id):
-    residente = _get_residente_or_redirect(request.user)
+    residente = _get_residente_or_redirect(request)
     meta = get_object_or_404(Orcamento_limite, pk=id, residente=residente)
     meta.delete()
     return redirect('relatorios')
 
 
 @login_required(login_url='login')
+# Responde 304 se os dados do residente não mudaram desde a última visita (ver versoes.py)
+@condition(etag_func=versoes.etag, last_modified_func=versoes.ultima_alteracao)
 def gerar_pdf(request, tipo, ano, mes):
-    residente = _get_residente_or_redirect(request.user)
+    residente = _get_residente_or_redirect(request)
     if not residente:
         return redirect('dashboard')
 
-    registos_base_geral = RegistoConsumo.objects.filter(dispositivo__residente=residente, timestamp__year=ano)
+    tarifas = cache_tarifas.linha_temporal(residente)
 
     metas_ano_dict = {
         (m.timestamp.month, m.tipo.tipo): float(m.valor)
-        for m in Orcamento_limite.objects.filter(residente=residente, timestamp__year=ano)
+        for m in Orcamento_limite.objects.filter(residente=residente, **filtro_ano(ano)).select_related('tipo')
     }
 
     if tipo == 'mensal':
-        registos_mensais = registos_base_geral.filter(timestamp__month=mes)
-        custos_calculados = calcular_custos_por_tipo(registos_mensais, residente)
+        custos_calculados = calcular_custos(residente, ano, mes, tarifas)['custos']
         alerta_status = {}
         for utilidade, custo_real in custos_calculados.items():
             meta = metas_ano_dict.get((mes, utilidade), 0.00)
@@ -492,9 +553,9 @@ def gerar_pdf(request, tipo, ano, mes):
     elif tipo == 'anual':
         relatorio_anual_detalhado = []
         custo_anual_total = 0.0
-        for m in range(1, 13):
-            registos_mensais = registos_base_geral.filter(timestamp__month=m)
-            custos_mensais = calcular_custos_por_tipo(registos_mensais, residente)
+        for dados_mes in calcular_serie_anual(residente, ano, tarifas):
+            m = dados_mes['mes']
+            custos_mensais = dados_mes['custos']
 
             detalhe_mensal = {'mes_nome': MESES.get(m, 'Mês Desconhecido'), 'custo_total_mes': 0.0, 'utilidades': []}
             tem_dados_no_mes = False
@@ -529,43 +590,75 @@ def gerar_pdf(request, tipo, ano, mes):
         return HttpResponse("Tipo de relatório inválido.", status=400)
 
     html_string = render_to_string('Gestao_Consumos/relatorio_base.html', contexto_pdf)
-    html = HTML(string=html_string)
-    pdf = html.write_pdf()
 
     nome_ficheiro = f"Relatorio_{tipo}_{ano}"
     if tipo == 'mensal':
         nome_ficheiro += f"_{mes}"
 
-    response = HttpResponse(pdf, content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="{nome_ficheiro}.pdf"'
-    return response
+    # O PDF é gerado em segundo plano; se já existir um igual é devolvido de imediato
+    chave = relatorios_pdf.pedir(residente, html_string, f"{nome_ficheiro}.pdf", tipo, ano, mes)
+    if relatorios_pdf.estado(residente, chave) == relatorios_pdf.PRONTO:
+        return _servir_pdf(residente, chave)
+    # O redirecionamento para a página de espera não pode ficar em cache (ainda não há PDF)
+    resposta = redirect('estado_pdf', chave=chave)
+    resposta['Cache-Control'] = 'no-store'
+    return resposta
+
+
+@login_required(login_url='login')
+def estado_pdf(request, chave):
+    residente = _get_residente_or_redirect(request)
+    if not residente:
+        return redirect('dashboard')
+
+    estado = relatorios_pdf.estado(residente, chave)
+    url_pdf = reverse('descarregar_pdf', args=[chave])
+
+    if request.GET.get('formato') == 'json':
+        return JsonResponse({
+            'estado': estado,
+            'url': url_pdf if estado == relatorios_pdf.PRONTO else None,
+            'erro': relatorios_pdf.erro(residente, chave) if estado == relatorios_pdf.ERRO else None,
+        })
+
+    if estado == relatorios_pdf.PRONTO:
+        return redirect(url_pdf)
+    if estado != relatorios_pdf.EM_CURSO:
+        messages.error(request, 'Não foi possível gerar o relatório. Tente novamente.')
+        return redirect('relatorios')
+
+    return render(request, 'Gestao_Consumos/relatorio_pdf_estado.html', {'residente': residente, 'chave': chave})
+
+
+# O ficheiro de uma chave nunca muda (a chave é o hash do conteúdo): a própria chave serve de ETag
+@login_required(login_url='login')
+@condition(etag_func=lambda request, chave: chave)
+def descarregar_pdf(request, chave):
+    residente = _get_residente_or_redirect(request)
+    if not residente:
+        return redirect('dashboard')
+    return _servir_pdf(residente, chave)
+
+def _servir_pdf(residente, chave):
+    relatorio = relatorios_pdf.obter(residente, chave)
+    if relatorio is None:
+        raise Http404("Relatório não encontrado.")
+    caminho_pdf, metadados = relatorio
+    return FileResponse(open(caminho_pdf, 'rb'), as_attachment=True,
+                        filename=metadados['nome_ficheiro'], content_type='application/pdf')
 
 
 @login_required(login_url='login')
 def lista_fornecedores(request):
-    residente = _get_residente_or_redirect(request.user)
-    fornecedores_data = []
-    for fornecedor in Fornecedor.objects.filter(status=1):
-        servicos_data = []
-        servicos_oferecidos = FornecedorTipo.objects.filter(fornecedor=fornecedor, status=1)
-        for servico in servicos_oferecidos:
-            servicos_data.append({
-                'servico_tipo': servico.tipo.tipo,
-                'tarifa_valor': get_latest_price(servico),
-                'unidade': servico.unidade,
-                'fornecedor_tipo_pk': servico.pk,
-            })
-        if servicos_data:
-            fornecedores_data.append({'info': {'id': fornecedor.pk, 'nome': fornecedor.nome}, 'servicos': servicos_data})
-
-    contrato_luz = get_active_contract(residente, 'Luz')
-    contrato_agua = get_active_contract(residente, 'Agua')
-    contrato_gas = get_active_contract(residente, 'Gas')
+    residente = _get_residente_or_redirect(request)
+    # Catálogo partilhado em cache (invalidado pelos sinais de fornecedores/serviços/tarifas)
+    fornecedores_data = cache_tarifas.catalogo()
+
+    contratos = cache_tarifas.contratos_ativos(residente.pk)
 
     residente_fornecedores = {
-        'Luz': contrato_luz.fornecedor_tipo.fornecedor.pk if contrato_luz else None,
-        'Agua': contrato_agua.fornecedor_tipo.fornecedor.pk if contrato_agua else None,
-        'Gas': contrato_gas.fornecedor_tipo.fornecedor.pk if contrato_gas else None,
+        tipo_nome: contratos[tipo_nome]['fornecedor'] if tipo_nome in contratos else None
+        for tipo_nome in ('Luz', 'Agua', 'Gas')
     }
 
     return render(request, 'Gestao_Consumos/fornecedores.html', {
@@ -581,7 +674,7 @@ def associar_fornecedor(request):
         return redirect('lista_fornecedores')
 
     fornecedor_tipo_pk = request.POST.get('fornecedor_tipo_pk')
-    residente = _get_residente_or_redirect(request.user)
+    residente = _get_residente_or_redirect(request)
     fornecedor_tipo_obj = FornecedorTipo.objects.get(pk=fornecedor_tipo_pk)
     servico_tipo = fornecedor_tipo_obj.tipo.tipo
     with transaction.atomic():
@@ -597,6 +690,8 @@ def associar_fornecedor(request):
             status=1,
             timestamp=datetime.datetime.now()
         )
+        # O update() acima não dispara sinais: invalida os contratos em cache depois do commit
+        transaction.on_commit(lambda: cache_tarifas.invalidar_contratos(residente.pk))
     messages.success(
         request,
         f"O seu fornecedor de {servico_tipo} foi atualizado para {fornecedor_tipo_obj.fornecedor.nome}."
@@ -606,29 +701,148 @@ def associar_fornecedor(request):
 def is_superuser_check(user):
     return user.is_superuser
 
+RESIDENTES_POR_PAGINA = 25
+COLUNAS_RESIDENTES = ('nome', 'email', 'cidade', 'status')
+
 
 @user_passes_test(is_superuser_check)
 def gerir_utilizadores(request):
-   
-    emails_root = User.objects.filter(is_superuser=True).values_list('email', flat=True)
+    pesquisa = request.GET.get('q', '').strip()
+    ordem = request.GET.get('ordem', 'nome')
+    if ordem.lstrip('-') not in COLUNAS_RESIDENTES:
+        ordem = 'nome'
 
+    # Alertas de orçamento do mês atual (gravados por avaliar_orcamentos e pelo dashboard)
+    hoje = datetime.date.today()
+    apenas_excedidos = request.GET.get('excedido') == '1'
 
-    residentes = Residente.objects.exclude(email__in=emails_root).order_by('nome')
-    
+    residentes = _residentes_geridos()
+    if pesquisa:
+        residentes = residentes.filter(
+            Q(nome__icontains=pesquisa) | Q(email__icontains=pesquisa) | Q(cidade__icontains=pesquisa)
+        )
+    if apenas_excedidos:
+        residentes = residentes.filter(
+            alertaorcamento__ano=hoje.year, alertaorcamento__mes=hoje.month,
+            alertaorcamento__estado=AlertaOrcamento.EXCEDIDO
+        )
+    # Contratos ativos e alertas de todos os residentes da página (uma query cada)
+    residentes = residentes.order_by(ordem, 'pk').prefetch_related(Prefetch(
+        'fornecedorresidente_set',
+        queryset=FornecedorResidente.objects.filter(status=1).select_related('fornecedor_tipo__fornecedor', 'fornecedor_tipo__tipo'),
+        to_attr='contratos_ativos'
+    ), Prefetch(
+        'alertaorcamento_set',
+        queryset=AlertaOrcamento.objects.filter(ano=hoje.year, mes=hoje.month, estado=AlertaOrcamento.EXCEDIDO),
+        to_attr='alertas_excedidos'
+    ))
+    pagina = Paginator(residentes, RESIDENTES_POR_PAGINA).get_page(request.GET.get('pagina'))
+
+    for r in pagina:
+        r.lista_empresas = [f"{c.fornecedor_tipo.fornecedor.nome} ({c.fornecedor_tipo.tipo.tipo})" for c in r.contratos_ativos]
+
+    # Links das colunas: clicar na coluna já ordenada inverte a ordem
+    filtros = {'q': pesquisa, 'excedido': '1' if apenas_excedidos else ''}
+    ordenacao_urls = {
+        coluna: '?' + urlencode({**filtros, 'ordem': f'-{coluna}' if ordem == coluna else coluna})
+        for coluna in COLUNAS_RESIDENTES
+    }
+    return render(request, 'Gestao_Consumos/gerir_utilizadores.html', {
+        'residentes': pagina,
+        'pagina': pagina,
+        'pesquisa': pesquisa,
+        'ordem': ordem,
+        'apenas_excedidos': apenas_excedidos,
+        'ordenacao_urls': ordenacao_urls,
+        'filtros_url': urlencode({**filtros, 'ordem': ordem}),
+    })
 
-    for r in residentes:
-        contratos = FornecedorResidente.objects.filter(residente=r, status=1)
-        lista_fornecedores = []
-        for c in contratos:
-            nome = c.fornecedor_tipo.fornecedor.nome
-            tipo = c.fornecedor_tipo.tipo.tipo
-            lista_fornecedores.append(f"{nome} ({tipo})")
-        
-        r.lista_empresas = lista_fornecedores
+# Ativa/bloqueia vários residentes de uma vez (Residente.status e User.is_active com dois UPDATE)
+@user_passes_test(is_superuser_check)
+@require_POST
+def alterar_estado_residentes(request):
+    acao = request.POST.get('acao')
+    ids = [int(i) for i in request.POST.getlist('residentes') if i.isdigit()]
+    if acao not in ('ativar', 'bloquear') or not ids:
+        messages.warning(request, 'Selecione pelo menos um residente e uma ação.')
+    else:
+        alterados = _definir_estado_residentes(_residentes_geridos().filter(pk__in=ids), 1 if acao == 'ativar' else 0)
+        messages.success(request, f"{alterados} residente(s) {'ativado(s)' if acao == 'ativar' else 'bloqueado(s)'}.")
 
-    return render(request, 'Gestao_Consumos/gerir_utilizadores.html', {
-        'residentes': residentes
+    destino = reverse('gerir_utilizadores')
+    if request.POST.get('filtros'):
+        destino += '?' + request.POST['filtros']
+    return redirect(destino)
+
+# Residentes geridos no painel (as contas de administrador ficam de fora)
+def _residentes_geridos():
+    return Residente.objects.exclude(email__in=User.objects.filter(is_superuser=True).values('email'))
+
+def _definir_estado_residentes(residentes, status):
+    with transaction.atomic():
+        alterados = residentes.update(status=status)
+        User.objects.filter(
+            Q(residente__in=residentes) | Q(email__in=residentes.values('email')), is_superuser=False
+        ).update(is_active=status == 1)
+    return alterados
+# Exportação de todos os residentes (auditoria): a tabela é lida por blocos, nunca inteira
+@user_passes_test(is_superuser_check)
+def exportar_consumos_todos(request):
+    return _exportar(request, None, None, 'consumos_todos')
+
+ANALISE_AGRUPAR_POR_OMISSAO = ['cidade', 'mes']
+
+# Consumo e custo de todos os residentes agrupados por cidade/código postal/tipo/categoria/mês (?formato=csv)
+@user_passes_test(is_superuser_check)
+def analise_consumos(request):
+    parametros = request.GET.copy()
+    if not parametros:
+        parametros.setlist('agrupar', ANALISE_AGRUPAR_POR_OMISSAO)
+    filtro = FiltroAnaliseForm(parametros)
+    if not filtro.is_valid():
+        return render(request, 'Gestao_Consumos/analise_consumos.html', {'filtro': filtro, 'linhas': []})
+
+    agrupar, linhas = analise.agregar(
+        filtro.cleaned_data['agrupar'], filtro.cleaned_data['desde'], filtro.cleaned_data['ate']
+    )
+    if parametros.get('formato') == 'csv':
+        resposta = HttpResponse(analise.em_csv(agrupar, linhas), content_type='text/csv; charset=utf-8')
+        resposta['Content-Disposition'] = f'attachment; filename="analise_consumos_{datetime.date.today():%Y%m%d}.csv"'
+        return resposta
+
+    parametros['formato'] = 'csv'
+    return render(request, 'Gestao_Consumos/analise_consumos.html', {
+        'filtro': filtro,
+        'colunas': [analise.AGRUPAMENTOS[nome] for nome in agrupar],
+        'linhas': linhas[:analise.LINHAS_NO_ECRA],
+        'total_linhas': len(linhas),
+        'custo_total': round(sum(linha['custo'] for linha in linhas), 2),
+        'csv_url': '?' + parametros.urlencode(),
     })
+
+# Contadores das caches de tarifas/contratos e das páginas (hits/misses) deste processo
+@user_passes_test(is_superuser_check)
+def estatisticas_cache(request):
+    return JsonResponse({'tarifas': cache_tarifas.estatisticas(), 'paginas': cache_paginas.estatisticas()})
+
+# Percentis por vista (tempo total, BD, queries, templates) medidos pelo MetricasMiddleware neste processo
+@user_passes_test(is_superuser_check)
+def painel_metricas(request):
+    dados = metricas.resumo()
+    if request.GET.get('formato') == 'json':
+        return JsonResponse(dados)
+    if request.method == 'POST':
+        metricas.limpar()
+        messages.success(request, 'Métricas reiniciadas.')
+        return redirect('painel_metricas')
+    vistas = sorted(dados['vistas'].items(), key=lambda item: item[1]['total_ms']['p95'], reverse=True)
+    return render(request, 'Gestao_Consumos/metricas.html', {
+        'vistas': vistas,
+        'segundo_plano': dados['segundo_plano'],
+        'limiar_ms': getattr(settings, 'METRICAS_PEDIDO_LENTO_MS', 500),
+    })
+
+
 @user_passes_test(is_superuser_check)
 def alterar_estado_residente(request, id_residente):
     residente = get_object_or_404(Residente, pk=id_residente)
@@ -639,7 +853,7 @@ def alterar_estado_residente(request, id_residente):
     residente.save()
     
     try:
-        user_django = User.objects.get(email=residente.email)
+        user_django = residente.utilizador or User.objects.get(email=residente.email)
         user_django.is_active = True if novo_status == 1 else False
         user_django.save()
         msg_tipo = "Ativado" if novo_status == 1 else "Bloqueado"
@@ -30,11 +30,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'Gestao_Consumos.middleware.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'Gestao_Consumos.middleware.ResidenteMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -43,7 +45,7 @@ ROOT_URLCONF = 'Projeto_appw.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'Gestao_Consumos.metricas.TemplatesInstrumentados',
         'DIRS': [BASE_DIR / 'Gestao_Consumos' / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -89,6 +91,52 @@ DATABASES = {
     }
 }
 
+#Cache usada para tarifas/contratos (ver Gestao_Consumos/cache_tarifas.py)
+#Em memória local por omissão; para vários workers usar um backend partilhado,
+#por exemplo 'django.core.cache.backends.redis.RedisCache' com LOCATION 'redis://127.0.0.1:6379'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'gestao-consumos',
+    }
+}
+TARIFAS_CACHE_ALIAS = 'default'
+
+#Cache dos cálculos do dashboard/relatórios por residente (ver Gestao_Consumos/cache_paginas.py)
+#Alias próprio para não expulsar as tarifas; em memória local por omissão (testes/desenvolvimento).
+#Em produção, com vários workers, usar uma cache partilhada, por exemplo:
+#{'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': BASE_DIR / 'cache_paginas'}
+CACHES['paginas'] = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'gestao-consumos-paginas',
+}
+PAGINAS_CACHE_ALIAS = 'paginas'
+
+#Relatórios PDF: gerados em segundo plano e guardados em disco (chave = hash do conteúdo)
+RELATORIOS_PDF_DIR = BASE_DIR / 'relatorios_pdf'
+RELATORIOS_PDF_WORKERS = 2
+#Segundos até um pedido de PDF pendente ser considerado abandonado (worker reiniciado a meio)
+RELATORIOS_PDF_PRAZO = 600
+#True em processos dedicados a PDFs: o wsgi.py carrega o WeasyPrint ao arrancar
+RELATORIOS_PDF_AQUECER = False
+
+#Métricas por pedido (Server-Timing, pedidos lentos no log e percentis em admin-painel/metricas/)
+METRICAS_PEDIDO_LENTO_MS = 500
+METRICAS_SERVER_TIMING = True
+#Amostras guardadas por vista (as mais recentes) para calcular os percentis
+METRICAS_AMOSTRAS = 1000
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'Gestao_Consumos': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 
 LANGUAGE_CODE = 'pt-pt'
 TIME_ZONE = 'Europe/Lisbon'
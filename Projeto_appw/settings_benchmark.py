@@ -0,0 +1,13 @@
+#Definições para os benchmarks em SQLite:
+#python manage.py benchmark_vistas --settings=Projeto_appw.settings_benchmark
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'benchmark.sqlite3',
+    }
+}
+
+#Os relatórios gerados nos benchmarks não se misturam com os verdadeiros
+RELATORIOS_PDF_DIR = BASE_DIR / 'relatorios_pdf_benchmark'
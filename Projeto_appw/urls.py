@@ -1,5 +1,5 @@
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, re_path
 from django.contrib.auth import views as auth_views
 from Gestao_Consumos import views 
 
@@ -18,6 +18,10 @@ urlpatterns = [
 
     path('definicoes/', views.definicoes, name='definicoes'),
     path('registar-consumo/', views.registar_consumo, name='registar_consumo'),
+    path('registar-consumo/importar/', views.importar_consumos, name='importar_consumos'),
+    path('registar-consumo/historico/', views.historico_consumos, name='historico_consumos'),
+    path('registar-consumo/exportar/', views.exportar_consumos, name='exportar_consumos'),
+    path('api/leituras/', views.api_leituras, name='api_leituras'),
     path('editar-consumo/<int:id>/', views.editar_consumo, name='editar_consumo'),
     path('apagar-consumo/<int:id>/', views.apagar_consumo, name='apagar_consumo'),
 
@@ -25,10 +29,17 @@ urlpatterns = [
     path('editar-meta/<int:id>/', views.editar_meta, name='editar_meta'),
     path('apagar-meta/<int:id>/', views.apagar_meta, name='apagar_meta'),
     path('relatorios/pdf/<str:tipo>/<int:ano>/<int:mes>/', views.gerar_pdf, name='gerar_pdf'),
+    re_path(r'^relatorios/pdf/estado/(?P<chave>[0-9a-f]{64})/$', views.estado_pdf, name='estado_pdf'),
+    re_path(r'^relatorios/pdf/descarregar/(?P<chave>[0-9a-f]{64})/$', views.descarregar_pdf, name='descarregar_pdf'),
 
     path('fornecedores/', views.lista_fornecedores, name='lista_fornecedores'),
     path('associar-fornecedor/', views.associar_fornecedor, name='associar_fornecedor'),
 
     path('admin-painel/utilizadores/', views.gerir_utilizadores, name='gerir_utilizadores'),
+    path('admin-painel/alterar-estado/', views.alterar_estado_residentes, name='alterar_estado_residentes'),
     path('admin-painel/alterar-estado/<int:id_residente>/', views.alterar_estado_residente, name='alterar_estado_residente'),
+    path('admin-painel/exportar/', views.exportar_consumos_todos, name='exportar_consumos_todos'),
+    path('admin-painel/analise/', views.analise_consumos, name='analise_consumos'),
+    path('admin-painel/cache/', views.estatisticas_cache, name='estatisticas_cache'),
+    path('admin-painel/metricas/', views.painel_metricas, name='painel_metricas'),
 ]
\ No newline at end of file
@@ -4,3 +4,9 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Projeto_appw.settings')
 application = get_wsgi_application()
+
+# Workers dedicados a PDFs carregam o WeasyPrint logo ao arrancar (ver RELATORIOS_PDF_AQUECER)
+from django.conf import settings
+if getattr(settings, 'RELATORIOS_PDF_AQUECER', False):
+    from Gestao_Consumos import relatorios_pdf
+    relatorios_pdf.aquecer_workers()